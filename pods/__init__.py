@@ -1,4 +1,16 @@
-from . import datasets
-from . import mocap
-from . import access
-from . import util
+# The submodules are imported the first time they are used, so that
+# "import pods" stays cheap for callers that only need part of the package
+# (pods.datasets pulls in pandas and scipy).
+import importlib
+
+__all__ = ["access", "catalog", "datasets", "mocap", "util"]
+
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module("." + name, __name__)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
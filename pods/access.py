@@ -4,7 +4,13 @@ import sys
 import os
 
 import json
-import yaml
+import hashlib
+import struct
+import threading
+import http.client
+from collections.abc import Mapping, MutableMapping
+from contextlib import closing
+from types import MappingProxyType
 
 import logging
 
@@ -20,269 +26,2886 @@ from .config import *
 DATAPATH = os.path.expanduser(os.path.expandvars(config.get("datasets", "dir")))
 overide_manual_authorize = False
 
-# Read data resources from json file.
-# Don't do this when ReadTheDocs is scanning as it breaks things
+class LazyJSON(MutableMapping):
+    """A dictionary that is read from a json file the first time it is used.
+
+    Importing pods then doesn't pay for parsing files that the process
+    never looks at. Once read, the dictionary can be changed like any
+    other."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self._data = None
+
+    @property
+    def data(self):
+        if self._data is None:
+            with self.lock:
+                if self._data is None:
+                    from io import open as iopen
+
+                    with iopen(self.filename, encoding="utf-8") as f:
+                        self._data = json.load(f)
+        return self._data
+
+    def loaded(self):
+        """Check if the file has been read yet."""
+        return self._data is not None
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+
+    def __delitem__(self, key):
+        del self.data[key]
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __repr__(self):
+        return "LazyJSON(" + repr(self.filename) + ")"
+
+    def copy(self):
+        return dict(self.data)
+
+    def clear(self):
+        self.data.clear()
+
+
+REGISTRY_MAGIC = b"PODSREG1"
+
+
+def registry_path(source):
+    """Return where the compiled form of a data resources json file is kept."""
+    return os.path.splitext(source)[0] + ".idx"
+
+
+def compile_registry(source=None, target=None):
+    """Compile a data resources json file into an indexed binary file.
+
+    The file holds a magic number, the length of a json header, the header
+    and then each entry as compact json. The header records the size,
+    modification time and SHA-256 digest of the source, to tell when the
+    file is out of date, and the offset and length of each entry, so
+    entries can be decoded one at a time.
+
+    :param source: the json file, data_resources.json by default.
+    :param target: the file to write, by default the source with an .idx extension.
+    """
+    if source is None:
+        source = data_resources.filename
+    if target is None:
+        target = registry_path(source)
+    stat = os.stat(source)
+    with open(source, "rb") as f:
+        contents = f.read()
+    resources = json.loads(contents.decode("utf-8"))
+    index = {}
+    entries = []
+    offset = 0
+    for name, entry in resources.items():
+        blob = json.dumps(entry, separators=(",", ":")).encode("utf-8")
+        index[name] = [offset, len(blob)]
+        entries.append(blob)
+        offset += len(blob)
+    header = json.dumps(
+        {
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "sha256": hashlib.sha256(contents).hexdigest(),
+            "index": index,
+        },
+        separators=(",", ":"),
+    ).encode("utf-8")
+    tmp_name = target + "." + str(os.getpid()) + ".tmp"
+    with open(tmp_name, "wb") as f:
+        f.write(REGISTRY_MAGIC)
+        f.write(struct.pack(">I", len(header)))
+        f.write(header)
+        f.writelines(entries)
+    os.replace(tmp_name, target)
+    return target
+
+
+def compile_registry_main(argv=None):
+    """Command line interface to compile_registry, installed as pods-compile-registry."""
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog="pods-compile-registry",
+        description="Compile the data resources into the indexed form pods reads at run time.",
+    )
+    parser.add_argument("source", nargs="?", default=None, help="json file to compile, the installed data_resources.json if not given")
+    parser.add_argument("-o", "--output", default=None, help="file to write, the source with an .idx extension if not given")
+    args = parser.parse_args(argv)
+    print("Wrote " + compile_registry(args.source, args.output))
+    return 0
+
+
+class Registry(MutableMapping):
+    """The data resources, decoded an entry at a time from the compiled registry.
+
+    Opening the registry reads the compiled file and its index, and each
+    entry is only decoded when it is first looked up. If the compiled file
+    is missing or was compiled from a different json source it is compiled
+    again, and if
+    that isn't possible (for example the package directory is read only)
+    the json source is parsed instead. Entries can be changed, added and
+    removed like in any other dictionary; the changes are kept in memory."""
+
+    def __init__(self, filename, compiled=None):
+        self.filename = filename
+        self.compiled = registry_path(filename) if compiled is None else compiled
+        self.lock = threading.Lock()
+        self._index = None
+        self._blob = b""
+        self._entries = {}
+        self._deleted = set()
+
+    def _read_compiled(self):
+        """Read the compiled registry, returning None if it is missing, damaged or out of date."""
+        try:
+            with open(self.compiled, "rb") as f:
+                contents = f.read()
+        except OSError:
+            return None
+        start = len(REGISTRY_MAGIC) + 4
+        if not contents.startswith(REGISTRY_MAGIC) or len(contents) < start:
+            return None
+        (header_length,) = struct.unpack(">I", contents[len(REGISTRY_MAGIC) : start])
+        try:
+            header = json.loads(contents[start : start + header_length].decode("utf-8"))
+        except ValueError:
+            return None
+        try:
+            stat = os.stat(self.filename)
+        except OSError:
+            # Only the compiled registry was shipped.
+            stat = None
+        if stat is not None and (header["mtime_ns"], header["size"]) != (stat.st_mtime_ns, stat.st_size):
+            # Installers don't keep modification times, so a source of the
+            # same size is compared by its contents before compiling again.
+            if header["size"] != stat.st_size or header.get("sha256") != file_sha256(self.filename).hexdigest():
+                return None
+        return header["index"], contents[start + header_length :]
+
+    def _open(self):
+        compiled = self._read_compiled()
+        if compiled is None:
+            try:
+                compile_registry(self.filename, self.compiled)
+                compiled = self._read_compiled()
+            except OSError as e:
+                logging.info("Registry: could not compile " + self.filename + ": " + str(e))
+        if compiled is None:
+            with open(self.filename, encoding="utf-8") as f:
+                resources = json.load(f)
+            self._entries.update(resources)
+            return dict.fromkeys(resources)
+        self._blob = compiled[1]
+        return compiled[0]
+
+    @property
+    def index(self):
+        if self._index is None:
+            with self.lock:
+                if self._index is None:
+                    self._index = self._open()
+        return self._index
+
+    def loaded(self):
+        """Check if the registry has been opened yet."""
+        return self._index is not None
+
+    def __getitem__(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            return entry
+        index = self.index
+        if key in self._deleted or key not in index:
+            raise KeyError(key)
+        with self.lock:
+            if key not in self._entries:
+                offset, length = index[key]
+                self._entries[key] = json.loads(self._blob[offset : offset + length].decode("utf-8"))
+            return self._entries[key]
+
+    def __setitem__(self, key, value):
+        self.index
+        self._entries[key] = value
+        self._deleted.discard(key)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._entries.pop(key, None)
+        self._deleted.add(key)
+
+    def __contains__(self, key):
+        return key in self._entries or (key in self.index and key not in self._deleted)
+
+    def __iter__(self):
+        index = self.index
+        names = [name for name in index if name not in self._deleted]
+        names += [name for name in list(self._entries) if name not in index]
+        return iter(names)
+
+    def __len__(self):
+        return sum(1 for name in self)
+
+    def __repr__(self):
+        return "Registry(" + repr(self.filename) + ")"
+
+    def copy(self):
+        return dict(self)
+
+    def clear(self):
+        for name in list(self):
+            del self[name]
+
+
+# The data resources and football teams are read when they are first used.
+# ReadTheDocs never uses them, so scanning the module doesn't break things.
 on_rtd = os.environ.get("READTHEDOCS", None) == "True"  # Checks if RTD is scanning
 
-if not (on_rtd):
-    path = os.path.join(os.path.dirname(__file__), "data_resources.json")
-    from io import open as iopen
+data_resources = Registry(os.path.join(os.path.dirname(__file__), "data_resources.json"))
+football_dict = LazyJSON(os.path.join(os.path.dirname(__file__), "football_teams.json"))
+
+
+    
+def prompt_stdin(prompt):
+    """Ask user for agreeing to data set licenses."""
+    # raw_input returns the empty string for "enter"
+    yes = set(["yes", "y"])
+    no = set(["no", "n"])
+
+    try:
+        print(prompt)
+        if sys.version_info >= (3, 0):
+            choice = input().lower()
+        else:
+            choice = raw_input().lower()
+        # would like to test for which exceptions here
+    except:
+        print("Stdin is not implemented.")
+        print("You need to set")
+        print("overide_manual_authorize=True")
+        print("to proceed with the download. Please set that variable and continue.")
+        raise 
+
+    if choice in yes:
+        return True
+    elif choice in no:
+        return False
+    else:
+        print("Your response was a " + choice)
+        print("Please respond with 'yes', 'y' or 'no', 'n'")
+
+class HTTPSession(object):
+    """Keep alive HTTP connections so that downloads from the same host reuse them.
+
+    Idle connections are pooled per scheme, host and port and can be
+    shared by several threads. Urls with other schemes, or that should go
+    through a proxy, are left to urlopen."""
+
+    def __init__(self, max_idle=8, max_redirects=10):
+        self.max_idle = max_idle
+        self.max_redirects = max_redirects
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, key):
+        """Return an idle connection for the key or open a new one and say whether it was reused."""
+        with self.lock:
+            connections = self.idle.get(key)
+            if connections:
+                return connections.pop(), True
+        scheme, host, port = key
+        if scheme == "https":
+            import ssl
+
+            return http.client.HTTPSConnection(host, port, context=ssl.create_default_context()), False
+        return http.client.HTTPConnection(host, port), False
+
+    def release(self, key, connection):
+        """Put a connection back in the pool once its response has been read."""
+        with self.lock:
+            connections = self.idle.setdefault(key, [])
+            if len(connections) < self.max_idle:
+                connections.append(connection)
+                return
+        connection.close()
+
+    def clear(self):
+        """Close all the idle connections."""
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+    def request(self, url, headers={}):
+        """Send a GET request for the url, following redirects.
+
+        Returns None if the url isn't one the session handles."""
+        from urllib.parse import urlsplit, urljoin
+        from urllib.request import getproxies, proxy_bypass
+
+        for redirect in range(self.max_redirects + 1):
+            parts = urlsplit(url)
+            if parts.scheme not in ("http", "https") or not parts.hostname:
+                return None
+            if parts.scheme in getproxies() and not proxy_bypass(parts.hostname):
+                return None
+            key = (parts.scheme, parts.hostname, parts.port)
+            path = parts.path or "/"
+            if parts.query:
+                path += "?" + parts.query
+            request_headers = {"User-Agent": "Python-urllib/%d.%d" % sys.version_info[:2]}
+            request_headers.update(headers)
+            while True:
+                connection, reused = self.acquire(key)
+                try:
+                    connection.request("GET", path, headers=request_headers)
+                    response = connection.getresponse()
+                except (http.client.HTTPException, OSError):
+                    connection.close()
+                    if reused:
+                        # The server has closed the idle connection, try a new one.
+                        continue
+                    raise
+                break
+            session_response = SessionResponse(self, key, connection, response, url)
+            location = response.getheader("Location")
+            if response.status in (301, 302, 303, 307, 308) and location:
+                session_response.read()
+                session_response.close()
+                url = urljoin(url, location)
+                continue
+            return session_response
+        raise ValueError("Tried url " + url + " and was redirected too many times")
+
+
+class SessionResponse(object):
+    """A response from an HTTPSession that returns its connection to the pool once read."""
+
+    def __init__(self, session, key, connection, response, url):
+        self.session = session
+        self.key = key
+        self.connection = connection
+        self.response = response
+        self.url = url
+
+    def info(self):
+        return self.response.msg
+
+    def getcode(self):
+        return self.response.status
+
+    def geturl(self):
+        return self.url
+
+    def read(self, amt=None):
+        buff = self.response.read(amt)
+        if not buff or self.response.isclosed():
+            self.close()
+        return buff
+
+    def close(self):
+        if self.connection is None:
+            return
+        connection, self.connection = self.connection, None
+        response = self.response
+        if (
+            response.isclosed()
+            and not response.will_close
+            and getattr(response, "length", None) in (None, 0)
+        ):
+            self.session.release(self.key, connection)
+        else:
+            response.close()
+            connection.close()
+
+
+# Shared by all downloads in the process.
+session = HTTPSession()
+
+
+class RetryPolicy(object):
+    """How often and how long to wait before a failed download is tried again.
+
+    Only TransientErrors are retried. The wait before retry n is drawn
+    uniformly from zero to backoff * 2**n seconds, capped at max_backoff,
+    unless the server gave a Retry-After delay which is used instead."""
+
+    def __init__(self, attempts=4, backoff=1.0, max_backoff=60.0):
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def delay(self, attempt, error):
+        """Return the number of seconds to wait after the given (zero based) failed attempt."""
+        import random
+
+        if getattr(error, "retry_after", None) is not None:
+            return min(error.retry_after, self.max_backoff)
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def call(self, function, *args, **kwargs):
+        """Call function, retrying it while it raises a TransientError."""
+        import time
+
+        for attempt in range(max(1, self.attempts)):
+            try:
+                return function(*args, **kwargs)
+            except TransientError as e:
+                if attempt + 1 >= self.attempts:
+                    raise
+                delay = self.delay(attempt, e)
+                logging.info(
+                    "RetryPolicy: " + str(e) + ", retrying in {:.1f}s".format(delay)
+                )
+                time.sleep(delay)
+
+
+class TokenBucket(object):
+    """Allow rate events per second on average with bursts of up to burst events."""
+
+    def __init__(self, rate, burst=1):
+        import time
+
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, sleeping until one is available."""
+        import time
+
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class HostRateLimiter(object):
+    """Limit the rate of requests made to each host with a token bucket per host.
+
+    A rate of zero or less disables the limit."""
+
+    def __init__(self, rate=0.0, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def wait(self, url):
+        """Block until a request may be sent to the host of the url."""
+        from urllib.parse import urlsplit
+
+        if self.rate <= 0:
+            return
+        host = urlsplit(url).netloc
+        if not host:
+            return
+        with self.lock:
+            bucket = self.buckets.get(host)
+            if bucket is None:
+                bucket = self.buckets[host] = TokenBucket(self.rate, self.burst)
+        bucket.acquire()
+
+
+retry_policy = RetryPolicy(
+    config.getint("download", "attempts"),
+    config.getfloat("download", "backoff"),
+    config.getfloat("download", "max_backoff"),
+)
+rate_limiter = HostRateLimiter(
+    config.getfloat("download", "host_rate"), config.getint("download", "host_burst")
+)
+
+
+class TransientError(ValueError):
+    """A download failure that may succeed if it is tried again later.
+
+    retry_after holds the number of seconds the server asked clients to
+    wait with a Retry-After header, if it sent one."""
+
+    def __init__(self, message, retry_after=None):
+        super(TransientError, self).__init__(message)
+        self.retry_after = retry_after
+
+
+def retry_after_seconds(headers):
+    """Return the delay requested by a Retry-After header in seconds, or None."""
+    value = headers.get("Retry-After") if headers else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    import time
+    from email.utils import parsedate_to_datetime
+
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+# Statuses that are worth retrying: timeout, too many requests and server overload.
+transient_codes = [408, 429, 500, 502, 503, 504]
+
+
+def http_error(url, code, headers):
+    """Return the error to raise for an HTTP error status."""
+    if code == 416:
+        error = RangeNotSatisfiable(
+            "Tried url " + url + " and the requested range was not satisfiable"
+        )
+        content_range = headers.get("Content-Range", "") if headers else ""
+        try:
+            error.total = int(content_range.rpartition("/")[2])
+        except ValueError:
+            error.total = None
+        return error
+    if code > 399 and code < 500:
+        error_class = TransientError if code in transient_codes else ValueError
+        error = error_class(
+            "Tried url "
+            + url
+            + " and received client error "
+            + str(code)
+        )
+    elif code > 499:
+        error_class = TransientError if code in transient_codes else ValueError
+        error = error_class(
+            "Tried url "
+            + url
+            + " and received server error "
+            + str(code)
+        )
+    else:
+        return None
+    if isinstance(error, TransientError):
+        error.retry_after = retry_after_seconds(headers)
+    return error
+
+
+def open_url(url, headers={}):
+    """Open a url for reading, converting failures into a ValueError.
+
+    http and https urls are fetched through the shared session so that
+    connections to a host are reused, anything else goes to urlopen."""
+    from urllib.request import urlopen, Request
+    from urllib.error import HTTPError, URLError
+
+    rate_limiter.wait(url)
+    try:
+        response = session.request(url, headers)
+    except (http.client.HTTPException, OSError) as e:
+        raise TransientError("Tried url " + url + " and failed with error " + str(e))
+    if response is not None:
+        error = http_error(url, response.getcode(), response.info())
+        if error is not None:
+            response.close()
+            raise error
+        return response
+    try:
+        return urlopen(Request(url, headers=headers))
+    except HTTPError as e:
+        if not hasattr(e, "code"):
+            raise
+        if e.code == 304:
+            return e
+        error = http_error(url, e.code, e.headers)
+        if error is None:
+            raise
+        raise error
+    except URLError as e:
+        # Missing local files won't appear by trying again.
+        error_class = ValueError if url.startswith("file:") else TransientError
+        raise error_class(
+            "Tried url " + url + " and failed with error " + str(e.reason)
+        )
+
+
+class RangeNotSatisfiable(ValueError):
+    """The server could not return the requested byte range of a file."""
+
+    total = None
+
+
+def content_range_start(response):
+    """Return the first byte position and the full size from a partial content response."""
+    content_range = response.info().get("Content-Range")
+    if not content_range or not content_range.startswith("bytes "):
+        return None, None
+    span, _, total = content_range[6:].partition("/")
+    try:
+        start = int(span.split("-")[0])
+    except ValueError:
+        return None, None
+    try:
+        total = int(total)
+    except ValueError:
+        total = None
+    return start, total
+
+
+def file_sha256(filename, digest=None, block_sz=1048576):
+    """Update a SHA-256 digest with the contents of a file and return it."""
+    if digest is None:
+        digest = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for buff in iter(lambda: f.read(block_sz), b""):
+            digest.update(buff)
+    return digest
+
+
+def read_validators(save_name):
+    """Read the ETag and Last-Modified headers stored alongside a cached file."""
+    try:
+        with open(save_name + ".validators", "r") as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def write_validators(save_name, url, headers):
+    """Store the ETag and Last-Modified headers of a response alongside the cached file."""
+    validators = {}
+    if headers.get("ETag"):
+        validators["etag"] = headers.get("ETag")
+    if headers.get("Last-Modified"):
+        validators["last_modified"] = headers.get("Last-Modified")
+    filename = save_name + ".validators"
+    if not validators:
+        if os.path.exists(filename):
+            os.unlink(filename)
+        return
+    validators["url"] = url
+    with open(filename + ".tmp", "w") as f:
+        json.dump(validators, f)
+    os.replace(filename + ".tmp", filename)
+
+
+def conditional_headers(save_name, url):
+    """Return the headers that ask the server to only send a file if it has changed."""
+    validators = read_validators(save_name)
+    headers = {}
+    if validators.get("url") != url:
+        return headers
+    if "etag" in validators:
+        headers["If-None-Match"] = validators["etag"]
+    if "last_modified" in validators:
+        headers["If-Modified-Since"] = validators["last_modified"]
+    return headers
+
+
+def range_validator(part_name, url):
+    """Return the If-Range header for resuming a partial download of url, or None if there is no validator to send.
+
+    The ETag or Last-Modified header of the response the partial download
+    started from is stored alongside it, so that the server sends the
+    whole file again if it has changed since."""
+    validators = read_validators(part_name)
+    if validators.get("url") != url:
+        return None
+    # Weak ETags can't be used to combine ranges.
+    if validators.get("etag") and not validators["etag"].startswith("W/"):
+        return validators["etag"]
+    return validators.get("last_modified")
+
+
+class StreamDecompressor(object):
+    """Decompress gzip, bz2 or xz data incrementally as it is downloaded.
+
+    Files made of several concatenated compressed streams are handled by
+    starting a new decoder whenever one stream ends."""
+
+    def __init__(self, method):
+        self.method = method
+        self.decoder = self.new_decoder()
+        self.pending = False
+
+    def new_decoder(self):
+        if self.method == "gzip":
+            import zlib
+
+            return zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif self.method == "bz2":
+            import bz2
+
+            return bz2.BZ2Decompressor()
+        elif self.method == "xz":
+            import lzma
+
+            return lzma.LZMADecompressor()
+        raise ValueError("Unknown compression method " + str(self.method))
+
+    def decompress(self, data):
+        chunks = []
+        while data:
+            chunks.append(self.decoder.decompress(data))
+            self.pending = True
+            if not self.decoder.eof:
+                break
+            data = self.decoder.unused_data
+            self.decoder = self.new_decoder()
+            self.pending = False
+            if not data.strip(b"\x00"):
+                # Ignore any padding after the last stream.
+                break
+        return b"".join(chunks)
+
+    def flush(self):
+        if self.pending:
+            raise ValueError("The " + self.method + " compressed data ended early.")
+        return b""
+
+
+def decompressed_name(filename):
+    """Return the name of a compressed file once it has been decompressed."""
+    root, extension = os.path.splitext(filename)
+    if extension == ".tgz":
+        return root + ".tar"
+    elif extension in [".gz", ".bz2", ".xz"]:
+        return root
+    return filename
+
+
+class ProgressReporter(object):
+    """Receives the progress of a download. This base class reports nothing.
+
+    Subclasses override start, update and finish, which are given the
+    number of bytes received so far and the size of the file, or None if
+    the server didn't say."""
+
+    def start(self, url, save_name, received, total):
+        pass
+
+    def update(self, received, total):
+        pass
+
+    def finish(self, received, total):
+        pass
+
+
+class ThrottledProgress(ProgressReporter):
+    """A progress reporter that passes updates to report at most once every interval seconds."""
+
+    def __init__(self, interval=0.1):
+        self.interval = interval
+        self.last = None
+
+    def update(self, received, total):
+        import time
+
+        now = time.monotonic()
+        if self.last is None or now - self.last >= self.interval:
+            self.last = now
+            self.report(received, total)
+
+    def report(self, received, total):
+        pass
+
+
+class BarProgress(ThrottledProgress):
+    """Draw a bar of ">" characters on stdout, or a counter of megabytes when the size is unknown."""
+
+    line_length = 30
+
+    def start(self, url, save_name, received, total):
+        self.drawn = 0
+        self.status = ""
+        if total:
+            print(
+                "|"
+                + "{:^{ll}}".format(
+                    "Downloading {:7.3f}MB".format(total / (1048576.0)),
+                    ll=self.line_length,
+                )
+                + "|"
+            )
+            sys.stdout.write("|")
+            sys.stdout.flush()
+
+    def report(self, received, total):
+        if total:
+            # If the size given was wrong don't draw past the end of the bar.
+            length = min(self.line_length, int(self.line_length * float(received) / total))
+            if length > self.drawn:
+                sys.stdout.write(">" * (length - self.drawn))
+                self.drawn = length
+        else:
+            sys.stdout.write(" " * len(self.status) + "\r")
+            self.status = "{dl:7.3f}MB".format(dl=received / (1048576.0))
+            sys.stdout.write(self.status)
+        sys.stdout.flush()
+
+    def finish(self, received, total):
+        self.report(received, total)
+        if total:
+            sys.stdout.write("|")
+            self.status = ""
+        print(self.status)
+
+
+class LoggingProgress(ThrottledProgress):
+    """Log the progress of downloads with the logging module, by default every ten seconds."""
+
+    def __init__(self, interval=10.0, level=logging.INFO):
+        super(LoggingProgress, self).__init__(interval)
+        self.level = level
+
+    def start(self, url, save_name, received, total):
+        self.save_name = save_name
+        logging.log(self.level, "Downloading " + url + " -> " + save_name)
+
+    def report(self, received, total):
+        message = "{:.3f}MB".format(received / 1048576.0)
+        if total:
+            message += " of {:.3f}MB".format(total / 1048576.0)
+        logging.log(self.level, self.save_name + ": " + message)
+
+    def finish(self, received, total):
+        logging.log(self.level, self.save_name + ": finished, {:.3f}MB".format(received / 1048576.0))
+
+
+class CallbackProgress(ThrottledProgress):
+    """Call callback(received, total) with the progress of a download, at most once every interval seconds and once at the end."""
+
+    def __init__(self, callback, interval=0.1):
+        super(CallbackProgress, self).__init__(interval)
+        self.callback = callback
+
+    def report(self, received, total):
+        self.callback(received, total)
+
+    def finish(self, received, total):
+        self.callback(received, total)
+
+
+def default_progress(messages=True):
+    """Return the progress reporter set by the progress setting in the download section of the configuration."""
+    style = config.get("download", "progress")
+    interval = config.getfloat("download", "progress_interval")
+    if not messages or style == "none":
+        return ProgressReporter()
+    elif style == "log":
+        return LoggingProgress(interval)
+    return BarProgress(interval)
+
+
+def download_url(
+        url, dir_name=".", save_name=None, store_directory=None, messages=True, suffix="", resume=None, sha256=None, revalidate=False, decompress=None, stats=None, progress=None
+):
+    """Download a file from a url and save it to disk.
+
+    The data is written to a ".part" file alongside save_name which is only
+    renamed once the download is complete. If resume is set and a partial
+    file exists, only the remaining bytes are requested from the server,
+    as long as the file hasn't changed since the partial download began.
+
+    :param resume: whether to continue a partial download, defaults to the resume setting in the download section of the configuration.
+    :param sha256: expected SHA-256 hex digest of the file. The digest is computed as the data arrives and the file is discarded if it doesn't match.
+    :param revalidate: if the file is already cached, send the ETag and Last-Modified headers stored with it so the server only returns the file if it has changed.
+    :param decompress: "gzip", "bz2" or "xz" to decompress the data as it arrives and save the decompressed file, without its compression extension, instead. Such downloads can't be resumed.
+    :param progress: a ProgressReporter for the download, defaults to the one given by the configuration, or none if messages is False.
+    :param stats: a dictionary in which the number of bytes received ("bytes"), the seconds until the first byte arrived ("time_to_first_byte") and whether the file was "downloaded", "resumed" or "not-modified" ("result") are recorded, along with the SHA-256 digest of the saved file ("sha256").
+    """
+    import time
+
+    if stats is None:
+        stats = {}
+    stats.setdefault("bytes", 0)
+    i = url.rfind("/")
+    file = url[i + 1 :]
+    if store_directory is not None:
+        dir_name = os.path.join(dir_name, store_directory)
+    if save_name is None:
+        save_name = file
+    decompressor = None
+    if decompress:
+        decompressor = StreamDecompressor(decompress)
+        save_name = decompressed_name(save_name)
+        resume = False
+    save_name = os.path.join(dir_name, save_name)
+    part_name = save_name + ".part"
+    if resume is None:
+        resume = config.getboolean("download", "resume")
+    print("Downloading ", url, "->", save_name)
+    if not os.path.exists(dir_name):
+        os.makedirs(dir_name)
+
+    conditional = {}
+    if revalidate and os.path.exists(save_name):
+        conditional = conditional_headers(save_name, url + suffix)
+
+    offset = 0
+    if_range = None
+    if resume and os.path.exists(part_name):
+        if_range = range_validator(part_name, url + suffix)
+        if if_range is not None:
+            offset = os.path.getsize(part_name)
+        else:
+            # Without a validator the server can't tell whether the file
+            # changed since the partial download began, so it starts again.
+            logging.info("download_url: not resuming " + part_name + ", no ETag or Last-Modified was stored with it")
+    response = None
+    request_time = time.time()
+    if offset:
+        try:
+            headers = {"Range": "bytes=" + str(offset) + "-", "If-Range": if_range}
+            headers.update(conditional)
+            response = open_url(url + suffix, headers)
+        except RangeNotSatisfiable as e:
+            if e.total == offset:
+                # The partial file already holds the whole of the data.
+                if sha256 is None or file_sha256(part_name).hexdigest() == sha256.lower():
+                    os.replace(part_name, save_name)
+                    os.replace(part_name + ".validators", save_name + ".validators")
+                    stats["result"] = "resumed"
+                    return
+            logging.info("download_url: discarding partial download " + part_name)
+            response = None
+        else:
+            start, total = content_range_start(response)
+            if response.getcode() != 206:
+                # The server ignored the range request, or the file has
+                # changed, so the whole file is being sent.
+                offset = 0
+            elif start != offset:
+                response.close()
+                response = None
+    if response is None:
+        offset = 0
+        response = open_url(url + suffix, conditional)
+    if response.getcode() == 304:
+        response.close()
+        if os.path.exists(part_name):
+            os.unlink(part_name)
+        print("File has not changed since it was downloaded.")
+        stats["result"] = "not-modified"
+        return
+    # The digest is always computed so the file can be stored by its content.
+    digest = hashlib.sha256()
+    # For decompressed files that is the digest of what is saved rather than what is received.
+    saved_digest = digest if decompressor is None else hashlib.sha256()
+    if offset:
+        file_sha256(part_name, digest)
+    if offset:
+        print("Resuming download from {:7.3f}MB".format(offset / (1048576.0)))
+
+    with open(part_name, "ab" if offset else "wb") as f, closing(response):
+        meta = response.info()
+        if not offset:
+            write_validators(part_name, url + suffix, meta)
+        content_length_str = meta.get("Content-Length")
+        if content_length_str:
+            # if sys.version_info>=(3,0):
+            try:
+                file_size = int(content_length_str)
+            except:
+                try:
+                    file_size = int(content_length_str[0])
+                except:
+                    file_size = None
+            if file_size == 1:
+                file_size = None
+            # else:
+            #    file_size = int(content_length_str)
+        else:
+            file_size = None
+        if offset:
+            start, total = content_range_start(response)
+            if total is not None:
+                file_size = total
+            elif file_size:
+                file_size += offset
+
+        file_size_dl = offset
+        if progress is None:
+            progress = default_progress(messages)
+        progress.start(url + suffix, save_name, file_size_dl, file_size)
+
+        # Start with small reads and double the block size while the
+        # reads are quick, so fast transfers aren't split into thousands of reads.
+        block_sz = 8192
+        max_block_sz = 1048576
+        target_seconds = 0.05
+        while True:
+            read_start = time.monotonic()
+            try:
+                buff = response.read(block_sz)
+            except Exception as e:
+                raise TransientError(
+                    "Download of " + url + suffix + " was interrupted: " + str(e)
+                )
+            if not buff:
+                break
+            read_seconds = time.monotonic() - read_start
+            if len(buff) == block_sz and block_sz < max_block_sz and read_seconds < target_seconds / 2:
+                block_sz *= 2
+            elif block_sz > 8192 and read_seconds > target_seconds * 2:
+                block_sz //= 2
+            if stats.get("time_to_first_byte") is None:
+                stats["time_to_first_byte"] = time.time() - request_time
+            stats["bytes"] += len(buff)
+            file_size_dl += len(buff)
+            digest.update(buff)
+            if decompressor is not None:
+                buff = decompressor.decompress(buff)
+                saved_digest.update(buff)
+            f.write(buff)
+            progress.update(file_size_dl, file_size)
+
+        if decompressor is not None:
+            buff = decompressor.flush()
+            saved_digest.update(buff)
+            f.write(buff)
+        progress.finish(file_size_dl, file_size)
+        # if we wanted to get more sophisticated maybe we should check the response code here again even for successes.
+
+    if file_size and file_size_dl != file_size:
+        raise TransientError(
+            "Download of "
+            + url
+            + suffix
+            + " is incomplete, received "
+            + str(file_size_dl)
+            + " of "
+            + str(file_size)
+            + " bytes. The partial download is kept in "
+            + part_name
+            + "."
+        )
+    if sha256 is not None and digest.hexdigest() != sha256.lower():
+        os.unlink(part_name)
+        write_validators(part_name, url + suffix, {})
+        raise ValueError(
+            "Download of "
+            + url
+            + suffix
+            + " failed checksum verification, expected SHA-256 "
+            + sha256
+            + " but received "
+            + digest.hexdigest()
+            + "."
+        )
+    os.replace(part_name, save_name)
+    write_validators(part_name, url + suffix, {})
+    write_validators(save_name, url + suffix, meta)
+    stats["result"] = "resumed" if offset else "downloaded"
+    stats["sha256"] = saved_digest.hexdigest()
+
+def freeze(value):
+    """Return a read only copy of a json value, with dictionaries as mapping proxies and lists as tuples."""
+    if isinstance(value, Mapping):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def resource_descriptor(base, **fields):
+    """Return a read only description of a data resource for a single call.
+
+    Loaders that download a different set of files on each call (a season
+    of football results, a CMU subject's motions) describe them with a
+    descriptor that they pass to download_data, data_available and
+    data_details_return, rather than by changing data_resources, so
+    several loads can run at once in different threads.
+
+    :param base: name of the entry in data_resources the descriptor starts from, or a mapping.
+    :param fields: fields that replace those of the base entry, e.g. files and urls.
+    """
+    resource = dict(data_resources[base] if isinstance(base, str) else base)
+    resource.update(fields)
+    return freeze(resource)
+
+
+def data_resource(dataset_name, resource=None):
+    """Return the description of a data set: the descriptor given for this call if there is one, otherwise its entry in data_resources."""
+    return data_resources[dataset_name] if resource is None else resource
+
+
+def data_details_return(data, data_set, resource=None):
+    """Update the data details component of the data dictionary with details drawn from the data_resources.json file.
+
+    Loaders call this once with what they return, so it also records the
+    use of the data set in the cache index."""
+    data.update(data_resource(data_set, resource))
+    record_access(data_set)
+    return data
+
+
+
+def download_jobs(dataset_name, dr):
+    """Return the list of individual file downloads needed for a data resource.
+
+    A resource may list SHA-256 digests for its files in an optional
+    "sha256" field that has the same shape as "files", with null for
+    files that have no digest. Similarly an optional "decompress" field
+    gives "gzip", "bz2" or "xz" for files that should be decompressed as
+    they are downloaded, and an optional "members" field lists, for
+    archives, the names or glob patterns of the members that the loader
+    reads (see extract_members)."""
+    jobs = []
+    if "sha256" in dr:
+        digests = [digest for file_digests in dr["sha256"] for digest in file_digests]
+    else:
+        digests = None
+    if "decompress" in dr:
+        methods = [method for file_methods in dr["decompress"] for method in file_methods]
+    else:
+        methods = None
+    if "members" in dr:
+        members = [patterns for file_members in dr["members"] for patterns in file_members]
+    else:
+        members = None
+    if "suffices" in dr:
+        for url, filenames, suffices in zip(dr["urls"], dr["files"], dr["suffices"]):
+            for filename, suffix in zip(filenames, suffices):
+                jobs.append(
+                    {
+                        "url": os.path.join(url, filename).replace(" ", "%20"),
+                        "save_name": filename,
+                        "store_directory": dataset_name,
+                        "suffix": suffix,
+                    }
+                )
+    elif "dirs" in dr:
+        for url, dirnames, filenames in zip(dr["urls"], dr["dirs"], dr["files"]):
+            for filename, dirname in zip(filenames, dirnames):
+                jobs.append(
+                    {
+                        "url": os.path.join(url, dirname, filename).replace(" ", "%20"),
+                        "save_name": filename,
+                        "store_directory": os.path.join(dataset_name, dirname),
+                        "suffix": "",
+                    }
+                )
+    else:
+        for url, filenames in zip(dr["urls"], dr["files"]):
+            for filename in filenames:
+                jobs.append(
+                    {
+                        "url": os.path.join(url, filename).replace(" ", "%20"),
+                        "save_name": filename,
+                        "store_directory": dataset_name,
+                        "suffix": "",
+                    }
+                )
+    for i, job in enumerate(jobs):
+        job["dataset_name"] = dataset_name
+        job["sha256"] = digests[i] if digests else None
+        job["decompress"] = methods[i] if methods else None
+        job["members"] = members[i] if members else None
+    return jobs
+
+
+def cache_path(job):
+    """Return where a file of a data resource is stored in the cache."""
+    save_name = job["save_name"]
+    if job["decompress"]:
+        save_name = decompressed_name(save_name)
+    return os.path.join(DATAPATH, job["store_directory"], save_name)
+
+
+class FileLock(object):
+    """An exclusive lock held on a lock file, shared by the threads and processes using the cache.
+
+    The lock is reentrant for the thread that holds it, so functions that
+    take it can call each other. If another process holds the lock, the
+    message is printed before waiting for it."""
+
+    # Thread lock, depth and open lock file for each lock path in this process.
+    held = {}
+    held_lock = threading.Lock()
+
+    def __init__(self, path, message=None):
+        self.path = os.path.abspath(path)
+        self.message = message
+        with FileLock.held_lock:
+            self.state = FileLock.held.setdefault(
+                self.path, {"lock": threading.RLock(), "depth": 0, "file": None}
+            )
+
+    def acquire(self, blocking=True):
+        """Take the lock, waiting for it unless blocking is False. Returns whether the lock was taken."""
+        if not self.state["lock"].acquire(blocking):
+            return False
+        if self.state["depth"] == 0:
+            try:
+                self.state["file"] = self.lock_file(blocking)
+            except BaseException:
+                self.state["lock"].release()
+                raise
+            if self.state["file"] is None:
+                self.state["lock"].release()
+                return False
+        self.state["depth"] += 1
+        return True
+
+    def release(self):
+        self.state["depth"] -= 1
+        if self.state["depth"] == 0:
+            f, self.state["file"] = self.state["file"], None
+            self.unlock_file(f)
+        self.state["lock"].release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+    def lock_file(self, blocking=True):
+        import time
+
+        dir_name = os.path.dirname(self.path)
+        if not os.path.exists(dir_name):
+            os.makedirs(dir_name, exist_ok=True)
+        f = open(self.path, "a+")
+        try:
+            import fcntl
+        except ImportError:
+            import msvcrt
+
+            waiting = False
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                    return f
+                except OSError:
+                    if not blocking:
+                        f.close()
+                        return None
+                    if not waiting and self.message:
+                        print(self.message)
+                    waiting = True
+                    time.sleep(0.1)
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            if not blocking:
+                f.close()
+                return None
+            if self.message:
+                print(self.message)
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            except BaseException:
+                f.close()
+                raise
+        return f
+
+    def unlock_file(self, f):
+        try:
+            import fcntl
+        except ImportError:
+            import msvcrt
+
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        f.close()
+
+
+if hasattr(os, "register_at_fork"):
+    # A child process doesn't hold its parent's locks or share its connections.
+    os.register_at_fork(after_in_child=FileLock.held.clear)
+    os.register_at_fork(after_in_child=lambda: session.clear())
+
+
+def dataset_lock(dataset_name):
+    """Return the lock a process holds while it downloads, extracts or parses a data set.
+
+    Lock files are kept in DATAPATH/.locks rather than in the data set's
+    directory so that removing the directory doesn't remove a held lock."""
+    return FileLock(
+        os.path.join(DATAPATH, ".locks", dataset_name + ".lock"),
+        "Waiting for another process to finish with " + dataset_name + ".",
+    )
+
+
+def file_stamp(path):
+    """Return what changes whenever a file is written again, or None if it is missing.
+
+    Modification times can be coarser than the time between two writes,
+    so the size and inode, which os.replace changes, are compared too."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+class CacheIndex(object):
+    """Index of the data sets held in the cache, stored in DATAPATH/.cache_index.json.
+
+    For each data set it records the size on disk, when and how often it
+    was last used, whether it is pinned and the size of each of its files
+    that has been downloaded, so that checking whether files are cached
+    needs one stat of the index rather than one per file. The file is
+    read again whenever another process has changed it."""
+
+    filename = ".cache_index.json"
+
+    def __init__(self):
+        self.path = None
+        self.stamp = None
+        self.datasets = {}
+
+    @property
+    def lock(self):
+        return FileLock(os.path.join(DATAPATH, ".locks", "cache_index.lock"))
+
+    def load(self):
+        path = os.path.join(DATAPATH, self.filename)
+        stamp = file_stamp(path)
+        if path != self.path or stamp != self.stamp:
+            # Readers don't take the lock, so the new entries are only put in place once complete.
+            datasets = {}
+            if stamp is not None:
+                try:
+                    with open(path, "r") as f:
+                        datasets = json.load(f)["datasets"]
+                except (ValueError, KeyError) as e:
+                    logging.warning("CacheIndex: ignoring unreadable " + path + ": " + str(e))
+            self.datasets = datasets
+            self.path = path
+            self.stamp = stamp
+        return self.datasets
+
+    def save(self):
+        if not os.path.exists(DATAPATH):
+            os.makedirs(DATAPATH, exist_ok=True)
+        with open(self.path + ".tmp", "w") as f:
+            json.dump({"datasets": self.datasets}, f, indent=1, sort_keys=True)
+        os.replace(self.path + ".tmp", self.path)
+        self.stamp = file_stamp(self.path)
+
+    def get(self, dataset_name):
+        return self.load().get(dataset_name)
+
+    def update(self, dataset_name, **values):
+        """Set values in the entry for a data set, creating it if needed."""
+        with self.lock:
+            entry = self.load().setdefault(
+                dataset_name, {"accesses": 0, "last_access": 0.0, "pinned": False, "size": None}
+            )
+            entry.update(values)
+            self.save()
+            return entry
+
+    def touch(self, dataset_name):
+        """Record that a data set has been used."""
+        import time
+
+        with self.lock:
+            entry = self.get(dataset_name) or {}
+            return self.update(
+                dataset_name, accesses=entry.get("accesses", 0) + 1, last_access=time.time()
+            )
+
+    def remove(self, dataset_name):
+        with self.lock:
+            if self.load().pop(dataset_name, None) is not None:
+                self.save()
+
+    @staticmethod
+    def key(dataset_name, path):
+        return os.path.relpath(path, os.path.join(DATAPATH, dataset_name))
+
+    def files(self, dataset_name):
+        """Return the sizes of the indexed files of a data set by their path within its directory."""
+        entry = self.get(dataset_name)
+        return entry.get("files", {}) if entry else {}
+
+    def add_files(self, dataset_name, paths):
+        """Record that files of a data set are complete in the cache."""
+        with self.lock:
+            files = dict(self.files(dataset_name))
+            for path in paths:
+                files[self.key(dataset_name, path)] = os.path.getsize(path)
+            self.update(dataset_name, files=files)
+
+    def remove_files(self, dataset_name, paths):
+        with self.lock:
+            files = dict(self.files(dataset_name))
+            keys = [self.key(dataset_name, path) for path in paths]
+            if any(key in files for key in keys):
+                for key in keys:
+                    files.pop(key, None)
+                self.update(dataset_name, files=files)
+
+    def unindexed(self, dataset_name, paths, validate=None):
+        """Return the paths that the index doesn't record as cached.
+
+        :param validate: "stat" to check the size of each indexed file on disk, or "index" to trust the index even for files that have since been removed. Defaults to the validate setting in the datasets section of the configuration.
+        """
+        if validate is None:
+            validate = config.get("datasets", "validate")
+        files = self.files(dataset_name)
+        unindexed = []
+        for path in paths:
+            size = files.get(self.key(dataset_name, path))
+            if size is None:
+                unindexed.append(path)
+            elif validate == "stat":
+                try:
+                    if os.path.getsize(path) != size:
+                        unindexed.append(path)
+                except OSError:
+                    unindexed.append(path)
+        return unindexed
+
+
+cache_index = CacheIndex()
+
+
+def parse_size(size):
+    """Convert a size such as "5861646", "500M" or "20G" into bytes. Empty or zero sizes give None."""
+    size = size.strip().upper().rstrip("B")
+    if not size:
+        return None
+    multiplier = 1
+    if size[-1] in "KMGT":
+        multiplier = 1024 ** ("KMGT".index(size[-1]) + 1)
+        size = size[:-1]
+    size = int(float(size) * multiplier)
+    return size if size > 0 else None
+
+
+def cache_quota():
+    """Return the largest size in bytes the cache may grow to, or None if it is unlimited."""
+    return parse_size(config.get("datasets", "quota"))
+
+
+def dataset_size(dataset_name):
+    """Return the number of bytes a data set takes up in the cache."""
+    size = 0
+    for dir_name, dirnames, filenames in os.walk(os.path.join(DATAPATH, dataset_name)):
+        for filename in filenames:
+            try:
+                size += os.path.getsize(os.path.join(dir_name, filename))
+            except OSError:
+                pass
+    return size
+
+
+def pinned(dataset_name):
+    """Check if a data set is exempt from eviction, either by the pinned setting or by pin()."""
+    if dataset_name in config.get("datasets", "pinned").split():
+        return True
+    entry = cache_index.get(dataset_name)
+    return bool(entry and entry.get("pinned"))
+
+
+def pin(dataset_name):
+    """Keep a data set in the cache whatever the quota."""
+    cache_index.update(dataset_name, pinned=True)
+
+
+def unpin(dataset_name):
+    cache_index.update(dataset_name, pinned=False)
+
+
+def cache_usage():
+    """Return the size in bytes of each data set in the cache.
+
+    Every directory in the cache counts, including those of loaders that
+    choose their files from their arguments (cmu_mocap, kepler_telescope,
+    a season of football_data) and so aren't in data_resources. Data sets
+    that aren't in the index yet, for instance because they were
+    downloaded by an older version, are measured and added to it with the
+    time their directory was last modified."""
+    usage = {}
+    if not os.path.isdir(DATAPATH):
+        return usage
+    for dataset_name in os.listdir(DATAPATH):
+        path = os.path.join(DATAPATH, dataset_name)
+        # The blob store, locks and other bookkeeping are kept in dot directories.
+        if dataset_name.startswith(".") or not os.path.isdir(path):
+            continue
+        entry = cache_index.get(dataset_name)
+        if entry is None or entry.get("size") is None:
+            entry = cache_index.update(
+                dataset_name,
+                size=dataset_size(dataset_name),
+                last_access=(entry or {}).get("last_access") or os.path.getmtime(path),
+            )
+        usage[dataset_name] = entry["size"]
+    return usage
+
+
+# The cache directory whose data sets have been measured into the index by this process.
+usage_scanned = None
+
+
+def indexed_usage():
+    """Return the size in bytes of each data set as recorded in the cache index, so the cache isn't walked on every download."""
+    global usage_scanned
+    if usage_scanned != DATAPATH:
+        # Directories the index doesn't know about are measured once per process.
+        cache_usage()
+        usage_scanned = DATAPATH
+    return dict(
+        (dataset_name, entry["size"])
+        for dataset_name, entry in cache_index.load().items()
+        if entry.get("size") is not None
+    )
+
+
+class BlobStore(object):
+    """Content addressed store of the downloaded files, kept in DATAPATH/.blobs.
+
+    Each file is stored once, under its SHA-256 digest, and the files of
+    the data sets are hard links to it, or symbolic links where hard
+    links can't be made or the dedupe setting is symlink. The digest of
+    each url downloaded is recorded too, so a file that another data set
+    has already downloaded is linked rather than downloaded again."""
+
+    dirname = ".blobs"
+
+    def __init__(self):
+        self.path = None
+        self.stamp = None
+        self.urls = {}
+
+    @property
+    def lock(self):
+        return FileLock(os.path.join(DATAPATH, ".locks", "blobs.lock"))
+
+    @property
+    def mode(self):
+        return config.get("datasets", "dedupe")
+
+    def root(self):
+        return os.path.join(DATAPATH, self.dirname)
+
+    def blob_path(self, digest):
+        return os.path.join(self.root(), digest[:2], digest)
+
+    def load(self):
+        path = os.path.join(self.root(), "urls.json")
+        stamp = file_stamp(path)
+        if path != self.path or stamp != self.stamp:
+            urls = {}
+            if stamp is not None:
+                try:
+                    with open(path, "r") as f:
+                        urls = json.load(f)
+                except ValueError as e:
+                    logging.warning("BlobStore: ignoring unreadable " + path + ": " + str(e))
+            self.urls = urls
+            self.path = path
+            self.stamp = stamp
+        return self.urls
+
+    def save(self):
+        if not os.path.exists(self.root()):
+            os.makedirs(self.root(), exist_ok=True)
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(self.urls, f, indent=1, sort_keys=True)
+        os.replace(self.path + ".tmp", self.path)
+        self.stamp = file_stamp(self.path)
+
+    def lookup(self, url):
+        """Return the path of the blob holding the contents of a url, or None if it isn't stored."""
+        if self.mode == "none":
+            return None
+        digest = self.load().get(url)
+        if digest is not None and os.path.exists(self.blob_path(digest)):
+            return self.blob_path(digest)
+        return None
+
+    def link_stored(self, path, url, sha256=None, decompress=None):
+        """Link path to the blob holding a url's contents or, failing that, the blob with its SHA-256 digest.
+
+        A blob stored for the url is only used if it matches the digest,
+        since the url may have served different contents since. Digests
+        of files that are decompressed are of the data as downloaded, so
+        neither check can be made for them and only the url is used.
+
+        :returns: whether a stored blob was linked."""
+        if self.mode == "none":
+            return False
+        with self.lock:
+            blob = self.lookup(url)
+            if blob is not None and sha256 and not decompress and os.path.basename(blob) != sha256.lower():
+                blob = None
+            if blob is None and not decompress:
+                blob = self.find(sha256)
+            if blob is None:
+                return False
+            try:
+                self.link(blob, path)
+            except OSError as e:
+                logging.warning("BlobStore: could not link " + path + ", downloading it instead: " + str(e))
+                return False
+        return True
+
+    def forget(self, path, url, sha256=None):
+        """Remove the blob path is linked to, found by its url or SHA-256 digest, so it is downloaded again rather than linked.
+
+        A file that is linked to a blob shares its contents, so when the
+        file is found to be broken, so is the blob."""
+        if self.mode == "none" or not os.path.exists(path):
+            return
+        with self.lock:
+            for blob in [self.lookup(url), self.find(sha256)]:
+                if blob is None or not os.path.exists(blob) or not os.path.samefile(blob, path):
+                    continue
+                digest = os.path.basename(blob)
+                urls = self.load()
+                for stored_url in [stored_url for stored_url, stored in urls.items() if stored == digest]:
+                    del urls[stored_url]
+                self.save()
+                logging.info("BlobStore: remove " + blob)
+                os.unlink(blob)
+
+    def find(self, digest):
+        """Return the path of the blob with a SHA-256 digest, or None if it isn't stored."""
+        if self.mode == "none" or not digest:
+            return None
+        blob = self.blob_path(digest.lower())
+        return blob if os.path.exists(blob) else None
+
+    def link(self, blob, path):
+        """Replace path with a link to a blob."""
+        link_name = path + ".link"
+        if os.path.lexists(link_name):
+            os.unlink(link_name)
+        dir_name = os.path.dirname(path)
+        if not os.path.exists(dir_name):
+            os.makedirs(dir_name, exist_ok=True)
+        try:
+            if self.mode == "symlink":
+                raise OSError("symbolic links requested")
+            os.link(blob, link_name)
+        except OSError:
+            os.symlink(blob, link_name)
+        os.replace(link_name, path)
+
+    def add(self, path, digest=None, url=None):
+        """Move a downloaded file into the store, leaving a link in its place.
+
+        :returns: the SHA-256 digest of the file, or None if it couldn't be stored."""
+        if self.mode == "none":
+            return None
+        try:
+            if digest is None and url is not None:
+                blob = self.lookup(url)
+                if blob is not None and os.path.samefile(blob, path):
+                    return os.path.basename(blob)
+            if digest is None:
+                digest = file_sha256(path).hexdigest()
+            blob = self.blob_path(digest)
+            # collect() removes blobs that nothing links to, so a blob and
+            # its link are put in place while holding the lock it runs under.
+            with self.lock:
+                if os.path.exists(blob):
+                    if not os.path.samefile(blob, path):
+                        self.link(blob, path)
+                elif not os.path.islink(path):
+                    if not os.path.exists(os.path.dirname(blob)):
+                        os.makedirs(os.path.dirname(blob), exist_ok=True)
+                    os.replace(path, blob)
+                    try:
+                        self.link(blob, path)
+                    except OSError:
+                        # Neither kind of link can be made here, so the data set keeps its own file.
+                        os.replace(blob, path)
+                        raise
+        except OSError as e:
+            logging.warning("BlobStore: could not store " + path + ": " + str(e))
+            return None
+        if url is not None:
+            with self.lock:
+                self.load()[url] = digest
+                self.save()
+        return digest
+
+    def collect(self):
+        """Remove the blobs that no data set links to any more.
+
+        :returns: the digests of the removed blobs."""
+        root = self.root()
+        if not os.path.isdir(root):
+            return []
+        targets = set()
+        for dir_name, dirnames, filenames in os.walk(DATAPATH):
+            if os.path.abspath(dir_name) == os.path.abspath(root):
+                dirnames[:] = []
+                continue
+            for filename in filenames:
+                path = os.path.join(dir_name, filename)
+                if os.path.islink(path):
+                    targets.add(os.path.abspath(os.path.realpath(path)))
+        removed = []
+        for dir_name, dirnames, filenames in os.walk(root):
+            for filename in filenames:
+                blob = os.path.join(dir_name, filename)
+                if dir_name == root:
+                    continue
+                if os.stat(blob).st_nlink == 1 and os.path.abspath(os.path.realpath(blob)) not in targets:
+                    logging.info("BlobStore: remove " + blob)
+                    os.unlink(blob)
+                    removed.append(filename)
+        if removed:
+            with self.lock:
+                urls = self.load()
+                for url in [url for url, digest in urls.items() if digest in removed]:
+                    del urls[url]
+                self.save()
+        return removed
+
+
+blob_store = BlobStore()
+
+
+def missing_files(dataset_name, paths):
+    """Return which of the paths of a data set's files are not in the cache.
+
+    The cache index is consulted first so that only files it doesn't
+    know about are looked for on disk. Those that are found are added to
+    the index."""
+    unindexed = cache_index.unindexed(dataset_name, paths)
+    missing = [path for path in unindexed if not os.path.exists(path)]
+    found = [path for path in unindexed if os.path.exists(path)]
+    if found:
+        cache_index.add_files(dataset_name, found)
+    return missing
+
+
+def evict(dataset_name):
+    """Remove a data set's directory from the cache entirely.
+
+    Data sets that another thread or process holds the lock of are in
+    use and left alone. Returns whether the data set was removed."""
+    import shutil
+
+    path = os.path.join(DATAPATH, dataset_name)
+    lock = dataset_lock(dataset_name)
+    if not lock.acquire(blocking=False):
+        return False
+    try:
+        logging.info("evict: remove " + path)
+        shutil.rmtree(path, ignore_errors=True)
+        cache_index.remove(dataset_name)
+    finally:
+        lock.release()
+    with blob_store.lock:
+        blob_store.collect()
+    return True
+
+
+def enforce_quota(needed=0, keep=[]):
+    """Evict data sets until the cache has room for needed more bytes within its quota.
+
+    Data sets are evicted least recently used first or, if the eviction
+    setting is lfu, least often used first. Pinned data sets, those in
+    keep and those being prefetched are never evicted.
+
+    :returns: the names of the evicted data sets."""
+    quota = cache_quota()
+    if quota is None:
+        return []
+    usage = indexed_usage()
+    total = sum(usage.values())
+    if total + needed <= quota:
+        return []
+    with prefetch_lock:
+        busy = set(prefetching)
+    candidates = [
+        name for name in usage if name not in keep and name not in busy and not pinned(name)
+    ]
+    entries = dict((name, cache_index.get(name) or {}) for name in candidates)
+    if config.get("datasets", "eviction").lower() == "lfu":
+        candidates.sort(key=lambda name: (entries[name].get("accesses", 0), entries[name].get("last_access", 0)))
+    else:
+        candidates.sort(key=lambda name: entries[name].get("last_access", 0))
+    evicted = []
+    for name in candidates:
+        if total + needed <= quota:
+            break
+        if not evict(name):
+            continue
+        print("Removed " + name + " from the cache to stay within its quota.")
+        total -= usage[name]
+        evicted.append(name)
+    if total + needed > quota:
+        logging.warning(
+            "enforce_quota: cache needs " + str(total + needed) + " bytes, more than its quota of " + str(quota)
+        )
+    return evicted
+
+
+def make_room(dataset_name, resource=None):
+    """Evict other data sets so that a data set of its declared size fits in the quota."""
+    if cache_quota() is None:
+        return []
+    needed = data_resource(dataset_name, resource).get("size") or 0
+    needed = max(0, needed - dataset_size(dataset_name))
+    return enforce_quota(needed, keep=[dataset_name])
+
+
+def record_download(dataset_name):
+    """Update the cache index with the new size of a data set and enforce the quota.
+
+    The data set counts as recently used, but not as used more often."""
+    import time
+
+    cache_index.update(dataset_name, size=dataset_size(dataset_name), last_access=time.time())
+    return enforce_quota(keep=[dataset_name])
+
+
+def record_access(dataset_name):
+    """Record in the cache index that a loader has used a data set, which orders eviction."""
+    try:
+        if cache_index.get(dataset_name) is not None:
+            cache_index.touch(dataset_name)
+    except OSError as e:
+        logging.warning("record_access: could not update the cache index: " + str(e))
+
+
+class Resolver(object):
+    """Decide where each file of a data set is downloaded from.
+
+    The sources method returns the urls to try for a file, in order. This
+    resolver only returns the file's url from the data resources, set
+    access.resolver to a subclass to fetch files from somewhere else."""
+
+    def sources(self, dataset_name, url, path):
+        """Return the urls to try for a file.
+
+        :param dataset_name: name of the data resource the file belongs to.
+        :param url: url of the file given by the data resource.
+        :param path: path of the file relative to the data cache directory.
+        """
+        return [url]
+
+    def report(self, url, seconds, error=None):
+        """Record how long a download from one of the sources took, or the error it failed with."""
+        pass
+
+
+class MirrorResolver(Resolver):
+    """Try mirrors of the data cache before the original hosts.
+
+    Each mirror is a local directory, a file:// url or an http(s) url whose
+    contents are laid out like the data cache, i.e. a file is found at
+    <mirror>/<data set>/<file>. Local mirrors are tried first, then the
+    http mirrors, fastest first according to the downloads so far, and
+    finally the url from the data resources."""
+
+    def __init__(self, mirrors=[], origin=True, smoothing=0.3):
+        self.local = []
+        self.remote = []
+        for mirror in mirrors:
+            mirror = mirror.rstrip("/")
+            if mirror.startswith("http://") or mirror.startswith("https://"):
+                self.remote.append(mirror)
+            elif mirror.startswith("file://"):
+                self.local.append(mirror)
+            else:
+                self.local.append("file://" + os.path.abspath(os.path.expanduser(mirror)))
+        self.origin = origin
+        self.smoothing = smoothing
+        self.timings = {}
+        self.lock = threading.Lock()
+
+    def sources(self, dataset_name, url, path):
+        from urllib.parse import quote
+
+        path = quote(path.replace(os.sep, "/"))
+        with self.lock:
+            remote = sorted(self.remote, key=lambda mirror: self.timings.get(mirror, 0.0))
+        sources = [mirror + "/" + path for mirror in self.local + remote]
+        if self.origin:
+            sources.append(url)
+        return sources
+
+    def report(self, url, seconds, error=None):
+        for mirror in self.remote:
+            if url.startswith(mirror + "/"):
+                if error is not None:
+                    # Penalise a failing mirror so that the others are tried first.
+                    seconds = max(seconds, 60.0)
+                with self.lock:
+                    previous = self.timings.get(mirror, seconds)
+                    self.timings[mirror] = (
+                        self.smoothing * seconds + (1 - self.smoothing) * previous
+                    )
+                return
+
+
+def configured_mirrors():
+    """Return the mirrors listed in the download section of the configuration."""
+    return config.get("download", "mirrors").replace(",", " ").split()
+
+
+resolver = MirrorResolver(configured_mirrors())
+
+
+def download_workers():
+    """Return the number of parallel downloads configured for a data resource."""
+    return max(1, config.getint("download", "workers"))
 
-    json_data = iopen(path, encoding="utf-8").read()
-    data_resources = json.loads(json_data)
 
-if not (on_rtd):
-    path = os.path.join(os.path.dirname(__file__), "football_teams.json")
-    from io import open as iopen
+class DownloadJournal(object):
+    """Record of which files of a data set are complete, in flight or have failed.
 
-    json_data = iopen(path, encoding="utf-8").read()
-    football_dict = json.loads(json_data)
+    The journal is kept in DATAPATH/<data set>/.journal and rewritten
+    atomically whenever a file changes state, so after an interrupted
+    download_data only the files that never completed are fetched again."""
 
+    def __init__(self, dataset_name):
+        self.path = os.path.join(DATAPATH, dataset_name, ".journal")
+        self.lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r") as f:
+                    self.entries = json.load(f)["files"]
+            except (ValueError, KeyError) as e:
+                logging.warning("DownloadJournal: ignoring unreadable " + self.path + ": " + str(e))
 
-    
-def prompt_stdin(prompt):
-    """Ask user for agreeing to data set licenses."""
-    # raw_input returns the empty string for "enter"
-    yes = set(["yes", "y"])
-    no = set(["no", "n"])
+    @staticmethod
+    def key(job):
+        return os.path.join(job["store_directory"], job["save_name"])
+
+    def state(self, job):
+        """Return "complete", "in-flight", "failed" or None if the file isn't recorded."""
+        entry = self.entries.get(self.key(job))
+        return entry["state"] if entry else None
+
+    def complete(self, job):
+        return self.state(job) == "complete" and os.path.exists(cache_path(job))
+
+    def mark(self, job, state, error=None):
+        import time
+
+        entry = {"state": state, "time": time.time()}
+        if error is not None:
+            entry["error"] = str(error)
+        with self.lock:
+            self.entries[self.key(job)] = entry
+            self.write()
+
+    def write(self):
+        dir_name = os.path.dirname(self.path)
+        if not os.path.exists(dir_name):
+            os.makedirs(dir_name, exist_ok=True)
+        with open(self.path + ".tmp", "w") as f:
+            json.dump({"files": self.entries}, f, indent=1, sort_keys=True)
+        os.replace(self.path + ".tmp", self.path)
+
+
+# Functions called with the metrics of every file download_data handles.
+metrics_hooks = []
+metrics_logger = logging.getLogger("pods.access.metrics")
+
+
+def add_metrics_hook(hook):
+    """Call hook with a dictionary of metrics for every file download_data fetches or finds in the cache.
 
+    The metrics are "dataset_name", "file", the "url" of the source
+    used, whether it was the "origin" rather than a mirror, "cache" which
+    is "hit" (already downloaded), "not-modified" (revalidated),
+    "shared" (linked to the same file downloaded for another data set)
+    or "miss", the "bytes" received, total "seconds", "time_to_first_byte",
+    "throughput" in bytes per second, "attempts", "retries" and "error",
+    which is None unless the download failed. The same metrics are
+    logged as JSON to the pods.access.metrics logger."""
+    metrics_hooks.append(hook)
+
+
+def remove_metrics_hook(hook):
+    metrics_hooks.remove(hook)
+
+
+def file_metrics(job, cache="miss"):
+    """Return the initial metrics for a file of a data set."""
+    return {
+        "dataset_name": job["dataset_name"],
+        "file": os.path.join(job["store_directory"], job["save_name"]),
+        "url": None,
+        "origin": None,
+        "cache": cache,
+        "bytes": 0,
+        "seconds": 0.0,
+        "time_to_first_byte": None,
+        "throughput": None,
+        "attempts": 0,
+        "retries": 0,
+        "error": None,
+    }
+
+
+def emit_metrics(metrics):
+    """Pass the metrics of a file to the logging module and every metrics hook."""
+    metrics_logger.info(json.dumps(metrics, sort_keys=True))
+    for hook in list(metrics_hooks):
+        try:
+            hook(metrics)
+        except Exception as e:
+            logging.warning("emit_metrics: metrics hook failed: " + str(e))
+
+
+def _journaled_download(job, journal, messages=True, revalidate=False):
+    import time
+
+    metrics = file_metrics(job)
+    cache_index.remove_files(job["dataset_name"], [cache_path(job)])
+    journal.mark(job, "in-flight")
+    start = time.time()
     try:
-        print(prompt)
-        if sys.version_info >= (3, 0):
-            choice = input().lower()
+        _download_job(job, messages, revalidate, metrics)
+    except Exception as e:
+        journal.mark(job, "failed", e)
+        metrics["error"] = str(e)
+        raise
+    else:
+        journal.mark(job, "complete")
+        cache_index.add_files(job["dataset_name"], [cache_path(job)])
+    finally:
+        metrics["seconds"] = time.time() - start
+        metrics["retries"] = max(0, metrics["attempts"] - 1)
+        if metrics["bytes"] and metrics["seconds"] > 0:
+            metrics["throughput"] = metrics["bytes"] / metrics["seconds"]
+        emit_metrics(metrics)
+
+
+def pending_jobs(jobs, journal, refresh=False):
+    """Return the jobs that still need to run, skipping files the journal records as complete."""
+    if refresh:
+        return jobs
+    pending = []
+    for job in jobs:
+        if journal.complete(job):
+            emit_metrics(file_metrics(job, "hit"))
         else:
-            choice = raw_input().lower()
-        # would like to test for which exceptions here
-    except:
-        print("Stdin is not implemented.")
-        print("You need to set")
-        print("overide_manual_authorize=True")
-        print("to proceed with the download. Please set that variable and continue.")
-        raise 
+            pending.append(job)
+    if len(pending) < len(jobs):
+        print(
+            str(len(jobs) - len(pending))
+            + " of "
+            + str(len(jobs))
+            + " files already downloaded."
+        )
+    return pending
 
-    if choice in yes:
-        return True
-    elif choice in no:
-        return False
-    else:
-        print("Your response was a " + choice)
-        print("Please respond with 'yes', 'y' or 'no', 'n'")
 
-def download_url(
-        url, dir_name=".", save_name=None, store_directory=None, messages=True, suffix=""
-):
-    """Download a file from a url and save it to disk."""
-    if sys.version_info >= (3, 0):
-        from urllib.parse import quote
-        from urllib.request import urlopen
-        from urllib.error import HTTPError, URLError
-    else:
-        from urllib2 import quote
-        from urllib2 import urlopen
-        from urllib2 import URLError as HTTPError
-    i = url.rfind("/")
-    file = url[i + 1 :]
-    if store_directory is not None:
-        dir_name = os.path.join(dir_name, store_directory)
-    if save_name is None:
-        save_name = file
-    save_name = os.path.join(dir_name, save_name)
-    print("Downloading ", url, "->", save_name)
-    if not os.path.exists(dir_name):
-        os.makedirs(dir_name)
-    try:
-        response = urlopen(url + suffix)
-    except HTTPError as e:
-        if not hasattr(e, "code"):
-            raise
-        if e.code > 399 and e.code < 500:
-            raise ValueError(
-                "Tried url "
-                + url
-                + suffix
-                + " and received client error "
-                + str(e.code)
-            )
-        elif e.code > 499:
-            raise ValueError(
-                "Tried url "
-                + url
-                + suffix
-                + " and received server error "
-                + str(e.code)
-            )
-    except URLError as e:
-        raise ValueError(
-            "Tried url " + url + suffix + " and failed with error " + str(e.reason)
+def _download_job(job, messages=True, revalidate=False, metrics=None):
+    import time
+
+    if metrics is None:
+        metrics = file_metrics(job)
+    origin = job["url"] + job["suffix"]
+    if not revalidate:
+        # Link to a copy another data set has already downloaded.
+        if blob_store.link_stored(cache_path(job), origin, job["sha256"], job["decompress"]):
+            metrics["cache"] = "shared"
+            return
+    sources = resolver.sources(
+        job["dataset_name"],
+        job["url"] + job["suffix"],
+        os.path.join(job["store_directory"], job["save_name"]),
+    )
+    if not sources:
+        raise ValueError("No sources to download " + job["save_name"] + " from.")
+
+    def attempt(url):
+        metrics["attempts"] += 1
+        download_url(
+            url=url,
+            dir_name=DATAPATH,
+            save_name=job["save_name"],
+            store_directory=job["store_directory"],
+            messages=messages,
+            sha256=job["sha256"],
+            revalidate=revalidate,
+            decompress=job["decompress"],
+            stats=metrics,
         )
-    with open(save_name, "wb") as f:
-        meta = response.info()
-        content_length_str = meta.get("Content-Length")
-        if content_length_str:
-            # if sys.version_info>=(3,0):
-            try:
-                file_size = int(content_length_str)
-            except:
-                try:
-                    file_size = int(content_length_str[0])
-                except:
-                    file_size = None
-            if file_size == 1:
-                file_size = None
-            # else:
-            #    file_size = int(content_length_str)
+
+    for i, url in enumerate(sources):
+        metrics["url"] = url
+        metrics["origin"] = url == job["url"] + job["suffix"]
+        start = time.time()
+        try:
+            retry_policy.call(attempt, url)
+        except Exception as e:
+            resolver.report(url, time.time() - start, e)
+            if i == len(sources) - 1:
+                raise
+            logging.info("download_data: " + url + " failed, trying next source: " + str(e))
         else:
-            file_size = None
+            resolver.report(url, time.time() - start)
+            if metrics.pop("result", None) == "not-modified":
+                metrics["cache"] = "not-modified"
+            blob_store.add(cache_path(job), metrics.pop("sha256", None), origin)
+            return
 
-        status = ""
-        file_size_dl = 0
-        block_sz = 8192
-        line_length = 30
-        percentage = 1.0 / line_length
 
-        if file_size:
-            print(
-                "|"
-                + "{:^{ll}}".format(
-                    "Downloading {:7.3f}MB".format(file_size / (1048576.0)),
-                    ll=line_length,
-                )
-                + "|"
+def download_data(dataset_name=None, prompt=prompt_stdin, workers=None, refresh=False, resource=None):
+    """Check with the user that the are happy with terms and conditions for the data set, then download it.
+
+    :param dataset_name: name of the data resource to download.
+    :param prompt: function used to ask the user to agree to the license.
+    :param workers: number of files to fetch in parallel, defaults to the workers setting in the download section of the configuration.
+    :param refresh: whether this is a refresh of cached files, in which case files are only transferred if they have changed on the server.
+    :param resource: descriptor of the files to download (see resource_descriptor), by default the data set's entry in data_resources.
+    """
+
+    future = in_flight(dataset_name)
+    if future is not None:
+        # A prefetch is already fetching the files, wait for it rather than fetch them twice.
+        try:
+            future.result()
+        except Exception as e:
+            logging.warning(
+                "download_data: prefetch of " + dataset_name + " failed, downloading again: " + str(e)
             )
-            from itertools import cycle
+        else:
+            if data_available(dataset_name, resource=resource):
+                return True
 
-            cycle_str = cycle(">")
-            sys.stdout.write("|")
+    dr = data_resource(dataset_name, resource)
+    if not authorize_download(dataset_name, prompt=prompt, resource=dr):
+        raise Exception("Permission to download data set denied.")
 
-        while True:
-            buff = response.read(block_sz)
-            if not buff:
-                break
-            file_size_dl += len(buff)
-            f.write(buff)
+    # Only one process downloads a data set at a time. Any that were
+    # waiting then find the files complete in the journal and skip them.
+    with dataset_lock(dataset_name):
+        return _download_data(dataset_name, dr, workers, refresh)
 
-            # If content_length_str was incorrect, we can end up with many too many equals signs, catches this edge case
-            # correct_meta = float(file_size_dl)/file_size <= 1.0
 
-            if file_size:
-                if (float(file_size_dl) / file_size) >= percentage:
-                    sys.stdout.write(next(cycle_str))
-                    sys.stdout.flush()
-                    percentage += 1.0 / line_length
-                # percentage = "="*int(line_length*float(file_size_dl)/file_size)
-                # status = r"[{perc: <{ll}}] {dl:7.3f}/{full:.3f}MB".format(dl=file_size_dl/(1048576.), full=file_size/(1048576.), ll=line_length, perc=percentage)
-            else:
-                sys.stdout.write(" " * (len(status)) + "\r")
-                status = r"{dl:7.3f}MB".format(
-                    dl=file_size_dl / (1048576.0),
-                    ll=line_length,
-                    perc="."
-                    * int(line_length * float(file_size_dl / (10 * 1048576.0))),
-                )
-                sys.stdout.write(status)
-                sys.stdout.flush()
+def _download_data(dataset_name, dr, workers=None, refresh=False):
+    make_room(dataset_name, dr)
+    journal = DownloadJournal(dataset_name)
+    jobs = pending_jobs(download_jobs(dataset_name, dr), journal, refresh)
+    if workers is None:
+        workers = download_workers()
+    workers = min(workers, len(jobs))
+
+    errors = []
+    if workers <= 1:
+        for job in jobs:
+            try:
+                _journaled_download(job, journal, revalidate=refresh)
+            except Exception as e:
+                logging.error("download_data: failed " + job["url"] + ": " + str(e))
+                errors.append((job, e))
+    else:
+        from concurrent.futures import ThreadPoolExecutor, as_completed
 
-            # sys.stdout.write(status)
+        print(
+            "Downloading "
+            + str(len(jobs))
+            + " files with "
+            + str(workers)
+            + " parallel workers."
+        )
+        # Progress bars from several threads would be interleaved, so only the per file messages are shown.
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(_journaled_download, job, journal, False, refresh): job
+                for job in jobs
+            }
+            for future in as_completed(futures):
+                job = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    logging.error("download_data: failed " + job["url"] + ": " + str(e))
+                    errors.append((job, e))
 
-        if file_size:
-            sys.stdout.write("|")
-            sys.stdout.flush()
+    if not errors:
+        # Loaders only call download_data when the data set isn't
+        # available, so the members they read are extracted here.
+        extract_members(dataset_name, dr)
+    record_download(dataset_name)
+    raise_download_errors(dataset_name, jobs, errors)
+    return True
 
-        print(status)
-        # if we wanted to get more sophisticated maybe we should check the response code here again even for successes.
 
-def data_details_return(data, data_set):
-    """Update the data details component of the data dictionary with details drawn from the data_resources.json file."""
-    data.update(data_resources[data_set])
-    return data
+def raise_download_errors(dataset_name, jobs, errors):
+    """Raise an error describing every file of a data set that failed to download."""
+    if len(errors) == 1:
+        raise errors[0][1]
+    elif errors:
+        raise ValueError(
+            "Failed to download "
+            + str(len(errors))
+            + " of "
+            + str(len(jobs))
+            + " files for "
+            + dataset_name
+            + ":\n"
+            + "\n".join(job["url"] + ": " + str(e) for job, e in errors)
+        )
 
 
+async def download_data_async(dataset_name=None, prompt=prompt_stdin, workers=None, refresh=False, resource=None):
+    """Download a data set from a coroutine without blocking the event loop.
 
-def download_data(dataset_name=None, prompt=prompt_stdin):
-    """Check with the user that the are happy with terms and conditions for the data set, then download it."""
+    The license prompt and the download, which holds the data set's lock
+    while its files are fetched in parallel, run in the event loop's
+    default executor, so several data sets can be awaited together with
+    asyncio.gather.
 
-    dr = data_resources[dataset_name]
-    if not authorize_download(dataset_name, prompt=prompt):
+    :param dataset_name: name of the data resource to download.
+    :param prompt: function used to ask the user to agree to the license.
+    :param workers: number of files to fetch in parallel, defaults to the workers setting in the download section of the configuration.
+    :param refresh: whether this is a refresh of cached files, in which case files are only transferred if they have changed on the server.
+    :param resource: descriptor of the files to download (see resource_descriptor), by default the data set's entry in data_resources.
+    """
+    import asyncio
+    from functools import partial
+
+    loop = asyncio.get_running_loop()
+    future = in_flight(dataset_name)
+    if future is not None:
+        try:
+            await asyncio.wrap_future(future)
+        except Exception as e:
+            logging.warning(
+                "download_data_async: prefetch of " + dataset_name + " failed, downloading again: " + str(e)
+            )
+        else:
+            if data_available(dataset_name, resource=resource):
+                return True
+    dr = data_resource(dataset_name, resource)
+    authorized = await loop.run_in_executor(
+        None, partial(authorize_download, dataset_name, prompt=prompt, resource=dr)
+    )
+    if not authorized:
         raise Exception("Permission to download data set denied.")
 
-    if "suffices" in dr:
-        for url, filenames, suffices in zip(dr["urls"], dr["files"], dr["suffices"]):
-            for filename, suffix in zip(filenames, suffices):
-                download_url(
-                    url=os.path.join(url, filename).replace(" ", "%20"),
-                    dir_name = DATAPATH,
-                    save_name = filename,
-                    store_directory=dataset_name,
-                    suffix=suffix,
-                )
-    elif "dirs" in dr:
-        for url, dirnames, filenames in zip(dr["urls"], dr["dirs"], dr["files"]):
-            for filename, dirname in zip(filenames, dirnames):
-                print(filename, dirname)
-                download_url(
-                    url=os.path.join(url, dirname, filename).replace(" ", "%20"),
-                    dir_name=DATAPATH,
-                    save_name = filename,
-                    store_directory=os.path.join(dataset_name, dirname),
-                )
-    else:
-        for url, filenames in zip(dr["urls"], dr["files"]):
-            for filename in filenames:
-                download_url(
-                    url=os.path.join(url, filename).replace(" ", "%20"),
-                    dir_name=DATAPATH,
-                    save_name = filename,
-                    store_directory=dataset_name,
-                )
-    return True
+    def download():
+        with dataset_lock(dataset_name):
+            return _download_data(dataset_name, dr, workers, refresh)
+
+    return await loop.run_in_executor(None, download)
+
+# Prefetches under way, by data set name, and the threads that run them.
+prefetching = {}
+prefetch_lock = threading.Lock()
+prefetch_executor = None
+prefetch_thread = threading.local()
+
+
+def in_flight(dataset_name):
+    """Return the future of a prefetch of the data set that is under way, or None.
+
+    A prefetch doesn't see its own future, so that the loader or
+    download_data it calls doesn't wait on itself."""
+    if dataset_name in getattr(prefetch_thread, "names", ()):
+        return None
+    with prefetch_lock:
+        return prefetching.get(dataset_name)
+
+
+def prefetch_target(name):
+    """Return the data resource name and loader (or None) for a name passed to prefetch."""
+    import inspect
+    from . import datasets
+
+    if name in data_resources:
+        return name, None
+    loader = getattr(datasets, name, None)
+    if not callable(loader):
+        raise ValueError("Unknown data set or loader " + name)
+    parameter = inspect.signature(loader).parameters.get("data_set")
+    if parameter is None or parameter.default is inspect.Parameter.empty:
+        return name, loader
+    return parameter.default, loader
+
+
+def _prefetch(dataset_name, loader, load):
+    names = prefetch_thread.__dict__.setdefault("names", set())
+    names.add(dataset_name)
+    try:
+        if dataset_name in data_resources and not data_available(dataset_name):
+            # Permission was given when the prefetch was requested, so the
+            # files are downloaded before the loader runs and would ask again.
+            download_data(dataset_name, prompt=lambda prompt: True)
+        if load and loader is not None:
+            return loader()
+        return True
+    finally:
+        names.discard(dataset_name)
+        with prefetch_lock:
+            prefetching.pop(dataset_name, None)
+
+
+def prefetch(names, prompt=prompt_stdin, load=False):
+    """Download data sets in a background thread pool so that they are cached before they are needed.
+
+    While a prefetch is under way download_data, and so the loaders,
+    wait for it instead of downloading the same files again, and
+    prefetching a data set that is already being fetched returns the
+    existing future. Permission to download is asked for straight away,
+    in the calling thread.
+
+    :param names: data resource names, or names of loaders in pods.datasets, e.g. ["airline_delay", "cmu_mocap_35_walk_jog"].
+    :param prompt: function used to ask the user to agree to each license.
+    :param load: for loader names, also run the loader in the background so the files are parsed as well as downloaded. Loaders whose data set isn't in data_resources, such as the cmu_mocap loaders that choose which files to fetch from their arguments, are always run, and ask for permission to download when they run.
+    :returns: a list with a concurrent.futures.Future for each name. Its result is the loaded data if the loader was run, True otherwise.
+    """
+    global prefetch_executor
+    from concurrent.futures import ThreadPoolExecutor
+
+    if isinstance(names, str):
+        names = [names]
+    futures = []
+    for name in names:
+        dataset_name, loader = prefetch_target(name)
+        run_loader = load
+        if dataset_name not in data_resources:
+            # Only the loader knows which files it reads, so it is run to
+            # fetch them, and the prefetch is known by the loader's name.
+            dataset_name, run_loader = name, True
+        with prefetch_lock:
+            future = prefetching.get(dataset_name)
+        if future is None:
+            if (
+                dataset_name in data_resources
+                and not data_available(dataset_name)
+                and not authorize_download(dataset_name, prompt=prompt)
+            ):
+                raise Exception("Permission to download data set denied.")
+            with prefetch_lock:
+                future = prefetching.get(dataset_name)
+                if future is None:
+                    if prefetch_executor is None:
+                        prefetch_executor = ThreadPoolExecutor(
+                            max_workers=download_workers(), thread_name_prefix="pods-prefetch"
+                        )
+                    future = prefetch_executor.submit(_prefetch, dataset_name, loader, run_loader)
+                    prefetching[dataset_name] = future
+        futures.append(future)
+    return futures
+
 
 def clear_cache(dataset_name=None):
     """Remove a data set from the cache"""
     dr = data_resources[dataset_name]
+    for job in download_jobs(dataset_name, dr):
+        path = cache_path(job)
+        for extension in ["", ".part", ".part.validators", ".validators"]:
+            if os.path.exists(path + extension):
+                logging.info("clear_cache: remove " + path + extension)
+                os.unlink(path + extension)
+    parsed = os.path.join(DATAPATH, dataset_name, PARSED_DIR)
+    if os.path.isdir(parsed):
+        import shutil
+
+        logging.info("clear_cache: remove directory " + parsed)
+        shutil.rmtree(parsed)
     if "dirs" in dr:
-        for dirnames, filenames in zip(dr["dirs"], dr["files"]):
-            for dirname, filename in zip(dirnames, filenames):
-                path = os.path.join(DATAPATH, dataset_name, dirname, filename)
-                if os.path.exists(path):
-                    logging.info("clear_cache: removing " + path)
-                    os.unlink(path)
+        for dirnames in dr["dirs"]:
             for dirname in dirnames:
                 path = os.path.join(DATAPATH, dataset_name, dirname)
                 if os.path.exists(path):
                     logging.info("clear_cache: remove directory " + path)
                     os.rmdir(path)
+    journal = DownloadJournal(dataset_name).path
+    if os.path.exists(journal):
+        logging.info("clear_cache: remove " + journal)
+        os.unlink(journal)
+    cache_index.remove(dataset_name)
+    with blob_store.lock:
+        blob_store.collect()
+
+
+# Loaders keep the arrays they parse from a data set's files here, within its directory.
+PARSED_DIR = ".parsed"
+
+
+def parse_cache_enabled():
+    return config.getboolean("datasets", "parse_cache")
+
+
+# The pods modules loaders parse files with, and the libraries that read them.
+PARSE_HELPERS = ["util.py", "mocap.py"]
+PARSE_LIBRARIES = ["numpy", "scipy", "pandas"]
+_parse_environment = None
+
+
+def parse_environment():
+    """Return what the arrays loaders parse depend on besides their own code: the digests of the pods modules they call and the versions of the libraries that read the files."""
+    global _parse_environment
+    if _parse_environment is None:
+        from importlib import metadata
+
+        environment = {}
+        for filename in PARSE_HELPERS:
+            environment[filename] = file_sha256(os.path.join(os.path.dirname(__file__), filename)).hexdigest()
+        for library in PARSE_LIBRARIES:
+            try:
+                environment[library] = metadata.version(library)
+            except metadata.PackageNotFoundError:
+                environment[library] = None
+        _parse_environment = environment
+    return _parse_environment
+
+
+def parse_fingerprint(loader, dataset_name):
+    """Return what the arrays a loader parses depend on: its code, the modules and libraries it calls (see parse_environment) and the size and modification time of each of the data set's files."""
+    import marshal
+
+    files = []
+    for job in download_jobs(dataset_name, data_resources[dataset_name]):
+        path = cache_path(job)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        files.append([os.path.relpath(path, DATAPATH), stat.st_size, stat.st_mtime_ns])
+    return {
+        "code": hashlib.sha256(marshal.dumps(loader.__code__)).hexdigest(),
+        "environment": parse_environment(),
+        "files": files,
+    }
+
+
+def parsed_path(loader, dataset_name, arguments):
+    """Return where the parsed arrays of a call to a loader with the given arguments are kept."""
+    key = hashlib.sha256(repr(sorted(arguments.items())).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(DATAPATH, dataset_name, PARSED_DIR, loader.__name__ + "-" + key + ".npz")
+
+
+def read_parsed(path, fingerprint):
+    """Read the data a loader returned from a parse cache file.
+
+    Returns the data and whether the details of the data resource should
+    be added to it, or None if the file is missing or out of date."""
+    import numpy as np
+
+    try:
+        with np.load(path, allow_pickle=False) as stored:
+            meta = json.loads(str(stored["__meta__"]))
+            if meta["fingerprint"] != fingerprint:
+                return None
+            data = dict(meta["values"])
+            for key in meta["arrays"]:
+                data[key] = stored[key]
+            for key in meta["scalars"]:
+                data[key] = stored[key][()]
+    except (OSError, ValueError, KeyError) as e:
+        if os.path.exists(path):
+            logging.warning("read_parsed: ignoring unreadable " + path + ": " + str(e))
+        return None
+    return data, meta["details"]
+
+
+def write_parsed(path, fingerprint, data, details=True):
+    """Write the data a loader returned to a parse cache file.
+
+    Arrays are stored as they are and other values as json. Returns False
+    without writing anything if there are values that can't be stored
+    without pickling them, such as data frames or arrays of objects, or
+    that json doesn't read back unchanged, such as tuples.
+
+    :param details: whether the loader added the details of the data resource, which are left out of data.
+    """
+    import numpy as np
+
+    arrays = {}
+    meta = {"fingerprint": fingerprint, "details": details, "values": {}, "arrays": [], "scalars": []}
+    for key, value in data.items():
+        if isinstance(value, (np.ndarray, np.generic)):
+            if value.dtype.hasobject or key == "__meta__":
+                return False
+            arrays[key] = value
+            meta["arrays" if isinstance(value, np.ndarray) else "scalars"].append(key)
+        else:
+            meta["values"][key] = value
+    try:
+        values = meta["values"]
+        meta = json.dumps(meta)
+    except (TypeError, ValueError):
+        return False
+    # json turns tuples into lists and dictionary keys into strings, values
+    # it doesn't give back as they were are left to the loader.
+    if json.loads(meta)["values"] != values:
+        return False
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_name = path + "." + str(os.getpid()) + "." + str(threading.get_ident()) + ".tmp"
+    with open(tmp_name, "wb") as f:
+        np.savez(f, __meta__=np.array(meta), **arrays)
+    os.replace(tmp_name, path)
+    return True
+
+
+def parse_cache(loader):
+    """Decorate a loader so that the arrays it parses are kept on disk and read back on later calls.
+
+    The loader's return value is stored in the data set's .parsed
+    directory, in an .npz file named after the loader and its arguments,
+    along with a fingerprint of the loader's code and the data set's
+    files. A later call with the same arguments reads the file instead of
+    parsing the data set again, as long as the fingerprint still matches.
+    The details of the data resource are not stored, they are added with
+    data_details_return. Loaders whose data set isn't in data_resources,
+    calls that refresh the data, and return values that hold anything other
+    than arrays and json values, such as data frames, are not cached. Set
+    parse_cache in the datasets section of the configuration to False to
+    turn the cache off.
+
+    Only loaders whose return value depends on nothing but their arguments
+    and the data set's files should be decorated. Loaders that draw random
+    numbers, even from a seed, are left alone since reading their return
+    value back would leave the random state as it was. Such a loader can
+    instead decorate a helper that parses the files, and draw the random
+    numbers from what it returns, as pumadyn does.
+    """
+    import functools
+    import inspect
+
+    signature = inspect.signature(loader)
+
+    @functools.wraps(loader)
+    def cached_loader(*args, **kwargs):
+        arguments = signature.bind(*args, **kwargs)
+        arguments.apply_defaults()
+        arguments = dict(arguments.arguments)
+        dataset_name = arguments.get("data_set")
+        refresh = arguments.pop("refresh_data", False)
+        if (
+            not isinstance(dataset_name, str)
+            or dataset_name not in data_resources
+            or not parse_cache_enabled()
+        ):
+            return loader(*args, **kwargs)
+        path = parsed_path(loader, dataset_name, arguments)
+        if not refresh and data_available(dataset_name):
+            stored = read_parsed(path, parse_fingerprint(loader, dataset_name))
+            if stored is not None:
+                data, details = stored
+                return data_details_return(data, dataset_name) if details else data
+
+        data = loader(*args, **kwargs)
+        if isinstance(data, dict):
+            resource = data_resources[dataset_name]
+            details = all(key in data for key in resource)
+            parsed = {key: value for key, value in data.items() if not (details and key in resource)}
+            try:
+                with dataset_lock(dataset_name):
+                    fingerprint = parse_fingerprint(loader, dataset_name)
+                    if fingerprint is not None and not write_parsed(path, fingerprint, parsed, details):
+                        logging.debug("parse_cache: " + loader.__name__ + " returns values that can't be stored")
+            except OSError as e:
+                logging.warning("parse_cache: could not write " + path + ": " + str(e))
+        return data
+
+    return cached_loader
+
+
+def data_available(dataset_name=None, verify=False, resource=None):
+    """Check if the data set is available on the local machine already.
+
+    Files are only moved into the cache once their download has completed
+    and matched any SHA-256 digest listed for them, and are then recorded
+    in the cache index, so by default each indexed file is only checked to
+    still have the size it was downloaded with, which also finds files
+    removed by hand, rather than being read or looked for in its directory
+    (see the validate setting in the datasets section of the
+    configuration). Files missing from the index are looked for on disk,
+    unless the download journal records that their last download is still
+    in flight or failed. Set verify to recompute the digests of the cached
+    files as well. The files checked are those of resource, if a descriptor
+    is given (see resource_descriptor). Checking doesn't count as a use of
+    the data set, loaders record that through data_details_return."""
+    dr = data_resource(dataset_name, resource)
+    jobs = download_jobs(dataset_name, dr)
+    unindexed = cache_index.unindexed(dataset_name, [cache_path(job) for job in jobs])
+    if unindexed:
+        journal = DownloadJournal(dataset_name)
+        for job in jobs:
+            path = cache_path(job)
+            if path not in unindexed:
+                continue
+            if not os.path.exists(path):
+                return False
+            if journal.state(job) in ["in-flight", "failed"]:
+                return False
+        cache_index.add_files(dataset_name, unindexed)
+    if verify:
+        for job in jobs:
+            path = cache_path(job)
+            # Digests of decompressed files are of the data as downloaded, which isn't kept.
+            if job["sha256"] and not job["decompress"] and file_sha256(path).hexdigest() != job["sha256"].lower():
+                logging.info("data_available: checksum mismatch for " + path)
+                return False
+    return True
+
+
+def extract_members(dataset_name=None, resource=None):
+    """Extract the archive members a data set's loader reads into its cache directory.
+
+    Only the members listed in the "members" field of the data resource
+    are written, the rest of each archive is left where it is. Members
+    are written whole under their final name, so several processes can
+    extract a data set in turn. download_data calls this once the files
+    have been downloaded."""
+    dr = data_resource(dataset_name, resource)
+    extracted = []
+    with dataset_lock(dataset_name):
+        for job in download_jobs(dataset_name, dr):
+            if job["members"]:
+                extracted += extract_archive(
+                    cache_path(job), os.path.join(DATAPATH, dataset_name), job["members"]
+                )
+    return extracted
+
+
+def member_matches(name, patterns):
+    """Check if an archive member name matches any of a list of names or glob patterns."""
+    import fnmatch
+
+    if name.startswith("./"):
+        name = name[2:]
+    return any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns)
+
+
+def member_path(dir_name, name):
+    """Return where an archive member is extracted to below dir_name."""
+    path = os.path.normpath(name)
+    if os.path.isabs(path) or path.split(os.sep)[0] == os.pardir:
+        raise ValueError("Archive member " + name + " would be extracted outside " + dir_name)
+    return os.path.join(dir_name, path)
+
+
+def extracted_since(path, filename):
+    """Check if a member has been extracted since the archive was downloaded."""
+    return os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(filename)
+
+
+def write_member(source, dir_name, name):
+    """Write an archive member read from the file like source below dir_name."""
+    path = member_path(dir_name, name)
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".part", "wb") as f:
+        while True:
+            buff = source.read(1048576)
+            if not buff:
+                break
+            f.write(buff)
+    os.replace(path + ".part", path)
+    return path
+
 
+def extract_archive(filename, dir_name, patterns):
+    """Extract the members of a zip or tar archive that match any of the names or glob patterns given.
+
+    Members are read straight from the archive. When only exact names
+    are given, reading a tar archive stops once they have all been found,
+    so the rest of a compressed archive is never decompressed."""
+    import tarfile
+    import zipfile
+
+    print("Extracting " + ", ".join(patterns) + " from " + filename + ".")
+    extracted = []
+    remaining = None
+    if not any(char in pattern for pattern in patterns for char in "*?["):
+        remaining = set(patterns)
+    if zipfile.is_zipfile(filename):
+        with zipfile.ZipFile(filename, "r") as archive:
+            for info in archive.infolist():
+                if info.filename.endswith("/") or not member_matches(info.filename, patterns):
+                    continue
+                path = member_path(dir_name, info.filename)
+                if extracted_since(path, filename):
+                    # Already extracted, for instance by another process.
+                    extracted.append(path)
+                    continue
+                with archive.open(info) as source:
+                    extracted.append(write_member(source, dir_name, info.filename))
     else:
-        for filenames in dr["files"]:
-            for filename in filenames:
-                path = os.path.join(DATAPATH, dataset_name, filename)
-                if os.path.exists(path):
-                    logging.info("clear_cache: remove " + path)
-                    os.unlink(path)
+        with tarfile.open(filename) as archive:
+            for member in archive:
+                if not member.isfile() or not member_matches(member.name, patterns):
+                    continue
+                path = member_path(dir_name, member.name)
+                if extracted_since(path, filename):
+                    extracted.append(path)
+                else:
+                    with closing(archive.extractfile(member)) as source:
+                        extracted.append(write_member(source, dir_name, member.name))
+                if remaining is not None:
+                    remaining.discard(member.name[2:] if member.name.startswith("./") else member.name)
+                    if not remaining:
+                        break
+    if not extracted:
+        raise ValueError("No members matching " + ", ".join(patterns) + " found in " + filename)
+    return extracted
 
 
-def data_available(dataset_name=None):
-    """Check if the data set is available on the local machine already."""
-    dr = data_resources[dataset_name]
-    if "dirs" in dr:
-        for dirnames, filenames in zip(dr["dirs"], dr["files"]):
-            for dirname, filename in zip(dirnames, filenames):
-                if not os.path.exists(os.path.join(DATAPATH, dataset_name, dirname, filename)):
-                    return False
+def verify_file(job, journal, digests=True):
+    """Check a cached file of a data set, returning a problem ("partial", "size" or "corrupt") and a description, or None, None if it is sound."""
+    path = cache_path(job)
+    if journal.state(job) in ["in-flight", "failed"] or os.path.exists(path + ".part"):
+        return "partial", "the last download of the file didn't complete"
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return "partial", "the file is missing"
+    indexed = cache_index.files(job["dataset_name"]).get(CacheIndex.key(job["dataset_name"], path))
+    if indexed is not None and indexed != size:
+        return "size", "the file has " + str(size) + " bytes but " + str(indexed) + " were downloaded"
+    if not digests:
+        return None, None
+    expected = None
+    if job["sha256"] and not job["decompress"]:
+        expected = job["sha256"].lower()
     else:
-        for filenames in dr["files"]:
-            for filename in filenames:
-                if not os.path.exists(os.path.join(DATAPATH, dataset_name, filename)):
-                    return False
-    return True
+        blob = blob_store.lookup(job["url"] + job["suffix"])
+        if blob is not None and os.path.samefile(blob, path):
+            # A file in the blob store is named by its digest.
+            expected = os.path.basename(blob)
+    if expected is not None:
+        digest = file_sha256(path).hexdigest()
+        if digest != expected:
+            return "corrupt", "the file's SHA-256 digest is " + digest + " rather than " + expected
+    return None, None
+
+
+def verify_cache(dataset_names=None, repair=False, digests=True, workers=None, prompt=prompt_stdin):
+    """Check the files of the data sets in the cache and optionally download the broken ones again.
+
+    Every file of each data set that has been downloaded is checked in
+    parallel: files missing from a data set or whose last download
+    didn't complete are "partial", files whose size differs from the
+    size downloaded are "size" and, if digests is set, files that don't
+    match the SHA-256 digest listed for them or under which they are
+    kept in the blob store are "corrupt". Data sets with no files in the
+    cache are skipped.
 
+    :param dataset_names: the data sets to check, defaults to all of them.
+    :param repair: remove the broken files and download just those again.
+    :param digests: recompute the digests of the files, which means reading all of them.
+    :param workers: number of files checked in parallel, defaults to the workers setting in the download section of the configuration.
+    :param prompt: function used to ask the user to agree to the license of a data set being repaired.
+    :returns: a list of dictionaries describing each problem found, with the "dataset_name", "path", "problem" and "detail", and whether it was "repaired".
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    if dataset_names is None:
+        dataset_names = sorted(data_resources)
+    checks = []
+    for dataset_name in dataset_names:
+        try:
+            jobs = download_jobs(dataset_name, data_resources[dataset_name])
+        except (KeyError, TypeError) as e:
+            logging.info("verify_cache: skipping " + dataset_name + ": " + str(e))
+            continue
+        if not any(os.path.exists(cache_path(job)) for job in jobs):
+            continue
+        journal = DownloadJournal(dataset_name)
+        checks += [(job, journal) for job in jobs]
+    if workers is None:
+        workers = download_workers()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        results = list(executor.map(lambda check: verify_file(check[0], check[1], digests), checks))
+
+    problems = []
+    for (job, journal), (problem, detail) in zip(checks, results):
+        if problem is None:
+            continue
+        path = cache_path(job)
+        print(job["dataset_name"] + ": " + problem + " " + path + ", " + detail + ".")
+        problems.append(
+            {"dataset_name": job["dataset_name"], "path": path, "problem": problem, "detail": detail, "repaired": False}
+        )
+        if repair:
+            with dataset_lock(job["dataset_name"]):
+                cache_index.remove_files(job["dataset_name"], [path])
+                blob_store.forget(path, job["url"] + job["suffix"], None if job["decompress"] else job["sha256"])
+                for extension in ["", ".part", ".part.validators", ".validators"]:
+                    if os.path.exists(path + extension):
+                        os.unlink(path + extension)
+                journal.mark(job, "failed", "verify_cache: " + detail)
+    if repair:
+        for dataset_name in sorted(set(problem["dataset_name"] for problem in problems)):
+            try:
+                download_data(dataset_name, prompt=prompt)
+            except Exception as e:
+                logging.error("verify_cache: failed to repair " + dataset_name + ": " + str(e))
+        for problem in problems:
+            problem["repaired"] = os.path.exists(problem["path"])
+    print(
+        "Checked "
+        + str(len(checks))
+        + " files, found "
+        + str(len(problems))
+        + " problems"
+        + (", repaired " + str(sum(problem["repaired"] for problem in problems)) if repair else "")
+        + "."
+    )
+    return problems
+
+
+def verify_cache_main(argv=None):
+    """Command line interface to verify_cache, installed as pods-verify-cache. Returns 1 if problems remain."""
+    import argparse
 
-def authorize_download(dataset_name=None, prompt=prompt_stdin):
+    parser = argparse.ArgumentParser(
+        prog="pods-verify-cache", description="Check the files in the pods data cache."
+    )
+    parser.add_argument("datasets", nargs="*", help="data sets to check, all of them if none are given")
+    parser.add_argument("--repair", action="store_true", help="download broken files again")
+    parser.add_argument("--no-digests", action="store_true", help="only check that files are complete, without reading them")
+    parser.add_argument("--workers", type=int, default=None, help="number of files checked in parallel")
+    parser.add_argument("--yes", action="store_true", help="agree to the licenses of data sets being repaired")
+    args = parser.parse_args(argv)
+
+    global overide_manual_authorize
+    if args.yes:
+        overide_manual_authorize = True
+    problems = verify_cache(
+        args.datasets or None,
+        repair=args.repair,
+        digests=not args.no_digests,
+        workers=args.workers,
+    )
+    return 1 if any(not problem["repaired"] for problem in problems) else 0
+
+
+def authorize_download(dataset_name=None, prompt=prompt_stdin, resource=None):
     """Check with the user that the are happy with terms and conditions for the data set."""
     print("Acquiring resource: " + dataset_name)
     # TODO, check resource is in dictionary!
     print("")
-    dr = data_resources[dataset_name]
+    dr = data_resource(dataset_name, resource)
     print("Details of data: ")
     print(dr["details"])
     print("")
@@ -314,6 +2937,8 @@ def authorize_download(dataset_name=None, prompt=prompt_stdin):
 
 def pmlr_proceedings_list(data_set):
     """Open the proceedings list from a yaml file."""
+    import yaml
+
     with open(os.path.join(DATAPATH, data_set, "proceedings.yaml"), "r") as f:
         try:
             proceedings = yaml.safe_load(f)
@@ -339,11 +2964,19 @@ def kepler_telescope_urls_files(datasets, messages=True):
     dataset_dir = os.path.join(DATAPATH, "kepler_telescope")
     if not os.path.isdir(dataset_dir):
         os.makedirs(dataset_dir)
+    missing = set(missing_files(
+        "kepler_telescope",
+        [
+            os.path.join(dataset_dir, "kplr" + kepler_id + "-" + dataset + "_llc.fits")
+            for dataset in datasets
+            for kepler_id in datasets[dataset]
+        ],
+    ))
     for dataset in datasets:
         for kepler_id in datasets[dataset]: 
             file_name = "kplr" + kepler_id + "-" + dataset + "_llc.fits"
             cur_dataset_file = os.path.join(dataset_dir, file_name)
-            if not os.path.exists(cur_dataset_file):
+            if cur_dataset_file in missing:
                 file_download = [file_name]
                 resource["files"].append(file_download)
                 resource["urls"].append(
@@ -386,13 +3019,20 @@ def cmu_urls_files(subj_motions, messages=True):
 
     all_motions = []
 
+    skel_dir = os.path.join(DATAPATH, "cmu_mocap")
+    paths = []
+    for i in range(len(subjects)):
+        paths.append(os.path.join(skel_dir, subjects[i] + ".asf"))
+        for j in range(len(motions[i])):
+            paths.append(os.path.join(skel_dir, subjects[i] + "_" + motions[i][j] + ".amc"))
+    missing = set(missing_files("cmu_mocap", paths))
+
     for i in range(len(subjects)):
-        skel_dir = os.path.join(DATAPATH, "cmu_mocap")
         cur_skel_file = os.path.join(skel_dir, subjects[i] + ".asf")
 
         url_required = False
         file_download = []
-        if not os.path.exists(cur_skel_file):
+        if cur_skel_file in missing:
             # Current skel file doesn't exist.
             if not os.path.isdir(skel_dir):
                 os.makedirs(skel_dir)
@@ -402,7 +3042,7 @@ def cmu_urls_files(subj_motions, messages=True):
         for j in range(len(motions[i])):
             file_name = subjects[i] + "_" + motions[i][j] + ".amc"
             cur_motion_file = os.path.join(skel_dir, file_name)
-            if not os.path.exists(cur_motion_file):
+            if cur_motion_file in missing:
                 url_required = True
                 file_download.append(subjects[i] + "_" + motions[i][j] + ".amc")
         if url_required:
@@ -0,0 +1,343 @@
+# Copyright 2014 Open Data Science Initiative and other authors. See AUTHORS.txt
+# Licensed under the BSD 3-clause license (see LICENSE.txt)
+"""Find data sets without calling their loaders.
+
+The catalog has an entry for each loader in pods.datasets and for each
+data resource no loader reads. An entry gives the data resource the
+loader reads, its size in bytes, its license, how many files it has, the
+keys of the dictionary the loader returns and, where it is known, the
+shape of each array the loader returns. For example
+
+    pods.catalog.search(max_size="10M", task="supervised")
+
+lists the data sets for regression or classification that take up less
+than 10 megabytes.
+
+The keys are found by reading the source of pods.datasets, so neither it
+nor pandas or scipy are imported. The index is shipped as catalog.json
+next to this file, built with the shapes of what the loaders return when
+pods is released (pods-build-catalog --shapes). If the contents of
+data_resources.json or datasets.py have changed since, it is built again
+into .catalog.json in the data cache, keeping the shapes it had.
+"""
+import ast
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from . import access
+
+INDEX_VERSION = 2
+
+# Returned by loaders with both inputs and outputs, or only outputs.
+TASKS = ["supervised", "unsupervised"]
+
+index_lock = threading.Lock()
+_index = None
+
+
+def index_path():
+    """Return where the index shipped with pods is kept."""
+    return os.path.join(os.path.dirname(__file__), "catalog.json")
+
+
+def cached_index_path():
+    """Return where an index built again since pods was installed is kept."""
+    return os.path.join(access.DATAPATH, ".catalog.json")
+
+
+def sources():
+    """Return the files the index is built from."""
+    return [
+        access.data_resources.filename,
+        os.path.join(os.path.dirname(__file__), "datasets.py"),
+    ]
+
+
+def source_digests():
+    """Return the SHA-256 digests of the files the index is built from, which installing pods doesn't change."""
+    digests = {}
+    for filename in sources():
+        try:
+            digests[os.path.basename(filename)] = access.file_sha256(filename).hexdigest()
+        except OSError:
+            digests[os.path.basename(filename)] = None
+    return digests
+
+
+def default_arguments(function):
+    """Return the default values of a function definition's arguments that are constants."""
+    arguments = function.args
+    defaults = {}
+    positional = arguments.posonlyargs + arguments.args
+    for argument, default in zip(positional[len(positional) - len(arguments.defaults) :], arguments.defaults):
+        defaults[argument.arg] = default
+    for argument, default in zip(arguments.kwonlyargs, arguments.kw_defaults):
+        if default is not None:
+            defaults[argument.arg] = default
+    return {
+        name: default.value for name, default in defaults.items() if isinstance(default, ast.Constant)
+    }
+
+
+def returned_keys(function):
+    """Return the keys of the dictionaries a loader passes to access.data_details_return."""
+    keys = set()
+    for node in ast.walk(function):
+        if not isinstance(node, ast.Call) or not node.args:
+            continue
+        name = node.func.attr if isinstance(node.func, ast.Attribute) else getattr(node.func, "id", None)
+        if name == "data_details_return" and isinstance(node.args[0], ast.Dict):
+            keys.update(
+                key.value
+                for key in node.args[0].keys
+                if isinstance(key, ast.Constant) and isinstance(key.value, str)
+            )
+    return sorted(keys)
+
+
+def loaders(filename=None):
+    """Find the loaders in the source of pods.datasets.
+
+    A loader is a public function with a data_set argument that defaults to
+    the name of a data resource. Returns a dictionary keyed by loader name
+    giving the data resource, the keys the loader returns and whether it
+    can be called without arguments."""
+    if filename is None:
+        filename = sources()[1]
+    with open(filename, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), filename)
+    found = {}
+    # Loaders that need an optional dependency are defined inside an if.
+    nodes = list(tree.body)
+    while nodes:
+        node = nodes.pop(0)
+        if isinstance(node, ast.If):
+            nodes = node.body + nodes
+            continue
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) or node.name.startswith("_"):
+            continue
+        defaults = default_arguments(node)
+        if not isinstance(defaults.get("data_set"), str):
+            continue
+        arguments = node.args.posonlyargs + node.args.args
+        found[node.name] = {
+            "data_set": defaults["data_set"],
+            "keys": returned_keys(node),
+            "needs_arguments": len(arguments) > len(node.args.defaults),
+        }
+    return found
+
+
+def task(keys):
+    """Guess the task a data set is for from the keys its loader returns."""
+    if "Y" in keys and "X" in keys:
+        return "supervised"
+    if "Y" in keys:
+        return "unsupervised"
+    return None
+
+
+def resource_entry(name, resource):
+    files = resource.get("files") or []
+    return {
+        "name": name,
+        "data_set": name,
+        "loader": None,
+        "size": resource.get("size"),
+        "license": resource.get("license"),
+        "files": sum(len(filenames) for filenames in files),
+        "details": resource.get("details"),
+        "keys": [],
+        "task": None,
+        "shapes": {},
+        "needs_arguments": False,
+    }
+
+
+def shapes(data):
+    """Return the shapes of the arrays and data frames in a loader's return value."""
+    found = {}
+    for key, value in data.items():
+        shape = getattr(value, "shape", None)
+        if isinstance(shape, tuple):
+            found[key] = list(shape)
+    return found
+
+
+def run_loader(name):
+    """Call a loader whose data are cached and return the shapes of what it returns, or None."""
+    from . import datasets
+
+    try:
+        return shapes(getattr(datasets, name)())
+    except Exception as e:
+        logging.warning("catalog: could not run " + name + ": " + str(e))
+        return None
+
+
+def build_index(target=None, load=False, previous=None):
+    """Build the catalog index and write it to target.
+
+    :param target: the file to write, catalog.json next to this module by default. Pass False to build the index without writing it.
+    :param load: whether to run the loaders that need no arguments and whose data are already cached, to record the shapes of what they return. Nothing is downloaded.
+    :param previous: an earlier index, whose shapes are kept for loaders that aren't run.
+    """
+    entries = {}
+    for name in access.data_resources:
+        entries[name] = resource_entry(name, access.data_resources[name])
+    for name, loader in loaders().items():
+        data_set = loader["data_set"]
+        if data_set in access.data_resources:
+            entry = resource_entry(data_set, access.data_resources[data_set])
+        else:
+            entry = resource_entry(data_set, {})
+        entry.update(
+            name=name,
+            loader=name,
+            keys=loader["keys"],
+            task=task(loader["keys"]),
+            needs_arguments=loader["needs_arguments"],
+        )
+        entries[name] = entry
+    # Data resources that a loader reads are listed under the loader.
+    for name in list(entries):
+        if entries[name]["loader"] is None and any(
+            entry["loader"] is not None and entry["data_set"] == name for entry in entries.values()
+        ):
+            del entries[name]
+
+    old_entries = (previous or {}).get("entries", {})
+    for name, entry in entries.items():
+        if name in old_entries and old_entries[name]["keys"] == entry["keys"]:
+            entry["shapes"] = old_entries[name]["shapes"]
+        if (
+            load
+            and entry["loader"] is not None
+            and not entry["needs_arguments"]
+            and entry["data_set"] in access.data_resources
+            and access.data_available(entry["data_set"])
+        ):
+            found = run_loader(name)
+            if found is not None:
+                entry["shapes"] = found
+
+    index = {"version": INDEX_VERSION, "sources": source_digests(), "entries": entries}
+    if target is None:
+        target = index_path()
+    if target:
+        if not os.path.exists(os.path.dirname(target)):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp_name = target + "." + str(os.getpid()) + ".tmp"
+        with open(tmp_name, "w") as f:
+            json.dump(index, f, indent=1, sort_keys=True)
+        os.replace(tmp_name, target)
+    return index
+
+
+def read_index(path=None):
+    """Read a catalog index, returning None if it is missing or unreadable."""
+    if path is None:
+        path = index_path()
+    try:
+        with open(path, encoding="utf-8") as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(index, dict) or index.get("version") != INDEX_VERSION:
+        return None
+    return index
+
+
+def get_index():
+    """Return the catalog index, building it again if its sources have changed since it was built.
+
+    The index shipped with pods is used if it is up to date, then one
+    built again in the data cache. Otherwise the index is built into the
+    data cache, keeping the shapes of the shipped index."""
+    global _index
+    if _index is None:
+        with index_lock:
+            if _index is None:
+                digests = source_digests()
+                shipped = read_index()
+                index = shipped
+                if index is None or index.get("sources") != digests:
+                    index = read_index(cached_index_path())
+                if index is None or index.get("sources") != digests:
+                    previous = index or shipped
+                    try:
+                        index = build_index(cached_index_path(), previous=previous)
+                    except OSError as e:
+                        logging.info("catalog: could not write " + cached_index_path() + ": " + str(e))
+                        index = build_index(target=False, previous=previous)
+                _index = index
+    return _index
+
+
+def entries():
+    """Return the catalog entries, by name."""
+    return get_index()["entries"]
+
+
+def describe(name):
+    """Return the catalog entry for a loader or data resource."""
+    return dict(entries()[name])
+
+
+def search(query=None, max_size=None, task=None, keys=None, licensed=None, cached=None, where=None):
+    """Return the catalog entries that match all of the criteria given, sorted by name.
+
+    :param query: text to look for in the name or details of the data set, ignoring case.
+    :param max_size: largest size of the data set's files, in bytes or as a string such as "500M". Data sets of unknown size are left out.
+    :param task: "supervised" for loaders that return inputs X and outputs Y, "unsupervised" for loaders that only return Y.
+    :param keys: keys the loader must return, e.g. ["X", "Y", "Xtest", "Ytest"].
+    :param licensed: True for data sets that come with a license to agree to, False for those without.
+    :param cached: True for data sets whose files are already in the cache, False for those that would be downloaded.
+    :param where: a function that is given each entry and returns whether it should be included, e.g. to check its shapes.
+    """
+    if task is not None and task not in TASKS:
+        raise ValueError("Unknown task " + str(task) + ", should be one of " + ", ".join(TASKS))
+    if isinstance(max_size, str):
+        max_size = access.parse_size(max_size)
+    found = []
+    for name, entry in sorted(entries().items()):
+        if query is not None:
+            text = (name + " " + (entry["details"] or "")).lower()
+            if query.lower() not in text:
+                continue
+        if max_size is not None and (entry["size"] is None or entry["size"] > max_size):
+            continue
+        if task is not None and entry["task"] != task:
+            continue
+        if keys is not None and not set(keys) <= set(entry["keys"]):
+            continue
+        if licensed is not None and bool(entry["license"]) != licensed:
+            continue
+        if cached is not None:
+            available = entry["data_set"] in access.data_resources and access.data_available(entry["data_set"])
+            if available != cached:
+                continue
+        if where is not None and not where(entry):
+            continue
+        found.append(dict(entry))
+    return found
+
+
+def build_index_main(argv=None):
+    """Command line interface to build_index, installed as pods-build-catalog."""
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog="pods-build-catalog",
+        description="Build the index pods.catalog.search reads.",
+    )
+    parser.add_argument("-o", "--output", default=None, help="file to write, catalog.json in the pods package if not given")
+    parser.add_argument("--shapes", action="store_true", help="run the loaders of cached data sets to record the shapes of what they return")
+    args = parser.parse_args(argv)
+    target = args.output or index_path()
+    index = build_index(target, load=args.shapes, previous=read_index(target))
+    print("Wrote " + str(len(index["entries"])) + " entries to " + target)
+    return 0
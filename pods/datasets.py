@@ -6,14 +6,12 @@ from __future__ import absolute_import
 import os
 import sys
 import csv
-import copy
 import numpy as np
-import scipy.io
 import datetime
 import json
-import yaml
 import re
-import tarfile
+import inspect
+import threading
 
 
 import logging
@@ -27,7 +25,6 @@ logging.basicConfig(
 
 
 from functools import reduce
-import pandas as pd
 
 
 
@@ -37,30 +34,20 @@ from . import util
 
 DATAPATH = os.path.expanduser(os.path.expandvars(config.get("datasets", "dir")))
 
-PYTRENDS_AVAILABLE = True
-try:
-    from pytrends.request import TrendReq
-except ImportError:
-    PYTRENDS_AVAILABLE = False
-
-GPY_AVAILABLE = True
-try:
-    import GPy
-except ImportError:
-    GPY_AVAILABLE = False
-
-NETPBMFILE_AVAILABLE = True
-try:
-    import netpbmfile
-except ImportError:
-    NETPBMFILE_AVAILABLE = False
-
-GEOPANDAS_AVAILABLE = True
-try:
-    import geopandas
-except ImportError:
-    GEOPANDAS_AVAILABLE = False
-    
+# Optional backends are only looked for here, they are imported by the
+# loaders that use them.
+pd = util.lazy_import("pandas")
+scipy = util.lazy_import("scipy.io")
+yaml = util.lazy_import("yaml")
+
+PYTRENDS_AVAILABLE = util.module_available("pytrends")
+GPY_AVAILABLE = util.module_available("GPy")
+NETPBMFILE_AVAILABLE = util.module_available("netpbmfile")
+GEOPANDAS_AVAILABLE = util.module_available("geopandas")
+
+# Guards the team numbers football_data adds to access.football_dict.
+football_lock = threading.Lock()
+
 if sys.version_info >= (3, 0):
     from urllib.parse import quote
     from urllib.request import urlopen
@@ -73,6 +60,32 @@ else:
 default_seed = 10000
 
 
+async def load_async(name, *args, **kwargs):
+    """Load a data set from a coroutine without blocking the event loop.
+
+    Any download the loader needs is awaited with access.download_data_async
+    and the loader itself, which parses the files, then runs in the event
+    loop's default executor.
+
+    :param name: name of the loader in pods.datasets, e.g. "olympic_marathon_men".
+    """
+    import asyncio
+    from functools import partial
+
+    loader = globals()[name]
+    arguments = inspect.signature(loader).bind_partial(*args, **kwargs)
+    arguments.apply_defaults()
+    data_set = arguments.arguments.get("data_set")
+    if (
+        isinstance(data_set, str)
+        and data_set in access.data_resources
+        and not access.data_available(data_set)
+    ):
+        await access.download_data_async(data_set)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, partial(loader, *args, **kwargs))
+
+
 def bmi_steps(data_set="bmi_steps"):
     if not access.data_available(data_set):
         access.download_data(data_set)
@@ -91,6 +104,7 @@ def bmi_steps(data_set="bmi_steps"):
 
 
 # The data sets
+@access.parse_cache
 def boston_housing(data_set="boston_housing"):
     if not access.data_available(data_set):
         access.download_data(data_set)
@@ -100,6 +114,7 @@ def boston_housing(data_set="boston_housing"):
     return access.data_details_return({"X": X, "Y": Y}, data_set)
 
 
+@access.parse_cache
 def boxjenkins_airline(data_set="boxjenkins_airline", num_train=96):
     path = os.path.join(access.DATAPATH, data_set)
     if not access.data_available(data_set):
@@ -126,6 +141,7 @@ def boxjenkins_airline(data_set="boxjenkins_airline", num_train=96):
     )
 
 
+@access.parse_cache
 def brendan_faces(data_set="brendan_faces"):
     if not access.data_available(data_set):
         access.download_data(data_set)
@@ -134,6 +150,7 @@ def brendan_faces(data_set="brendan_faces"):
     return access.data_details_return({"Y": Y}, data_set)
 
 
+@access.parse_cache
 def della_gatta_TRP63_gene_expression(data_set="della_gatta", gene_number=None):
     if not access.data_available(data_set):
         access.download_data(data_set)
@@ -210,8 +227,8 @@ if GEOPANDAS_AVAILABLE:
     def nigerian_administrative_zones(
         data_set="nigerian_administrative_zones", refresh_data=False
     ):
-        if not access.data_available(data_set) and not refresh_data:
-            access.download_data(data_set)
+        if refresh_data or not access.data_available(data_set):
+            access.download_data(data_set, refresh=refresh_data)
         from zipfile import ZipFile
 
         with ZipFile(
@@ -230,8 +247,8 @@ if GEOPANDAS_AVAILABLE:
 
 
 def nigerian_covid(data_set="nigerian_covid", refresh_data=False):
-    if not access.data_available(data_set) and not refresh_data:
-        access.download_data(data_set)
+    if refresh_data or not access.data_available(data_set):
+        access.download_data(data_set, refresh=refresh_data)
 
     dir_path = os.path.join(access.DATAPATH, data_set)
     filename = os.path.join(dir_path, "line-list-nigeria.csv")
@@ -249,8 +266,8 @@ def nigerian_covid(data_set="nigerian_covid", refresh_data=False):
 
 
 def nigeria_nmis(data_set="nigeria_nmis", refresh_data=False):
-    if not access.data_available(data_set) and not refresh_data:
-        access.download_data(data_set)
+    if refresh_data or not access.data_available(data_set):
+        access.download_data(data_set, refresh=refresh_data)
 
     dir_path = os.path.join(access.DATAPATH, data_set)
     filename = os.path.join(dir_path, "healthmopupandbaselinenmisfacility.csv")
@@ -259,8 +276,8 @@ def nigeria_nmis(data_set="nigeria_nmis", refresh_data=False):
 
 
 def nigerian_population(data_set="nigerian_population", refresh_data=False):
-    if not access.data_available(data_set) and not refresh_data:
-        access.download_data(data_set)
+    if refresh_data or not access.data_available(data_set):
+        access.download_data(data_set, refresh=refresh_data)
 
     dir_path = os.path.join(access.DATAPATH, data_set)
     filename = os.path.join(dir_path, "nga_admpop_adm1_2020.csv")
@@ -282,14 +299,17 @@ def nigerian_population(data_set="nigerian_population", refresh_data=False):
 
 def pmlr(volumes="all", data_set="pmlr", refresh_data=False):
     """Abstracts from the Proceedings of Machine Learning Research"""
-    if not access.data_available(data_set) and not refresh_data:
-        access.download_data(data_set)
+    if refresh_data or not access.data_available(data_set):
+        access.download_data(data_set, refresh=refresh_data)
 
     proceedings = access.pmlr_proceedings_list(data_set)
 
-    # Create a new resources entry for downloading contents of proceedings.
+    # Describe the contents of the proceedings for this call.
     data_name_full = "pmlr"
-    access.data_resources[data_set]["dirs"] = [['.']]
+    base = access.data_resources[data_set]
+    files = list(base["files"])
+    dirs = [["."]]
+    urls = list(base["urls"])
     for entry in proceedings:
         if volumes == "all" or entry["volume"] in volumes:
             file = entry["yaml"].split("/")[-1]
@@ -297,13 +317,14 @@ def pmlr(volumes="all", data_set="pmlr", refresh_data=False):
             file = os.path.basename(url)
             dirname = os.path.dirname("/".join(url.split("/")[1:]))
             urln = proto + "//" + url.split("/")[0]
-            access.data_resources[data_name_full]["files"].append([file])
-            access.data_resources[data_name_full]["dirs"].append([dirname])
-            access.data_resources[data_name_full]["urls"].append(urln)
-        Y = []
-        # Download the volume data
-    if not access.data_available(data_name_full):
-        access.download_data(data_name_full)
+            files.append([file])
+            dirs.append([dirname])
+            urls.append(urln)
+    Y = []
+    resource = access.resource_descriptor(data_set, files=files, dirs=dirs, urls=urls)
+    # Download the volume data
+    if not access.data_available(data_name_full, resource=resource):
+        access.download_data(data_name_full, resource=resource)
 
     for entry in reversed(proceedings):
         volume = entry["volume"]
@@ -381,6 +402,7 @@ def pmlr(volumes="all", data_set="pmlr", refresh_data=False):
             "info": "Data is a pandas data frame containing each paper, its abstract, authors, volumes and venue.",
         },
         data_set,
+        resource,
     )
 
 def erich_friedman_packing_data(series="squares-in-squares", data_set="erich_friedman_data"):
@@ -417,26 +439,27 @@ def football_data(season="1617", data_set="football_data"):
     def football2num(string):
         if isinstance(string, bytes):
             string = string.decode("utf-8")
-        if string in access.football_dict:
-            return access.football_dict[string]
-        else:
-            access.football_dict[string] = len(access.football_dict) + 1
-            return len(access.football_dict) + 1
+        with football_lock:
+            if string in access.football_dict:
+                return access.football_dict[string]
+            else:
+                access.football_dict[string] = len(access.football_dict) + 1
+                return len(access.football_dict) + 1
 
     def datestr2num(s):
         return util.date2num(datetime.datetime.strptime(s.decode("utf-8"), "%d/%m/%y"))
 
     data_set_season = data_set + "_" + season
-    access.data_resources[data_set_season] = copy.deepcopy(access.data_resources[data_set])
-    access.data_resources[data_set_season]["urls"][0] += season + "/"
     start_year = int(season[0:2])
     end_year = int(season[2:4])
     files = ["E0.csv", "E1.csv", "E2.csv", "E3.csv"]
     if start_year > 4 and start_year < 93:
         files += ["EC.csv"]
-    access.data_resources[data_set_season]["files"] = [files]
-    if not access.data_available(data_set_season):
-        access.download_data(data_set_season)
+    urls = list(access.data_resources[data_set]["urls"])
+    urls[0] += season + "/"
+    resource = access.resource_descriptor(data_set, urls=urls, files=[files])
+    if not access.data_available(data_set_season, resource=resource):
+        access.download_data(data_set_season, resource=resource)
     start = True
     for file in reversed(files):
         filename = os.path.join(access.DATAPATH, data_set_season, file)
@@ -476,8 +499,8 @@ def football_data(season="1617", data_set="football_data"):
             "covariates": [
                 util.discrete(league_dict, "league"),
                 util.datenum("match_day"),
-                util.discrete(access.football_dict, "home team"),
-                util.discrete(access.football_dict, "away team"),
+                util.discrete(dict(access.football_dict), "home team"),
+                util.discrete(dict(access.football_dict), "away team"),
             ],
             "response": [util.integer("home score"), util.integer("away score")],
         },
@@ -747,6 +770,7 @@ if PYTRENDS_AVAILABLE:
         )
 
 
+@access.parse_cache
 def oil(data_set="three_phase_oil_flow"):
     """The three phase oil data from Bishop and James (1993)."""
     if not access.data_available(data_set):
@@ -791,6 +815,7 @@ def oil(data_set="three_phase_oil_flow"):
     # throw an error
 
 
+@access.parse_cache
 def leukemia(data_set="leukemia"):
     if not access.data_available(data_set):
         access.download_data(data_set)
@@ -819,19 +844,22 @@ def oil_100(seed=default_seed, data_set="three_phase_oil_flow"):
     )
 
 
-def pumadyn(seed=default_seed, data_set="pumadyn-32nm"):
-    """Data from a simulation of the Puma robotic arm generated by Zoubin Ghahramani."""
+@access.parse_cache
+def _pumadyn_data(data_set="pumadyn-32nm"):
+    """The pumadyn data as parsed from its file, before it is split at random."""
     if not access.data_available(data_set):
         access.download_data(data_set)
-        dir_path = os.path.join(access.DATAPATH, data_set)
-        tar = tarfile.open(os.path.join(dir_path, "pumadyn-32nm.tar.gz"))
-        print("Extracting file.")
-        tar.extractall(path=dir_path)
-        tar.close()
+    return {
+        "data": np.loadtxt(
+            os.path.join(access.DATAPATH, data_set, "pumadyn-32nm", "Dataset.data.gz")
+        )
+    }
+
+
+def pumadyn(seed=default_seed, data_set="pumadyn-32nm"):
+    """Data from a simulation of the Puma robotic arm generated by Zoubin Ghahramani."""
     # Data is variance 1, no need to normalize.
-    data = np.loadtxt(
-        os.path.join(access.DATAPATH, data_set, "pumadyn-32nm", "Dataset.data.gz")
-    )
+    data = _pumadyn_data(data_set)["data"]
     indices = util.permute(data.shape[0])
     indicesTrain = indices[0:7168]
     indicesTest = indices[7168:-1]
@@ -846,6 +874,7 @@ def pumadyn(seed=default_seed, data_set="pumadyn-32nm"):
     )
 
 
+@access.parse_cache
 def robot_wireless(data_set="robot_wireless"):
     # WiFi access point strengths on a tour around UW Paul Allen building.
     if not access.data_available(data_set):
@@ -901,6 +930,7 @@ def robot_wireless(data_set="robot_wireless"):
     )
 
 
+@access.parse_cache
 def silhouette(data_set="ankur_pose_data"):
     """Ankur Agarwal and Bill Trigg's silhoutte data."""
     if not access.data_available(data_set):
@@ -921,6 +951,7 @@ def silhouette(data_set="ankur_pose_data"):
     )
 
 
+@access.parse_cache
 def decampos_digits(
     data_set="decampos_characters", which_digits=[0, 1, 2, 3, 4, 5, 6, 7, 8, 9]
 ):
@@ -947,6 +978,7 @@ def decampos_digits(
     )
 
 
+@access.parse_cache
 def ripley_synth(data_set="ripley_prnn_data"):
     """Synthetic classification data set generated by Brian Ripley for his Neural Networks book."""
     if not access.data_available(data_set):
@@ -987,6 +1019,7 @@ def ripley_synth(data_set="ripley_prnn_data"):
 """
 
 
+@access.parse_cache
 def mauna_loa(data_set="mauna_loa", num_train=545, refresh_data=False):
     """CO2 concentrations from the Mauna Loa observatory."""
     path = os.path.join(access.DATAPATH, data_set)
@@ -995,7 +1028,7 @@ def mauna_loa(data_set="mauna_loa", num_train=545, refresh_data=False):
             "Using cached version of the data set, to use latest version set refresh_data to True"
         )
     else:
-        access.download_data(data_set)
+        access.download_data(data_set, refresh=refresh_data)
     data = np.loadtxt(os.path.join(access.DATAPATH, data_set, "co2_mm_mlo.txt"))
     print(
         "Most recent data observation from month ",
@@ -1025,16 +1058,12 @@ def mauna_loa(data_set="mauna_loa", num_train=545, refresh_data=False):
     )
 
 
+@access.parse_cache
 def osu_run1(data_set="osu_run1", sample_every=4):
     """Ohio State University's Run1 motion capture data set."""
     path = os.path.join(access.DATAPATH, data_set)
     if not access.data_available(data_set):
-        import zipfile
-
         access.download_data(data_set)
-        zip = zipfile.ZipFile(os.path.join(access.DATAPATH, data_set, "run1TXT.ZIP"), "r")
-        for name in zip.namelist():
-            zip.extract(name, path)
     from . import mocap
 
     Y, connect = mocap.load_text_data("Aug210106", path)
@@ -1089,6 +1118,7 @@ def swiss_roll_1000():
     return swiss_roll(num_samples=1000)
 
 
+@access.parse_cache
 def swiss_roll(num_samples=3000, data_set="swiss_roll"):
     if not access.data_available(data_set):
         access.download_data(data_set)
@@ -1138,6 +1168,8 @@ if GPY_AVAILABLE:
 
         """
 
+        import GPy
+
         np.random.seed(seed=seed)
         num_in = 1
         X = np.random.uniform(low=-1.0, high=1.0, size=(num_samples, num_in))
@@ -1284,14 +1316,11 @@ def olivetti_glasses(
 
 if NETPBMFILE_AVAILABLE:
     def olivetti_faces(data_set="olivetti_faces"):
+        import netpbmfile
+
         path = os.path.join(access.DATAPATH, data_set)
         if not access.data_available(data_set):
-            import zipfile
-
             access.download_data(data_set)
-            zip = zipfile.ZipFile(os.path.join(path, "att_faces.zip"), "r")
-            for name in zip.namelist():
-                zip.extract(name, path)
         Y = []
         lbls = []
         for subject in range(40):
@@ -1369,6 +1398,10 @@ if False:
 
         if not unpacked_files_exist and not access.data_available(data_set):
             access.download_data(data_set)
+            # The .ped and .map files are decompressed as they download.
+            unpacked_files_exist = reduce(
+                lambda a, b: a and b, list(map(os.path.exists, unpacked_files))
+            )
 
         preprocessed_access.DATAPATHs = [
             os.path.join(dir_path, hapmap_file_name + file_name)
@@ -1636,15 +1669,10 @@ if False:
         else:
             import cPickle as pickle
         dir_path = os.path.join(access.DATAPATH, data_set)
-        filename = os.path.join(dir_path, "cifar-10-python.tar.gz")
         if not access.data_available(data_set):
-            import tarfile
-
             access.download_data(data_set)
-            # This code is from Boris Babenko's blog post.
-            # http://bbabenko.tumblr.com/post/86756017649/learning-low-level-vision-feautres-in-10-lines-of-code
-            tfile = tarfile.open(filename, "r:gz")
-            tfile.extractall(dir_path)
+        # This code is from Boris Babenko's blog post.
+        # http://bbabenko.tumblr.com/post/86756017649/learning-low-level-vision-feautres-in-10-lines-of-code
 
         with open(
             os.path.join(dir_path, "cifar-10-batches-py", "data_batch_1"), "rb"
@@ -1685,6 +1713,7 @@ if False:
             data_set,
         )
 
+@access.parse_cache
 def xw_pen(data_set="xw_pen"):
     if not access.data_available(data_set):
         access.download_data(data_set)
@@ -1702,15 +1731,7 @@ def xw_pen(data_set="xw_pen"):
 
 def download_rogers_girolami_data(data_set="rogers_girolami_data"):
     if not access.data_available("rogers_girolami_data"):
-        import tarfile
-
         access.download_data(data_set)
-        path = os.path.join(access.DATAPATH, data_set)
-        tar_file = os.path.join(path, "firstcoursemldata.tar.gz")
-        tar = tarfile.open(tar_file)
-        print("Extracting file.")
-        tar.extractall(path=path)
-        tar.close()
 
 
 def olympic_100m_men(data_set="rogers_girolami_data"):
@@ -1831,6 +1852,7 @@ def olympic_400m_men(data_set="rogers_girolami_data"):
     )
 
 
+@access.parse_cache
 def olympic_marathon_men(data_set="olympic_marathon_men"):
     if not access.data_available(data_set):
         access.download_data(data_set)
@@ -1950,13 +1972,7 @@ def movie_body_count_r_classify(data_set="movie_body_count"):
 def movielens100k(data_set="movielens100k"):
     """Data set of movie ratings collected by the University of Minnesota and 'cleaned up' for use."""
     if not access.data_available(data_set):
-        import zipfile
-
         access.download_data(data_set)
-        dir_path = os.path.join(access.DATAPATH, data_set)
-        zip = zipfile.ZipFile(os.path.join(dir_path, "ml-100k.zip"), "r")
-        for name in zip.namelist():
-            zip.extract(name, dir_path)
 
     encoding = "latin-1"
     movie_path = os.path.join(access.DATAPATH, "movielens100k", "ml-100k")
@@ -2112,17 +2128,11 @@ Data set formed from a mixture of four Gaussians. In each class two of the Gauss
     }
 
 
+@access.parse_cache
 def creep_data(data_set="creep_rupture"):
     """Brun and Yoshida's metal creep rupture data."""
     if not access.data_available(data_set):
-        import tarfile
-
         access.download_data(data_set)
-        path = os.path.join(access.DATAPATH, data_set)
-        tar_file = os.path.join(path, "creeprupt.tar")
-        tar = tarfile.open(tar_file)
-        tar.extractall(path=path)
-        tar.close()
     all_data = np.loadtxt(os.path.join(access.DATAPATH, data_set, "taka"))
     y = all_data[:, 1:2].copy()
     features = [0]
@@ -2283,11 +2293,11 @@ def kepler_telescope(datasets, data_set="kepler_telescope"):
 
     # Make sure the data is downloaded.
     resource = access.kepler_telescope_urls_files(datasets)
-    access.data_resources[data_set] = access.data_resources["kepler_telescope_base"].copy()
-    access.data_resources[data_set]["files"] = resource["files"]
-    access.data_resources[data_set]["urls"] = resource["urls"]
+    resource = access.resource_descriptor(
+        "kepler_telescope_base", files=resource["files"], urls=resource["urls"]
+    )
     if resource["urls"]:
-        access.download_data(data_set)
+        access.download_data(data_set, resource=resource)
 
     dataset_dir = os.path.join(access.DATAPATH, "kepler_telescope")
     filenames = []
@@ -2304,6 +2314,7 @@ def kepler_telescope(datasets, data_set="kepler_telescope"):
             "Y": Y,
         },
         data_set,
+        resource,
     )
 
 
@@ -2398,11 +2409,11 @@ def cmu_mocap(
     # Make sure the data is downloaded.
     all_motions = train_motions + test_motions
     resource = access.cmu_urls_files(([subject], [all_motions]))
-    access.data_resources[data_set] = access.data_resources["cmu_mocap_full"].copy()
-    access.data_resources[data_set]["files"] = resource["files"]
-    access.data_resources[data_set]["urls"] = resource["urls"]
+    resource = access.resource_descriptor(
+        "cmu_mocap_full", files=resource["files"], urls=resource["urls"]
+    )
     if resource["urls"]:
-        access.download_data(data_set)
+        access.download_data(data_set, resource=resource)
     skel = mocap.acclaim_skeleton(os.path.join(subject_dir, subject + ".asf"))
 
     # Set up labels for each sequence
@@ -2480,6 +2491,7 @@ def cmu_mocap(
             "skel": skel,
         },
         data_set,
+        resource,
     )
 
 
@@ -2503,10 +2515,6 @@ def mcycle(data_set="mcycle", seed=default_seed):
 def elevators(data_set="elevators", seed=default_seed):
     if not access.data_available(data_set):
         access.download_data(data_set)
-        dir_path = os.path.join(access.DATAPATH, data_set)
-        tar = tarfile.open(name=os.path.join(dir_path, "elevators.tgz"))
-        tar.extractall(dir_path)
-        tar.close()
 
     elevator_path = os.path.join(access.DATAPATH, "elevators", "Elevators")
     elevator_train_path = os.path.join(elevator_path, "elevators.data")
@@ -2594,6 +2602,10 @@ if False:
 
         if not unpacked_files_exist and not access.data_available(data_set):
             access.download_data(data_set)
+            # The .ped and .map files are decompressed as they download.
+            unpacked_files_exist = reduce(
+                lambda a, b: a and b, list(map(os.path.exists, unpacked_files))
+            )
 
         preprocessed_access.DATAPATHs = [
             os.path.join(dir_path, hapmap_file_name + file_name)
@@ -2861,15 +2873,10 @@ if False:
         else:
             import cPickle as pickle
         dir_path = os.path.join(access.DATAPATH, data_set)
-        filename = os.path.join(dir_path, "cifar-10-python.tar.gz")
         if not access.data_available(data_set):
-            import tarfile
-
             access.download_data(data_set)
-            # This code is from Boris Babenko's blog post.
-            # http://bbabenko.tumblr.com/post/86756017649/learning-low-level-vision-feautres-in-10-lines-of-code
-            tfile = tarfile.open(filename, "r:gz")
-            tfile.extractall(dir_path)
+        # This code is from Boris Babenko's blog post.
+        # http://bbabenko.tumblr.com/post/86756017649/learning-low-level-vision-feautres-in-10-lines-of-code
 
         with open(
             os.path.join(dir_path, "cifar-10-batches-py", "data_batch_1"), "rb"
@@ -2909,3 +2916,4 @@ if False:
             },
             data_set,
         )
+
@@ -75,3 +75,1531 @@ class AccessTests(unittest.TestCase):
         path = os.path.dirname(pods.__file__)
         # Compare files
         self.assertTrue(filecmp.cmp(os.path.join(path, filename), download_name))
+
+
+import ast
+import asyncio
+import hashlib
+import json
+import shutil
+import subprocess
+import tempfile
+import threading
+import mock
+import numpy as np
+
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    """Serve files from the current test directory without logging to stderr."""
+
+    def log_message(self, format, *args):
+        pass
+
+
+class RangeHandler(QuietHandler):
+    """Serve files over keep alive connections honouring single byte range requests.
+
+    Requested ranges, response codes and client ports are recorded on the
+    server and, when the server's truncate flag is set, the next response
+    is cut off half way through. Files carry an ETag so that conditional
+    requests can be answered with 304, and ranges are ignored when an
+    If-Range header doesn't match it. Paths starting with /redirect/ are
+    redirected to the rest of the path."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.clients.add(self.client_address[1])
+        if self.path.startswith("/redirect/"):
+            self.send_response(302)
+            self.send_header("Location", self.path[len("/redirect") :])
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        with open(path, "rb") as f:
+            data = f.read()
+        etag = '"' + hashlib.md5(data).hexdigest() + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self.server.statuses.append(304)
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        range_header = self.headers.get("Range")
+        self.server.ranges.append(range_header)
+        start = 0
+        if range_header and self.headers.get("If-Range") not in [None, etag]:
+            range_header = None
+        if range_header:
+            start = int(range_header[len("bytes=") :].split("-")[0])
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header("Content-Range", "bytes */" + str(len(data)))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.server.statuses.append(206)
+            self.send_response(206)
+            self.send_header(
+                "Content-Range",
+                "bytes " + str(start) + "-" + str(len(data) - 1) + "/" + str(len(data)),
+            )
+        else:
+            self.server.statuses.append(200)
+            self.send_response(200)
+        body = data[start:]
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.server.truncate:
+            self.server.truncate = False
+            self.close_connection = True
+            body = body[: len(body) // 2]
+        self.wfile.write(body)
+
+
+class LocalServerTests(unittest.TestCase):
+    """Tests that run against a local http.server stand in for the data hosts."""
+
+    handler = RangeHandler
+
+    def setUp(self):
+        self.serve_dir = tempfile.mkdtemp()
+        self.cache_dir = tempfile.mkdtemp()
+        serve_dir = self.serve_dir
+
+        class Handler(self.handler):
+            def __init__(self, *args, **kwargs):
+                kwargs["directory"] = serve_dir
+                super(Handler, self).__init__(*args, **kwargs)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.server.clients = set()
+        self.server.ranges = []
+        self.server.statuses = []
+        self.server.truncate = False
+        self.url = "http://127.0.0.1:" + str(self.server.server_address[1]) + "/"
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.patches = [
+            mock.patch.object(pods.access, "DATAPATH", self.cache_dir),
+            mock.patch.object(pods.access, "overide_manual_authorize", True),
+            mock.patch.dict(pods.access.data_resources),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in reversed(self.patches):
+            patch.stop()
+        pods.access.session.clear()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.serve_dir)
+        shutil.rmtree(self.cache_dir)
+
+    def serve_file(self, name, contents):
+        path = os.path.join(self.serve_dir, name)
+        with open(path, "wb") as f:
+            f.write(contents)
+        return path
+
+    def add_resource(self, dataset_name, files, **kwargs):
+        resource = {
+            "citation": None,
+            "details": "Test data served from a local server.",
+            "files": [files],
+            "license": None,
+            "size": None,
+            "urls": [self.url],
+        }
+        resource.update(kwargs)
+        pods.access.data_resources[dataset_name] = resource
+        return resource
+
+
+class DownloadDataTests(LocalServerTests):
+    def test_parallel_download(self):
+        """access_tests: Test downloading all files of a resource in parallel."""
+        files = ["file" + str(i) + ".txt" for i in range(10)]
+        for i, name in enumerate(files):
+            self.serve_file(name, (str(i) * 1000).encode("ascii"))
+        self.add_resource("parallel_test", files)
+
+        self.assertFalse(pods.access.data_available("parallel_test"))
+        pods.access.download_data("parallel_test", workers=4)
+        self.assertTrue(pods.access.data_available("parallel_test"))
+        for i, name in enumerate(files):
+            with open(os.path.join(self.cache_dir, "parallel_test", name), "rb") as f:
+                self.assertEqual(f.read(), (str(i) * 1000).encode("ascii"))
+
+    def test_parallel_download_failures(self):
+        """access_tests: Test every failed file is reported by a parallel download."""
+        self.serve_file("present.txt", b"present")
+        self.add_resource("failure_test", ["present.txt", "missing1.txt", "missing2.txt"])
+
+        with self.assertRaises(ValueError) as context:
+            pods.access.download_data("failure_test", workers=3)
+        message = str(context.exception)
+        self.assertIn("missing1.txt", message)
+        self.assertIn("missing2.txt", message)
+        self.assertTrue(
+            os.path.exists(os.path.join(self.cache_dir, "failure_test", "present.txt"))
+        )
+
+
+class ResumeDownloadTests(LocalServerTests):
+    contents = bytes(bytearray(range(256))) * 400
+
+    def download(self):
+        pods.access.download_url(
+            self.url + "data.bin",
+            dir_name=self.cache_dir,
+            store_directory="resume_test",
+            messages=False,
+            resume=True,
+        )
+        return os.path.join(self.cache_dir, "resume_test", "data.bin")
+
+    def partial(self, contents, served=None):
+        """Leave a partial download of data.bin, begun while served was being served."""
+        os.makedirs(os.path.join(self.cache_dir, "resume_test"))
+        part_name = os.path.join(self.cache_dir, "resume_test", "data.bin.part")
+        with open(part_name, "wb") as f:
+            f.write(contents)
+        if served is not None:
+            etag = '"' + hashlib.md5(served).hexdigest() + '"'
+            pods.access.write_validators(part_name, self.url + "data.bin", {"ETag": etag})
+
+    def test_resume_partial_download(self):
+        """access_tests: Test a partial download is resumed with a range request."""
+        self.serve_file("data.bin", self.contents)
+        self.partial(self.contents[:40000], self.contents)
+
+        filename = self.download()
+        self.assertEqual(self.server.ranges, ["bytes=40000-"])
+        self.assertEqual(self.server.statuses, [206])
+        with open(filename, "rb") as f:
+            self.assertEqual(f.read(), self.contents)
+        self.assertFalse(os.path.exists(filename + ".part"))
+        self.assertFalse(os.path.exists(filename + ".part.validators"))
+
+    def test_changed_file_restarts(self):
+        """access_tests: Test a partial download of a file that has since changed is started again."""
+        changed = self.contents[::-1]
+        self.serve_file("data.bin", changed)
+        self.partial(self.contents[:40000], self.contents)
+
+        filename = self.download()
+        self.assertEqual(self.server.statuses, [200])
+        with open(filename, "rb") as f:
+            self.assertEqual(f.read(), changed)
+
+    def test_partial_without_validator_restarts(self):
+        """access_tests: Test a partial download with no ETag or Last-Modified stored is started again."""
+        self.serve_file("data.bin", self.contents)
+        self.partial(b"stale" * 100)
+
+        filename = self.download()
+        self.assertEqual(self.server.ranges, [None])
+        with open(filename, "rb") as f:
+            self.assertEqual(f.read(), self.contents)
+
+    def test_interrupted_download(self):
+        """access_tests: Test an interrupted download is kept and then completed."""
+        self.serve_file("data.bin", self.contents)
+        self.server.truncate = True
+
+        with self.assertRaises(ValueError):
+            self.download()
+        filename = os.path.join(self.cache_dir, "resume_test", "data.bin")
+        self.assertFalse(os.path.exists(filename))
+        self.assertTrue(os.path.exists(filename + ".part"))
+
+        self.download()
+        self.assertEqual(self.server.ranges[0], None)
+        self.assertEqual(
+            self.server.ranges[1], "bytes=" + str(len(self.contents) // 2) + "-"
+        )
+        with open(filename, "rb") as f:
+            self.assertEqual(f.read(), self.contents)
+
+    def test_complete_partial_download(self):
+        """access_tests: Test a partial file that already holds all the data is kept."""
+        self.serve_file("data.bin", self.contents)
+        self.partial(self.contents, self.contents)
+
+        filename = self.download()
+        self.assertEqual(self.server.statuses, [])
+        with open(filename, "rb") as f:
+            self.assertEqual(f.read(), self.contents)
+
+
+class ChecksumTests(LocalServerTests):
+    contents = b"Checksummed contents\n" * 1000
+
+    def test_matching_checksum(self):
+        """access_tests: Test a download with a matching SHA-256 digest is kept."""
+        self.serve_file("data.txt", self.contents)
+        digest = hashlib.sha256(self.contents).hexdigest()
+        self.add_resource("checksum_test", ["data.txt"], sha256=[[digest]])
+
+        pods.access.download_data("checksum_test")
+        self.assertTrue(pods.access.data_available("checksum_test", verify=True))
+
+        filename = os.path.join(self.cache_dir, "checksum_test", "data.txt")
+        with open(filename, "wb") as f:
+            f.write(self.contents[:100])
+        self.assertTrue(pods.access.data_available("checksum_test"))
+        self.assertFalse(pods.access.data_available("checksum_test", verify=True))
+
+    def test_mismatched_checksum(self):
+        """access_tests: Test a download that doesn't match its digest is discarded."""
+        self.serve_file("data.txt", self.contents)
+        self.add_resource("checksum_test", ["data.txt"], sha256=[["0" * 64]])
+
+        with self.assertRaises(ValueError):
+            pods.access.download_data("checksum_test")
+        filename = os.path.join(self.cache_dir, "checksum_test", "data.txt")
+        self.assertFalse(os.path.exists(filename))
+        self.assertFalse(os.path.exists(filename + ".part"))
+        self.assertFalse(pods.access.data_available("checksum_test"))
+
+
+class SessionTests(LocalServerTests):
+    def test_connection_reuse(self):
+        """access_tests: Test the files of a resource are fetched over one connection."""
+        files = ["file" + str(i) + ".txt" for i in range(5)]
+        for name in files:
+            self.serve_file(name, name.encode("ascii"))
+        self.add_resource("session_test", files)
+
+        pods.access.download_data("session_test", workers=1)
+        self.assertTrue(pods.access.data_available("session_test"))
+        self.assertEqual(len(self.server.clients), 1)
+
+    def test_redirect(self):
+        """access_tests: Test redirects are followed by the session."""
+        self.serve_file("data.txt", b"redirected")
+        pods.access.download_url(
+            self.url + "redirect/data.txt",
+            dir_name=self.cache_dir,
+            messages=False,
+        )
+        with open(os.path.join(self.cache_dir, "data.txt"), "rb") as f:
+            self.assertEqual(f.read(), b"redirected")
+
+
+class AsyncTests(LocalServerTests):
+    def test_download_data_async(self):
+        """access_tests: Test several data sets can be downloaded concurrently from asyncio."""
+        for name in ["a1.txt", "a2.txt", "b1.txt"]:
+            self.serve_file(name, name.encode("ascii"))
+        self.add_resource("async_a", ["a1.txt", "a2.txt"])
+        self.add_resource("async_b", ["b1.txt"])
+
+        async def download():
+            return await asyncio.gather(
+                pods.access.download_data_async("async_a"),
+                pods.access.download_data_async("async_b"),
+            )
+
+        self.assertEqual(asyncio.run(download()), [True, True])
+        self.assertTrue(pods.access.data_available("async_a"))
+        self.assertTrue(pods.access.data_available("async_b"))
+
+    def test_load_async(self):
+        """access_tests: Test a data set loader can be awaited."""
+        self.serve_file(
+            "olympicMarathonTimes.csv", b"1896,4.47083\n1900,4.46472\n1904,5.22208\n"
+        )
+        self.add_resource("olympic_marathon_men", ["olympicMarathonTimes.csv"])
+
+        data = asyncio.run(pods.datasets.load_async("olympic_marathon_men"))
+        self.assertEqual(data["X"].shape, (3, 1))
+        self.assertEqual(data["Y"].shape, (3, 1))
+
+
+class RevalidationTests(LocalServerTests):
+    def test_refresh_unchanged(self):
+        """access_tests: Test refreshing an unchanged file skips the transfer."""
+        self.serve_file("data.txt", b"original")
+        self.add_resource("refresh_test", ["data.txt"])
+        pods.access.download_data("refresh_test")
+        filename = os.path.join(self.cache_dir, "refresh_test", "data.txt")
+        modified = os.path.getmtime(filename)
+
+        pods.access.download_data("refresh_test", refresh=True)
+        self.assertEqual(self.server.statuses, [200, 304])
+        self.assertEqual(os.path.getmtime(filename), modified)
+
+    def test_refresh_changed(self):
+        """access_tests: Test refreshing a changed file downloads the new version."""
+        self.serve_file("data.txt", b"original")
+        self.add_resource("refresh_test", ["data.txt"])
+        pods.access.download_data("refresh_test")
+
+        self.serve_file("data.txt", b"updated")
+        pods.access.download_data("refresh_test", refresh=True)
+        self.assertEqual(self.server.statuses, [200, 200])
+        with open(os.path.join(self.cache_dir, "refresh_test", "data.txt"), "rb") as f:
+            self.assertEqual(f.read(), b"updated")
+
+
+class MirrorTests(LocalServerTests):
+    def setUp(self):
+        super(MirrorTests, self).setUp()
+        self.mirror_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.mirror_dir)
+        super(MirrorTests, self).tearDown()
+
+    def mirror_file(self, dataset_name, name, contents):
+        os.makedirs(os.path.join(self.mirror_dir, dataset_name), exist_ok=True)
+        with open(os.path.join(self.mirror_dir, dataset_name, name), "wb") as f:
+            f.write(contents)
+
+    def test_local_mirror(self):
+        """access_tests: Test files are taken from a local mirror before the origin."""
+        self.mirror_file("mirror_test", "data.txt", b"mirrored")
+        self.serve_file("data.txt", b"origin")
+        self.add_resource("mirror_test", ["data.txt"])
+
+        resolver = pods.access.MirrorResolver([self.mirror_dir])
+        with mock.patch.object(pods.access, "resolver", resolver):
+            pods.access.download_data("mirror_test")
+        self.assertEqual(self.server.statuses, [])
+        with open(os.path.join(self.cache_dir, "mirror_test", "data.txt"), "rb") as f:
+            self.assertEqual(f.read(), b"mirrored")
+
+    def test_mirror_fallback(self):
+        """access_tests: Test files missing from the mirrors are taken from the origin."""
+        self.mirror_file("mirror_test", "first.txt", b"mirrored")
+        self.serve_file("second.txt", b"origin")
+        self.add_resource("mirror_test", ["first.txt", "second.txt"])
+
+        resolver = pods.access.MirrorResolver(["file://" + self.mirror_dir, self.url + "missing"])
+        with mock.patch.object(pods.access, "resolver", resolver):
+            pods.access.download_data("mirror_test", workers=1)
+        self.assertEqual(self.server.statuses, [200])
+        self.assertTrue(pods.access.data_available("mirror_test"))
+
+    def test_fastest_mirror_first(self):
+        """access_tests: Test http mirrors are ordered by their download times."""
+        resolver = pods.access.MirrorResolver(
+            ["http://slow.example.com", "http://fast.example.com"], origin=False
+        )
+        resolver.report("http://slow.example.com/data/file.txt", 5.0)
+        resolver.report("http://fast.example.com/data/file.txt", 0.1)
+        self.assertEqual(
+            resolver.sources("data", "http://origin/file.txt", "data/file.txt"),
+            ["http://fast.example.com/data/file.txt", "http://slow.example.com/data/file.txt"],
+        )
+
+
+class DecompressTests(LocalServerTests):
+    def test_gzip_decompressed_while_downloading(self):
+        """access_tests: Test gzip files are stored decompressed."""
+        import gzip
+
+        contents = b"1 2 3\n" * 10000
+        # Two concatenated gzip members, as written by some tools.
+        self.serve_file("data.txt.gz", gzip.compress(contents) + gzip.compress(contents))
+        self.add_resource("gzip_test", ["data.txt.gz"], decompress=[["gzip"]])
+
+        pods.access.download_data("gzip_test")
+        path = os.path.join(self.cache_dir, "gzip_test", "data.txt")
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), contents + contents)
+        self.assertFalse(os.path.exists(path + ".gz"))
+        self.assertTrue(pods.access.data_available("gzip_test"))
+
+    def test_checksum_of_compressed_data(self):
+        """access_tests: Test digests are checked against the compressed data."""
+        import bz2
+
+        compressed = bz2.compress(b"some data")
+        self.serve_file("data.bz2", compressed)
+        self.add_resource(
+            "bz2_test",
+            ["data.bz2"],
+            decompress=[["bz2"]],
+            sha256=[[hashlib.sha256(compressed).hexdigest()]],
+        )
+        pods.access.download_data("bz2_test")
+        with open(os.path.join(self.cache_dir, "bz2_test", "data"), "rb") as f:
+            self.assertEqual(f.read(), b"some data")
+        self.assertTrue(pods.access.data_available("bz2_test", verify=True))
+
+    def test_truncated_stream(self):
+        """access_tests: Test incomplete compressed data is rejected."""
+        import lzma
+
+        self.serve_file("data.xz", lzma.compress(b"x" * 100000)[:-20])
+        self.add_resource("xz_test", ["data.xz"], decompress=[["xz"]])
+        with self.assertRaises(ValueError):
+            pods.access.download_data("xz_test")
+        self.assertFalse(pods.access.data_available("xz_test"))
+
+
+class ExtractMembersTests(LocalServerTests):
+    def make_tar(self, name, members):
+        import io
+        import tarfile
+
+        path = os.path.join(self.serve_dir, name)
+        with tarfile.open(path, "w:gz") as tar:
+            for member, contents in members:
+                info = tarfile.TarInfo(member)
+                info.size = len(contents)
+                tar.addfile(info, io.BytesIO(contents))
+        return path
+
+    def test_extract_tar_members(self):
+        """access_tests: Test only the listed members of a tar archive are extracted."""
+        self.make_tar(
+            "data.tar.gz",
+            [("data/wanted.txt", b"wanted"), ("data/unwanted.txt", b"unwanted"), ("README", b"readme")],
+        )
+        self.add_resource("tar_test", ["data.tar.gz"], members=[[["data/wanted.txt"]]])
+        pods.access.download_data("tar_test")
+        extracted = pods.access.extract_members("tar_test")
+
+        dir_name = os.path.join(self.cache_dir, "tar_test")
+        self.assertEqual(extracted, [os.path.join(dir_name, "data", "wanted.txt")])
+        with open(extracted[0], "rb") as f:
+            self.assertEqual(f.read(), b"wanted")
+        self.assertFalse(os.path.exists(os.path.join(dir_name, "data", "unwanted.txt")))
+        self.assertFalse(os.path.exists(os.path.join(dir_name, "README")))
+
+    def test_load_async_extracts(self):
+        """access_tests: Test load_async extracts the members a loader reads from an archive."""
+        rows = "\n".join(" ".join(str(i + j) for j in range(31)) for i in range(5))
+        self.make_tar("creeprupt.tar", [("taka", rows.encode("ascii"))])
+        self.add_resource("creep_rupture", ["creeprupt.tar"], members=[[["taka"]]])
+
+        data = asyncio.run(pods.datasets.load_async("creep_data"))
+        self.assertEqual(data["X"].shape, (5, 30))
+        self.assertEqual(data["Y"].shape, (5, 1))
+        self.assertTrue(os.path.exists(os.path.join(self.cache_dir, "creep_rupture", "taka")))
+
+    def test_extract_zip_pattern(self):
+        """access_tests: Test glob patterns select members of a zip archive."""
+        import zipfile
+
+        with zipfile.ZipFile(os.path.join(self.serve_dir, "data.zip"), "w") as archive:
+            archive.writestr("faces/s1/1.pgm", b"one")
+            archive.writestr("faces/s2/1.pgm", b"two")
+            archive.writestr("faces/README", b"readme")
+        self.serve_file("other.txt", b"other")
+        self.add_resource(
+            "zip_test", ["data.zip", "other.txt"], members=[[["faces/s*/*.pgm"], None]]
+        )
+        pods.access.download_data("zip_test")
+        extracted = pods.access.extract_members("zip_test")
+        self.assertEqual(len(extracted), 2)
+        self.assertFalse(os.path.exists(os.path.join(self.cache_dir, "zip_test", "faces", "README")))
+
+    def test_unsafe_member(self):
+        """access_tests: Test members outside the cache directory are refused."""
+        self.make_tar("data.tar.gz", [("../escape.txt", b"escape")])
+        self.add_resource("unsafe_test", ["data.tar.gz"], members=[[["../escape.txt"]]])
+        with self.assertRaises(ValueError):
+            pods.access.download_data("unsafe_test")
+        with self.assertRaises(ValueError):
+            pods.access.extract_members("unsafe_test")
+        self.assertFalse(os.path.exists(os.path.join(self.cache_dir, "escape.txt")))
+
+
+class JournalTests(LocalServerTests):
+    def test_resume_only_missing_files(self):
+        """access_tests: Test an interrupted download only fetches incomplete files again."""
+        self.serve_file("first.txt", b"first")
+        self.add_resource("journal_test", ["first.txt", "second.txt"])
+        with self.assertRaises(ValueError):
+            pods.access.download_data("journal_test", workers=1)
+
+        journal = pods.access.DownloadJournal("journal_test")
+        jobs = pods.access.download_jobs("journal_test", pods.access.data_resources["journal_test"])
+        self.assertEqual(journal.state(jobs[0]), "complete")
+        self.assertEqual(journal.state(jobs[1]), "failed")
+        self.assertFalse(pods.access.data_available("journal_test"))
+
+        self.serve_file("second.txt", b"second")
+        self.server.statuses[:] = []
+        pods.access.download_data("journal_test", workers=1)
+        self.assertEqual(self.server.statuses, [200])
+        self.assertTrue(pods.access.data_available("journal_test"))
+
+    def test_in_flight_file_unavailable(self):
+        """access_tests: Test files whose download was cut short don't count as available."""
+        self.serve_file("data.txt", b"data")
+        self.add_resource("journal_test", ["data.txt"])
+        pods.access.download_data("journal_test")
+        job = pods.access.download_jobs("journal_test", pods.access.data_resources["journal_test"])[0]
+        # As left by a process killed part way through downloading the file again.
+        pods.access.cache_index.remove_files("journal_test", [pods.access.cache_path(job)])
+        pods.access.DownloadJournal("journal_test").mark(job, "in-flight")
+        self.assertFalse(pods.access.data_available("journal_test"))
+
+        pods.access.download_data("journal_test")
+        self.assertTrue(pods.access.data_available("journal_test"))
+
+
+class FlakyHandler(RangeHandler):
+    """Answer the first server.failures requests with 503 Service Unavailable."""
+
+    def do_GET(self):
+        if self.server.failures > 0:
+            self.server.failures -= 1
+            self.server.statuses.append(503)
+            self.send_response(503)
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        RangeHandler.do_GET(self)
+
+
+class RetryTests(LocalServerTests):
+    handler = FlakyHandler
+
+    def setUp(self):
+        super(RetryTests, self).setUp()
+        self.server.failures = 0
+        policy = pods.access.RetryPolicy(attempts=3, backoff=0.01, max_backoff=0.05)
+        patch = mock.patch.object(pods.access, "retry_policy", policy)
+        patch.start()
+        self.patches.append(patch)
+
+    def test_retry_transient_errors(self):
+        """access_tests: Test files are retried after a server returns 503."""
+        self.server.failures = 2
+        self.serve_file("data.txt", b"data")
+        self.add_resource("retry_test", ["data.txt"])
+        pods.access.download_data("retry_test")
+        self.assertEqual(self.server.statuses, [503, 503, 200])
+        self.assertTrue(pods.access.data_available("retry_test"))
+
+    def test_retries_exhausted(self):
+        """access_tests: Test the error is raised once all attempts have failed."""
+        self.server.failures = 3
+        self.serve_file("data.txt", b"data")
+        self.add_resource("retry_test", ["data.txt"])
+        with self.assertRaises(pods.access.TransientError):
+            pods.access.download_data("retry_test")
+        self.assertEqual(self.server.statuses, [503, 503, 503])
+
+    def test_client_errors_not_retried(self):
+        """access_tests: Test missing files aren't retried."""
+        self.add_resource("retry_test", ["missing.txt"])
+        with self.assertRaises(ValueError):
+            pods.access.download_data("retry_test")
+        self.assertEqual(self.server.statuses, [])
+
+    def test_retry_after(self):
+        """access_tests: Test Retry-After delays are obeyed."""
+        policy = pods.access.RetryPolicy(backoff=100.0, max_backoff=30.0)
+        error = pods.access.http_error(
+            "http://example.com/", 503, {"Retry-After": "2"}
+        )
+        self.assertEqual(policy.delay(0, error), 2.0)
+        error.retry_after = 3600.0
+        self.assertEqual(policy.delay(0, error), 30.0)
+
+    def test_host_rate_limit(self):
+        """access_tests: Test requests to a host are spaced out by the token bucket."""
+        import time
+
+        limiter = pods.access.HostRateLimiter(rate=20.0, burst=2)
+        start = time.monotonic()
+        for i in range(6):
+            limiter.wait(self.url)
+        # Two requests go straight away, the other four wait 1/20s each.
+        self.assertGreaterEqual(time.monotonic() - start, 0.18)
+        # Other hosts have their own bucket.
+        start = time.monotonic()
+        limiter.wait("http://example.com/")
+        self.assertLess(time.monotonic() - start, 0.05)
+
+
+class GatedHandler(RangeHandler):
+    """Hold each request until the server's gate event is set."""
+
+    def do_GET(self):
+        self.server.gate.wait(10)
+        RangeHandler.do_GET(self)
+
+
+class PrefetchTests(LocalServerTests):
+    handler = GatedHandler
+
+    def setUp(self):
+        super(PrefetchTests, self).setUp()
+        self.server.gate = threading.Event()
+
+    def tearDown(self):
+        self.server.gate.set()
+        super(PrefetchTests, self).tearDown()
+
+    def test_prefetch(self):
+        """access_tests: Test data sets are downloaded in the background."""
+        self.serve_file("data.txt", b"data")
+        self.add_resource("prefetch_test", ["data.txt"])
+        futures = pods.access.prefetch(["prefetch_test"])
+        self.assertEqual(len(futures), 1)
+        self.assertFalse(futures[0].done())
+        self.assertIs(pods.access.prefetch("prefetch_test")[0], futures[0])
+
+        self.server.gate.set()
+        self.assertTrue(futures[0].result(timeout=10))
+        self.assertTrue(pods.access.data_available("prefetch_test"))
+        self.assertIsNone(pods.access.in_flight("prefetch_test"))
+
+    def test_download_waits_for_prefetch(self):
+        """access_tests: Test download_data waits on a prefetch instead of downloading again."""
+        self.serve_file("data.txt", b"data")
+        self.add_resource("prefetch_test", ["data.txt"])
+        future = pods.access.prefetch(["prefetch_test"])[0]
+
+        threading.Timer(0.2, self.server.gate.set).start()
+        pods.access.download_data("prefetch_test")
+        self.assertTrue(future.done())
+        self.assertEqual(self.server.statuses, [200])
+
+    def test_prefetch_extracts(self):
+        """access_tests: Test a prefetch extracts the members the loader reads from an archive."""
+        import io
+        import tarfile
+
+        rows = "\n".join(" ".join(str(i + j) for j in range(31)) for i in range(5))
+        with tarfile.open(os.path.join(self.serve_dir, "creeprupt.tar"), "w") as tar:
+            info = tarfile.TarInfo("taka")
+            info.size = len(rows)
+            tar.addfile(info, io.BytesIO(rows.encode("ascii")))
+        self.add_resource("creep_rupture", ["creeprupt.tar"], members=[[["taka"]]])
+        self.server.gate.set()
+        self.assertTrue(pods.access.prefetch(["creep_data"])[0].result(timeout=10))
+        self.assertEqual(pods.datasets.creep_data()["X"].shape, (5, 30))
+
+    def test_load_asks_once(self):
+        """access_tests: Test a loader run by a prefetch doesn't ask for the permission already given."""
+        self.serve_file("data.txt", b"1 2\n3 4\n")
+        self.add_resource("prefetch_test", ["data.txt"])
+        asked = []
+
+        def prompt(message):
+            asked.append(message)
+            return True
+
+        def loader(data_set="prefetch_test"):
+            if not pods.access.data_available(data_set):
+                pods.access.download_data(data_set)
+            return "loaded"
+
+        self.server.gate.set()
+        with mock.patch.object(pods.access, "overide_manual_authorize", False), mock.patch(
+            "builtins.input", side_effect=AssertionError("input called")
+        ), mock.patch.object(pods.datasets, "subject_loader", loader, create=True):
+            future = pods.access.prefetch(["subject_loader"], prompt=prompt, load=True)[0]
+            self.assertEqual(future.result(timeout=10), "loaded")
+        self.assertEqual(len(asked), 1)
+        self.assertTrue(pods.access.data_available("prefetch_test"))
+
+    def test_prefetch_runs_unregistered_loader(self):
+        """access_tests: Test loaders whose data set isn't in data_resources are run by a prefetch."""
+        calls = []
+
+        def subject_loader(subject="01", data_set="not_a_registered_data_set"):
+            calls.append(subject)
+            return {"subject": subject}
+
+        with mock.patch.object(pods.datasets, "subject_loader", subject_loader, create=True):
+            future = pods.access.prefetch(["subject_loader"])[0]
+            self.assertEqual(future.result(timeout=10), {"subject": "01"})
+        self.assertEqual(calls, ["01"])
+
+    def test_unknown_name(self):
+        """access_tests: Test prefetching an unknown data set is an error."""
+        with self.assertRaises(ValueError):
+            pods.access.prefetch(["no_such_data_set_or_loader"])
+
+
+class MetricsTests(LocalServerTests):
+    def setUp(self):
+        super(MetricsTests, self).setUp()
+        self.metrics = []
+        pods.access.add_metrics_hook(self.metrics.append)
+
+    def tearDown(self):
+        pods.access.remove_metrics_hook(self.metrics.append)
+        super(MetricsTests, self).tearDown()
+
+    def test_download_metrics(self):
+        """access_tests: Test metrics are reported for each downloaded file."""
+        self.serve_file("first.txt", b"1" * 1000)
+        self.serve_file("second.txt", b"2" * 2000)
+        self.add_resource("metrics_test", ["first.txt", "second.txt"])
+        pods.access.download_data("metrics_test", workers=1)
+
+        self.assertEqual([m["file"] for m in self.metrics], [
+            os.path.join("metrics_test", "first.txt"),
+            os.path.join("metrics_test", "second.txt"),
+        ])
+        metrics = self.metrics[1]
+        self.assertEqual(metrics["bytes"], 2000)
+        self.assertEqual(metrics["cache"], "miss")
+        self.assertEqual(metrics["url"], self.url + "second.txt")
+        self.assertTrue(metrics["origin"])
+        self.assertEqual(metrics["attempts"], 1)
+        self.assertEqual(metrics["retries"], 0)
+        self.assertIsNone(metrics["error"])
+        self.assertGreater(metrics["throughput"], 0)
+        self.assertLessEqual(metrics["time_to_first_byte"], metrics["seconds"])
+
+    def test_cache_metrics(self):
+        """access_tests: Test cache hits and revalidations are reported."""
+        self.serve_file("data.txt", b"data")
+        self.add_resource("metrics_test", ["data.txt"])
+        pods.access.download_data("metrics_test")
+        pods.access.download_data("metrics_test")
+        pods.access.download_data("metrics_test", refresh=True)
+        self.assertEqual(
+            [m["cache"] for m in self.metrics], ["miss", "hit", "not-modified"]
+        )
+        self.assertEqual(self.metrics[2]["bytes"], 0)
+
+    def test_failure_metrics(self):
+        """access_tests: Test failed downloads are reported with their error."""
+        self.add_resource("metrics_test", ["missing.txt"])
+        with self.assertRaises(ValueError):
+            pods.access.download_data("metrics_test")
+        self.assertEqual(len(self.metrics), 1)
+        self.assertIn("404", self.metrics[0]["error"])
+
+
+class ProgressTests(LocalServerTests):
+    def test_callback_progress(self):
+        """access_tests: Test progress callbacks are throttled and see the whole file."""
+        contents = os.urandom(1048576)
+        self.serve_file("data.bin", contents)
+        updates = []
+        pods.access.download_url(
+            self.url + "data.bin",
+            dir_name=self.cache_dir,
+            progress=pods.access.CallbackProgress(
+                lambda received, total: updates.append((received, total)), interval=60
+            ),
+        )
+        # One update at the start of the throttling interval and one at the end.
+        self.assertEqual(updates, [(8192, len(contents)), (len(contents), len(contents))])
+
+    def test_bar_progress(self):
+        """access_tests: Test the progress bar is drawn to its full length."""
+        import io
+
+        reporter = pods.access.BarProgress(interval=0)
+        with mock.patch("sys.stdout", new_callable=io.StringIO) as stdout:
+            reporter.start("http://example.com/data", "data", 0, 3000)
+            for received in range(0, 3001, 100):
+                reporter.update(received, 3000)
+            reporter.finish(3000, 3000)
+        lines = stdout.getvalue().splitlines()
+        self.assertIn("Downloading", lines[0])
+        self.assertEqual(lines[1], "|" + ">" * reporter.line_length + "|")
+
+
+class QuotaTests(LocalServerTests):
+    def set_config(self, section, option, value):
+        config = pods.access.config
+        self.addCleanup(config.set, section, option, config.get(section, option))
+        config.set(section, option, value)
+
+    def download(self, dataset_name, size):
+        self.serve_file(dataset_name + ".bin", b"x" * size)
+        self.add_resource(dataset_name, [dataset_name + ".bin"], size=size)
+        pods.access.download_data(dataset_name)
+
+    def test_lru_eviction(self):
+        """access_tests: Test the least recently used data sets are evicted to stay within the quota."""
+        self.set_config("datasets", "quota", "35K")
+        self.download("first", 10240)
+        self.download("second", 10240)
+        self.download("third", 5120)
+        pods.access.data_details_return({}, "first")
+        self.download("fourth", 10240)
+
+        self.assertTrue(pods.access.data_available("first"))
+        self.assertFalse(os.path.exists(os.path.join(self.cache_dir, "second")))
+        self.assertTrue(pods.access.data_available("third"))
+        self.assertTrue(pods.access.data_available("fourth"))
+        self.assertLessEqual(sum(pods.access.cache_usage().values()), 35 * 1024)
+
+    def test_lfu_eviction(self):
+        """access_tests: Test the least often used data sets are evicted with the lfu policy."""
+        self.set_config("datasets", "quota", "25K")
+        self.set_config("datasets", "eviction", "lfu")
+        self.download("first", 10240)
+        for i in range(3):
+            pods.access.data_details_return({}, "first")
+        self.download("second", 10240)
+        self.download("third", 10240)
+        self.assertTrue(pods.access.data_available("first"))
+        self.assertFalse(os.path.exists(os.path.join(self.cache_dir, "second")))
+
+    def test_check_is_not_use(self):
+        """access_tests: Test checking a data set is available doesn't count as using it."""
+        self.download("first", 1024)
+        index = os.path.join(self.cache_dir, pods.access.CacheIndex.filename)
+        entry = dict(pods.access.cache_index.get("first"))
+        mtime = os.stat(index).st_mtime_ns
+        for i in range(3):
+            self.assertTrue(pods.access.data_available("first"))
+        self.assertEqual(pods.access.cache_index.get("first"), entry)
+        self.assertEqual(os.stat(index).st_mtime_ns, mtime)
+        pods.access.data_details_return({}, "first")
+        self.assertEqual(pods.access.cache_index.get("first")["accesses"], entry["accesses"] + 1)
+
+    def test_pinned_not_evicted(self):
+        """access_tests: Test pinned data sets are kept whatever the quota."""
+        self.set_config("datasets", "quota", "1K")
+        self.set_config("datasets", "pinned", "second")
+        self.download("first", 1024)
+        pods.access.pin("first")
+        self.download("second", 1024)
+        self.download("third", 1024)
+        self.assertTrue(pods.access.data_available("first"))
+        self.assertTrue(pods.access.data_available("second"))
+        self.assertTrue(pods.access.data_available("third"))
+
+    def test_unregistered_directory_counted(self):
+        """access_tests: Test directories of data sets that aren't in data_resources count towards the quota."""
+        self.set_config("datasets", "quota", "25K")
+        os.makedirs(os.path.join(self.cache_dir, "cmu_mocap", "01"))
+        with open(os.path.join(self.cache_dir, "cmu_mocap", "01", "01_01.amc"), "wb") as f:
+            f.write(b"x" * 20480)
+        os.makedirs(os.path.join(self.cache_dir, ".blobs"))
+        self.assertEqual(pods.access.cache_usage(), {"cmu_mocap": 20480})
+        self.download("first", 10240)
+        self.assertFalse(os.path.exists(os.path.join(self.cache_dir, "cmu_mocap")))
+        self.assertTrue(pods.access.data_available("first"))
+
+    def test_quota_from_index(self):
+        """access_tests: Test enforcing the quota reads the sizes in the cache index rather than measuring the cache."""
+        self.set_config("datasets", "quota", "25K")
+        self.download("first", 10240)
+        with mock.patch.object(pods.access, "dataset_size", side_effect=AssertionError("cache measured")):
+            self.assertEqual(pods.access.enforce_quota(), [])
+
+    def test_parse_size(self):
+        """access_tests: Test quota sizes are converted to bytes."""
+        self.assertEqual(pods.access.parse_size("500"), 500)
+        self.assertEqual(pods.access.parse_size("2k"), 2048)
+        self.assertEqual(pods.access.parse_size("1.5GB"), 1610612736)
+        self.assertIsNone(pods.access.parse_size(""))
+        self.assertIsNone(pods.access.parse_size("0"))
+
+
+class CacheIndexTests(LocalServerTests):
+    def test_data_available_from_index(self):
+        """access_tests: Test data_available only stats files recorded in the cache index, and finds those removed by hand."""
+        self.serve_file("data.txt", b"data")
+        self.add_resource("index_test", ["data.txt"])
+        pods.access.download_data("index_test")
+        path = os.path.join(self.cache_dir, "index_test", "data.txt")
+        with mock.patch("os.path.exists", wraps=os.path.exists) as exists:
+            self.assertTrue(pods.access.data_available("index_test"))
+        self.assertNotIn(mock.call(path), exists.call_args_list)
+
+        os.unlink(path)
+        self.assertFalse(pods.access.data_available("index_test"))
+        self.assertEqual(pods.access.missing_files("index_test", [path]), [path])
+        self.assertEqual(pods.access.cache_index.unindexed("index_test", [path], "index"), [])
+        pods.access.download_data("index_test")
+        self.assertTrue(pods.access.data_available("index_test"))
+
+    def test_reload_within_one_tick(self):
+        """access_tests: Test an index written by another process is read again even if its modification time is unchanged."""
+        other = pods.access.CacheIndex()
+        pods.access.cache_index.update("first", size=1)
+        path = os.path.join(self.cache_dir, pods.access.CacheIndex.filename)
+        mtime = os.stat(path).st_mtime_ns
+        other.update("second", size=2)
+        os.utime(path, ns=(mtime, mtime))
+        self.assertEqual(pods.access.cache_index.get("second")["size"], 2)
+
+    def test_index_filled_from_disk(self):
+        """access_tests: Test files cached before the index existed are added to it."""
+        os.makedirs(os.path.join(self.cache_dir, "index_test"))
+        path = os.path.join(self.cache_dir, "index_test", "data.txt")
+        with open(path, "wb") as f:
+            f.write(b"data")
+        self.add_resource("index_test", ["data.txt"])
+        self.assertEqual(pods.access.cache_index.unindexed("index_test", [path]), [path])
+        self.assertTrue(pods.access.data_available("index_test"))
+        self.assertEqual(pods.access.cache_index.unindexed("index_test", [path]), [])
+
+    def test_missing_files(self):
+        """access_tests: Test missing_files reports the files not in the cache."""
+        dir_name = os.path.join(self.cache_dir, "index_test")
+        os.makedirs(dir_name)
+        with open(os.path.join(dir_name, "present.txt"), "wb") as f:
+            f.write(b"present")
+        paths = [os.path.join(dir_name, name) for name in ["present.txt", "absent.txt"]]
+        self.assertEqual(pods.access.missing_files("index_test", paths), paths[1:])
+        self.assertEqual(pods.access.cache_index.unindexed("index_test", paths), paths[1:])
+
+
+class BlobStoreTests(LocalServerTests):
+    def test_shared_url_downloaded_once(self):
+        """access_tests: Test a file shared by two data sets is downloaded and stored once."""
+        self.serve_file("shared.txt", b"shared")
+        self.add_resource("first", ["shared.txt"])
+        self.add_resource("second", ["shared.txt"])
+        pods.access.download_data("first")
+        pods.access.download_data("second")
+        self.assertEqual(self.server.statuses, [200])
+
+        first = os.path.join(self.cache_dir, "first", "shared.txt")
+        second = os.path.join(self.cache_dir, "second", "shared.txt")
+        self.assertTrue(os.path.samefile(first, second))
+        blob = pods.access.blob_store.blob_path(hashlib.sha256(b"shared").hexdigest())
+        self.assertTrue(os.path.samefile(first, blob))
+        self.assertTrue(pods.access.data_available("second"))
+
+    def test_shared_digest(self):
+        """access_tests: Test files with a known digest are linked from the store."""
+        self.serve_file("data.txt", b"data")
+        self.serve_file("copy.txt", b"data")
+        digest = hashlib.sha256(b"data").hexdigest()
+        self.add_resource("first", ["data.txt"])
+        self.add_resource("second", ["copy.txt"], sha256=[[digest]])
+        pods.access.download_data("first")
+        pods.access.download_data("second")
+        self.assertEqual(self.server.statuses, [200])
+        with open(os.path.join(self.cache_dir, "second", "copy.txt"), "rb") as f:
+            self.assertEqual(f.read(), b"data")
+
+    def test_links_unsupported(self):
+        """access_tests: Test files stay in the data set's directory where no kind of link can be made."""
+        self.serve_file("data.txt", b"data")
+        self.add_resource("first", ["data.txt"])
+        self.add_resource("second", ["data.txt"])
+        with mock.patch("os.link", side_effect=OSError("links not supported")), mock.patch(
+            "os.symlink", side_effect=OSError("links not supported")
+        ):
+            pods.access.download_data("first")
+            pods.access.download_data("second")
+        for dataset_name in ["first", "second"]:
+            with open(os.path.join(self.cache_dir, dataset_name, "data.txt"), "rb") as f:
+                self.assertEqual(f.read(), b"data")
+            self.assertTrue(pods.access.data_available(dataset_name))
+        self.assertIsNone(pods.access.blob_store.find(hashlib.sha256(b"data").hexdigest()))
+
+    def test_decompressed_digest_from_download(self):
+        """access_tests: Test decompressed files are stored by the digest computed while they were saved."""
+        import gzip
+
+        self.serve_file("data.txt.gz", gzip.compress(b"data"))
+        self.add_resource("gzip_test", ["data.txt.gz"], decompress=[["gzip"]])
+        with mock.patch.object(pods.access, "file_sha256", side_effect=AssertionError("file read again")):
+            pods.access.download_data("gzip_test")
+        blob = pods.access.blob_store.find(hashlib.sha256(b"data").hexdigest())
+        self.assertTrue(os.path.samefile(blob, os.path.join(self.cache_dir, "gzip_test", "data.txt")))
+
+    def test_url_blob_checked_against_digest(self):
+        """access_tests: Test a blob stored for a url isn't linked when the data resource expects other contents."""
+        self.serve_file("data.txt", b"old")
+        self.add_resource("first", ["data.txt"])
+        pods.access.download_data("first")
+        self.serve_file("data.txt", b"new")
+        self.add_resource("second", ["data.txt"], sha256=[[hashlib.sha256(b"new").hexdigest()]])
+        pods.access.download_data("second")
+        self.assertEqual(self.server.statuses, [200, 200])
+        with open(os.path.join(self.cache_dir, "second", "data.txt"), "rb") as f:
+            self.assertEqual(f.read(), b"new")
+
+    def test_linked_under_lock(self):
+        """access_tests: Test blobs are moved into the store and linked while holding the store's lock."""
+        link = pods.access.BlobStore.link
+        depths = []
+
+        def checked_link(store, blob, path):
+            depths.append(store.lock.state["depth"])
+            return link(store, blob, path)
+
+        self.serve_file("shared.txt", b"shared")
+        self.add_resource("first", ["shared.txt"])
+        self.add_resource("second", ["shared.txt"])
+        with mock.patch.object(pods.access.BlobStore, "link", checked_link):
+            pods.access.download_data("first")
+            pods.access.download_data("second")
+        self.assertEqual(len(depths), 2)
+        self.assertTrue(all(depth > 0 for depth in depths))
+
+    def test_symlinks(self):
+        """access_tests: Test data sets can link to the store with symbolic links."""
+        config = pods.access.config
+        self.addCleanup(config.set, "datasets", "dedupe", config.get("datasets", "dedupe"))
+        config.set("datasets", "dedupe", "symlink")
+        self.serve_file("shared.txt", b"shared")
+        self.add_resource("first", ["shared.txt"])
+        self.add_resource("second", ["shared.txt"])
+        pods.access.download_data("first")
+        pods.access.download_data("second")
+        path = os.path.join(self.cache_dir, "second", "shared.txt")
+        self.assertTrue(os.path.islink(path))
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), b"shared")
+
+    def test_collect_unused_blobs(self):
+        """access_tests: Test blobs are removed once no data set links to them."""
+        self.serve_file("shared.txt", b"shared")
+        self.add_resource("first", ["shared.txt"])
+        self.add_resource("second", ["shared.txt"])
+        pods.access.download_data("first")
+        pods.access.download_data("second")
+        blob = pods.access.blob_store.blob_path(hashlib.sha256(b"shared").hexdigest())
+
+        pods.access.clear_cache("first")
+        self.assertTrue(os.path.exists(blob))
+        pods.access.clear_cache("second")
+        self.assertFalse(os.path.exists(blob))
+        self.assertIsNone(pods.access.blob_store.lookup(self.url + "shared.txt"))
+
+
+def download_in_process(dataset_name):
+    pods.access.download_data(dataset_name, workers=1)
+
+
+class LockTests(LocalServerTests):
+    handler = GatedHandler
+
+    def setUp(self):
+        super(LockTests, self).setUp()
+        self.server.gate = threading.Event()
+
+    def tearDown(self):
+        self.server.gate.set()
+        super(LockTests, self).tearDown()
+
+    def test_processes_download_once(self):
+        """access_tests: Test only one of several processes downloads a data set."""
+        import multiprocessing
+
+        self.serve_file("data.txt", b"data")
+        self.add_resource("lock_test", ["data.txt"])
+        context = multiprocessing.get_context("fork")
+        processes = [
+            context.Process(target=download_in_process, args=("lock_test",))
+            for i in range(3)
+        ]
+        for process in processes:
+            process.start()
+        threading.Timer(0.5, self.server.gate.set).start()
+        for process in processes:
+            process.join(30)
+            self.assertEqual(process.exitcode, 0)
+        self.assertEqual(self.server.statuses, [200])
+        self.assertTrue(pods.access.data_available("lock_test"))
+
+    def test_reentrant(self):
+        """access_tests: Test a thread can take a lock it already holds."""
+        lock = pods.access.dataset_lock("lock_test")
+        with lock:
+            with pods.access.dataset_lock("lock_test"):
+                pass
+            acquired = []
+            thread = threading.Thread(
+                target=lambda: acquired.append(lock.acquire(blocking=False))
+            )
+            thread.start()
+            thread.join()
+            self.assertEqual(acquired, [False])
+        self.assertTrue(lock.acquire(blocking=False))
+        lock.release()
+
+
+class VerifyCacheTests(LocalServerTests):
+    def setUp(self):
+        super(VerifyCacheTests, self).setUp()
+        self.serve_file("good.txt", b"good")
+        self.serve_file("bad.txt", b"bad")
+        self.add_resource(
+            "verify_test",
+            ["good.txt", "bad.txt"],
+            sha256=[[None, hashlib.sha256(b"bad").hexdigest()]],
+        )
+        config = pods.access.config
+        self.addCleanup(config.set, "datasets", "dedupe", config.get("datasets", "dedupe"))
+        config.set("datasets", "dedupe", "none")
+        pods.access.download_data("verify_test", workers=1)
+        self.bad = os.path.join(self.cache_dir, "verify_test", "bad.txt")
+
+    def corrupt(self):
+        with open(self.bad, "wb") as f:
+            f.write(b"BAD")
+
+    def test_sound_cache(self):
+        """access_tests: Test verify_cache finds no problems in a sound cache."""
+        self.assertEqual(pods.access.verify_cache(["verify_test"]), [])
+
+    def test_corrupt_file(self):
+        """access_tests: Test verify_cache reports files that don't match their digest."""
+        self.corrupt()
+        problems = pods.access.verify_cache(["verify_test"])
+        self.assertEqual([(p["path"], p["problem"]) for p in problems], [(self.bad, "corrupt")])
+        self.assertEqual(pods.access.verify_cache(["verify_test"], digests=False), [])
+
+    def test_size_and_partial(self):
+        """access_tests: Test verify_cache reports truncated and missing files."""
+        with open(self.bad, "wb") as f:
+            f.write(b"b")
+        os.unlink(os.path.join(self.cache_dir, "verify_test", "good.txt"))
+        problems = pods.access.verify_cache(["verify_test"], digests=False)
+        self.assertEqual(sorted(p["problem"] for p in problems), ["partial", "size"])
+
+    def test_repair(self):
+        """access_tests: Test verify_cache downloads just the broken files again."""
+        self.corrupt()
+        self.server.statuses[:] = []
+        problems = pods.access.verify_cache(["verify_test"], repair=True)
+        self.assertEqual([p["repaired"] for p in problems], [True])
+        self.assertEqual(self.server.statuses, [200])
+        with open(self.bad, "rb") as f:
+            self.assertEqual(f.read(), b"bad")
+        self.assertEqual(pods.access.verify_cache(["verify_test"]), [])
+
+    def test_repair_linked(self):
+        """access_tests: Test verify_cache downloads a file again when it is linked to a blob it broke."""
+        pods.access.config.set("datasets", "dedupe", "hardlink")
+        os.unlink(self.bad)
+        pods.access.download_data("verify_test", workers=1)
+        self.assertIsNotNone(pods.access.blob_store.lookup(self.url + "bad.txt"))
+        self.corrupt()
+        self.server.statuses[:] = []
+        problems = pods.access.verify_cache(["verify_test"], repair=True)
+        self.assertEqual([p["repaired"] for p in problems], [True])
+        self.assertEqual(self.server.statuses, [200])
+        with open(self.bad, "rb") as f:
+            self.assertEqual(f.read(), b"bad")
+        self.assertEqual(pods.access.verify_cache(["verify_test"]), [])
+
+    def test_command_line(self):
+        """access_tests: Test the command line returns 1 while problems remain."""
+        self.assertEqual(pods.access.verify_cache_main(["verify_test"]), 0)
+        self.corrupt()
+        self.assertEqual(pods.access.verify_cache_main(["verify_test"]), 1)
+        self.assertEqual(pods.access.verify_cache_main(["--repair", "--yes", "verify_test"]), 0)
+
+
+class ResourceDescriptorTests(LocalServerTests):
+    def test_read_only(self):
+        """access_tests: Test resource descriptors can't be changed and leave data_resources alone."""
+        base = self.add_resource("descriptor_test", ["base.txt"])
+        resource = pods.access.resource_descriptor("descriptor_test", files=[["other.txt"]])
+        self.assertEqual(resource["files"], (("other.txt",),))
+        self.assertEqual(resource["urls"], (self.url,))
+        with self.assertRaises(TypeError):
+            resource["files"] = [["more.txt"]]
+        with self.assertRaises(AttributeError):
+            resource["urls"].append(self.url)
+        self.assertEqual(pods.access.data_resources["descriptor_test"], base)
+
+    def test_concurrent_downloads(self):
+        """access_tests: Test downloads of different descriptors of one data set from several threads."""
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.add_resource("descriptor_test", ["base.txt"])
+        resources = []
+        for i in range(4):
+            names = ["part" + str(i) + "_" + str(j) + ".txt" for j in range(3)]
+            for name in names:
+                self.serve_file(name, name.encode("ascii") * 100)
+            resources.append(pods.access.resource_descriptor("descriptor_test", files=[names]))
+
+        def load(resource):
+            self.assertFalse(pods.access.data_available("descriptor_test", resource=resource))
+            pods.access.download_data("descriptor_test", resource=resource)
+            return pods.access.data_details_return({}, "descriptor_test", resource)
+
+        with ThreadPoolExecutor(4) as executor:
+            details = list(executor.map(load, resources))
+        for resource, data in zip(resources, details):
+            self.assertEqual(data["files"], resource["files"])
+            self.assertTrue(pods.access.data_available("descriptor_test", resource=resource))
+            for name in resource["files"][0]:
+                with open(os.path.join(self.cache_dir, "descriptor_test", name), "rb") as f:
+                    self.assertEqual(f.read(), name.encode("ascii") * 100)
+        self.assertEqual(pods.access.data_resources["descriptor_test"]["files"], [["base.txt"]])
+        self.assertFalse(pods.access.data_available("descriptor_test"))
+
+
+class ParseCacheTests(LocalServerTests):
+    def setUp(self):
+        super(ParseCacheTests, self).setUp()
+        self.serve_file("table.txt", b"1 2\n3 4\n5 6\n")
+        self.add_resource("parse_test", ["table.txt"])
+        self.calls = []
+        cache_dir = self.cache_dir
+        calls = self.calls
+
+        def table(data_set="parse_test", column=1, refresh_data=False):
+            """Load the test table."""
+            if refresh_data or not pods.access.data_available(data_set):
+                pods.access.download_data(data_set)
+            calls.append(column)
+            data = np.loadtxt(os.path.join(cache_dir, data_set, "table.txt"))
+            return pods.access.data_details_return(
+                {"Y": data[:, column : column + 1], "total": data.sum(), "info": "A test table."},
+                data_set,
+            )
+
+        self.table = pods.access.parse_cache(table)
+
+    def test_second_call_reads_cache(self):
+        """access_tests: Test a loader's arrays are read from the parse cache on the second call."""
+        first = self.table()
+        second = self.table()
+        self.assertEqual(self.calls, [1])
+        np.testing.assert_array_equal(second["Y"], [[2], [4], [6]])
+        self.assertEqual(second["total"], 21)
+        self.assertEqual(second["info"], "A test table.")
+        self.assertEqual(second["details"], first["details"])
+        self.assertEqual(self.table.__doc__, "Load the test table.")
+        parsed = os.listdir(os.path.join(self.cache_dir, "parse_test", pods.access.PARSED_DIR))
+        self.assertEqual(len(parsed), 1)
+        self.assertTrue(parsed[0].startswith("table-"))
+
+        np.testing.assert_array_equal(self.table(column=0)["Y"], [[1], [3], [5]])
+        self.assertEqual(self.calls, [1, 0])
+
+    def test_invalidated(self):
+        """access_tests: Test the parse cache is not used once the data set's files change or on refresh."""
+        self.table()
+        path = os.path.join(self.cache_dir, "parse_test", "table.txt")
+        with open(path, "w") as f:
+            f.write("1 20\n3 40\n")
+        np.testing.assert_array_equal(self.table()["Y"], [[20], [40]])
+        self.assertEqual(self.calls, [1, 1])
+        self.table(refresh_data=True)
+        self.assertEqual(self.calls, [1, 1, 1])
+        self.table()
+        self.assertEqual(self.calls, [1, 1, 1])
+
+    def test_unstorable(self):
+        """access_tests: Test values that need pickling are not put in the parse cache."""
+        calls = []
+
+        def objects(data_set="parse_test"):
+            if not pods.access.data_available(data_set):
+                pods.access.download_data(data_set)
+            calls.append(data_set)
+            return {"Y": np.array([{"a": 1}], dtype=object)}
+
+        objects = pods.access.parse_cache(objects)
+        objects()
+        objects()
+        self.assertEqual(len(calls), 2)
+        self.assertFalse(os.path.exists(os.path.join(self.cache_dir, "parse_test", pods.access.PARSED_DIR)))
+
+    def test_json_changes_not_stored(self):
+        """access_tests: Test values json doesn't read back unchanged, such as tuples and integer keys, are not put in the parse cache."""
+        path = os.path.join(self.cache_dir, "parsed.npz")
+        self.assertFalse(pods.access.write_parsed(path, {}, {"Y": np.ones(2), "shape": (2, 1)}))
+        self.assertFalse(pods.access.write_parsed(path, {}, {"Y": np.ones(2), "labels": {1: "one"}}))
+        self.assertFalse(os.path.exists(path))
+        self.assertTrue(pods.access.write_parsed(path, {}, {"Y": np.ones(2), "labels": {"1": ["one"]}}))
+
+    def test_random_loaders_not_cached(self):
+        """access_tests: Test only loaders that don't draw random numbers use the parse cache."""
+        self.assertTrue(hasattr(pods.datasets.oil, "__wrapped__"))
+        self.assertTrue(hasattr(pods.datasets.mauna_loa, "__wrapped__"))
+        for loader in [pods.datasets.oil_100, pods.datasets.pumadyn, pods.datasets.mcycle]:
+            self.assertFalse(hasattr(loader, "__wrapped__"))
+
+    def test_parsed_before_permuting(self):
+        """access_tests: Test pumadyn reads its parsed data from the cache but still permutes it with the global random state."""
+        import gzip
+        import io
+        import tarfile
+
+        rows = "\n".join(" ".join(str(i * 34 + j) for j in range(34)) for i in range(7200))
+        member = gzip.compress(rows.encode("ascii"))
+        with tarfile.open(os.path.join(self.serve_dir, "pumadyn-32nm.tar"), "w") as tar:
+            info = tarfile.TarInfo("pumadyn-32nm/Dataset.data.gz")
+            info.size = len(member)
+            tar.addfile(info, io.BytesIO(member))
+        self.add_resource(
+            "pumadyn-32nm", ["pumadyn-32nm.tar"], members=[[["pumadyn-32nm/Dataset.data.gz"]]]
+        )
+        with mock.patch.object(pods.datasets.np, "loadtxt", wraps=np.loadtxt) as loadtxt:
+            np.random.seed(1)
+            first = pods.datasets.pumadyn()
+            np.random.seed(1)
+            second = pods.datasets.pumadyn()
+            np.random.seed(2)
+            third = pods.datasets.pumadyn()
+        self.assertEqual(loadtxt.call_count, 1)
+        np.testing.assert_array_equal(first["X"], second["X"])
+        self.assertFalse(np.array_equal(first["Xtest"], third["Xtest"]))
+        self.assertEqual(first["X"].shape, (7168, 32))
+
+    def test_environment_in_fingerprint(self):
+        """access_tests: Test the parse cache is not used once the modules or libraries the loaders call change."""
+        self.table()
+        environment = dict(pods.access.parse_environment(), numpy="0.0")
+        with mock.patch.object(pods.access, "parse_environment", return_value=environment):
+            self.table()
+        self.assertEqual(self.calls, [1, 1])
+
+    def test_disabled_and_cleared(self):
+        """access_tests: Test the parse cache can be turned off and is removed with the data set."""
+        config = pods.access.config
+        self.addCleanup(config.set, "datasets", "parse_cache", config.get("datasets", "parse_cache"))
+        config.set("datasets", "parse_cache", "False")
+        self.table()
+        self.table()
+        self.assertEqual(self.calls, [1, 1])
+        config.set("datasets", "parse_cache", "True")
+        self.table()
+        parsed = os.path.join(self.cache_dir, "parse_test", pods.access.PARSED_DIR)
+        self.assertTrue(os.path.isdir(parsed))
+        pods.access.clear_cache("parse_test")
+        self.assertFalse(os.path.exists(parsed))
+
+
+class LazyJSONTests(unittest.TestCase):
+    def test_read_on_first_use(self):
+        """access_tests: Test json files are only read when first used."""
+        resources = pods.access.LazyJSON(pods.access.data_resources.filename)
+        self.assertFalse(resources.loaded())
+        self.assertIn("olympic_marathon_men", resources)
+        self.assertTrue(resources.loaded())
+        self.assertEqual(
+            resources["olympic_marathon_men"]["files"],
+            pods.access.data_resources["olympic_marathon_men"]["files"],
+        )
+
+    def test_mutable(self):
+        """access_tests: Test entries can be added to a lazily read dictionary."""
+        resources = pods.access.LazyJSON(pods.access.data_resources.filename)
+        resources["new_entry"] = {"files": []}
+        self.assertEqual(resources["new_entry"], {"files": []})
+        del resources["new_entry"]
+        self.assertNotIn("new_entry", resources)
+
+
+class ImportTests(unittest.TestCase):
+    # Modules that are too slow to import unless a loader needs them.
+    heavy_modules = ["pandas", "scipy", "yaml", "GPy", "pytrends", "geopandas", "netpbmfile"]
+
+    def imported(self, statement):
+        """Run statement in a fresh interpreter and return the modules it imported and how long it took."""
+        script = (
+            "import sys, time\n"
+            "start = time.perf_counter()\n"
+            + statement + "\n"
+            "elapsed = time.perf_counter() - start\n"
+            "print(repr((sorted(sys.modules), elapsed)))\n"
+        )
+        output = subprocess.check_output([sys.executable, "-c", script], cwd=os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+        return ast.literal_eval(output.decode().strip().splitlines()[-1])
+
+    def test_import_budget(self):
+        """access_tests: Test import pods does not import the submodules or their dependencies."""
+        modules, elapsed = self.imported("import pods")
+        for name in ["pods.datasets", "pods.access", "numpy"] + self.heavy_modules:
+            self.assertNotIn(name, modules)
+        self.assertLess(elapsed, 0.5)
+
+    def test_datasets_defer_backends(self):
+        """access_tests: Test pods.datasets only imports optional backends when they are used."""
+        modules, elapsed = self.imported("import pods.datasets")
+        for name in self.heavy_modules:
+            self.assertNotIn(name, modules)
+        modules, elapsed = self.imported("import pods\npods.datasets.pd.DataFrame")
+        self.assertIn("pandas", modules)
+
+
+class RegistryTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.source = os.path.join(self.dir, "resources.json")
+        self.write_source({"first": {"files": [["a"]]}, "second": {"files": [["b"]]}})
+
+    def write_source(self, resources, mtime=None):
+        with open(self.source, "w") as f:
+            json.dump(resources, f)
+        if mtime is not None:
+            os.utime(self.source, (mtime, mtime))
+
+    def test_matches_json(self):
+        """access_tests: Test the compiled registry holds the same entries as data_resources.json."""
+        target = pods.access.compile_registry(
+            pods.access.data_resources.filename, os.path.join(self.dir, "resources.idx")
+        )
+        registry = pods.access.Registry(pods.access.data_resources.filename, target)
+        with open(pods.access.data_resources.filename) as f:
+            resources = json.load(f)
+        self.assertEqual(list(registry), list(resources))
+        self.assertEqual(dict(registry), resources)
+
+    def test_decodes_entries_on_lookup(self):
+        """access_tests: Test entries are only decoded when they are looked up."""
+        pods.access.compile_registry(self.source)
+        registry = pods.access.Registry(self.source)
+        self.assertIn("second", registry)
+        self.assertEqual(registry._entries, {})
+        self.assertEqual(registry["first"], {"files": [["a"]]})
+        self.assertEqual(list(registry._entries), ["first"])
+
+    def test_recompiles_when_source_changes(self):
+        """access_tests: Test the compiled registry is rebuilt when the json file changes."""
+        registry = pods.access.Registry(self.source)
+        self.assertEqual(len(registry), 2)
+        self.assertTrue(os.path.exists(registry.compiled))
+        self.write_source({"third": {"files": []}}, mtime=os.path.getmtime(self.source) + 10)
+        registry = pods.access.Registry(self.source)
+        self.assertEqual(list(registry), ["third"])
+
+    def test_installed_without_mtimes(self):
+        """access_tests: Test the compiled registry is used when only the json file's modification time has changed."""
+        pods.access.compile_registry(self.source)
+        os.utime(self.source, (1, 1))
+        with mock.patch.object(pods.access, "compile_registry", side_effect=AssertionError("compiled again")):
+            registry = pods.access.Registry(self.source)
+            self.assertEqual(list(registry), ["first", "second"])
+        self.assertEqual(registry._entries, {})
+
+    def test_shipped_registry_current(self):
+        """access_tests: Test the compiled registry shipped with pods was compiled from data_resources.json."""
+        registry = pods.access.Registry(pods.access.data_resources.filename)
+        with mock.patch.object(pods.access, "compile_registry", side_effect=AssertionError("compiled again")):
+            self.assertIn("olympic_marathon_men", registry)
+
+    def test_read_only(self):
+        """access_tests: Test the json file is parsed when the registry can't be compiled."""
+        registry = pods.access.Registry(self.source, os.path.join(self.dir, "missing", "resources.idx"))
+        self.assertEqual(registry["second"], {"files": [["b"]]})
+        self.assertFalse(os.path.exists(registry.compiled))
+
+    def test_mutable(self):
+        """access_tests: Test entries of the registry can be changed."""
+        registry = pods.access.Registry(self.source)
+        with mock.patch.dict(registry, {"third": {"files": []}}):
+            del registry["first"]
+            self.assertEqual(list(registry), ["second", "third"])
+        self.assertEqual(list(registry), ["first", "second"])
+        self.assertEqual(registry["first"], {"files": [["a"]]})
+        self.assertRaises(KeyError, registry.__getitem__, "third")
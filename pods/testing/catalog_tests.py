@@ -0,0 +1,101 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+import numpy as np
+
+import pods
+
+
+class CatalogTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, "catalog.json")
+        self.cache_dir = os.path.join(self.dir, "cache")
+        patches = [
+            mock.patch.object(pods.catalog, "index_path", return_value=self.path),
+            mock.patch.object(pods.catalog, "_index", None),
+            mock.patch.object(pods.access, "DATAPATH", self.cache_dir),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_loaders(self):
+        """catalog_tests: Test the loaders and the keys they return are read from the source of pods.datasets."""
+        loaders = pods.catalog.loaders()
+        self.assertEqual(loaders["olympic_marathon_men"]["data_set"], "olympic_marathon_men")
+        self.assertEqual(loaders["olympic_marathon_men"]["keys"], ["X", "Y", "covariates", "response"])
+        self.assertFalse(loaders["olympic_marathon_men"]["needs_arguments"])
+        self.assertEqual(loaders["olympic_sprints"]["data_set"], "rogers_girolami_data")
+        self.assertTrue(loaders["cmu_mocap"]["needs_arguments"])
+        # Defined only when netpbmfile is installed.
+        self.assertIn("olivetti_faces", loaders)
+        self.assertNotIn("download_data", loaders)
+
+    def test_search(self):
+        """catalog_tests: Test searching the catalog by size, task and keys."""
+        found = pods.catalog.search(max_size="1K", task="supervised")
+        names = [entry["name"] for entry in found]
+        self.assertIn("olympic_marathon_men", names)
+        self.assertEqual(names, sorted(names))
+        for entry in found:
+            self.assertLessEqual(entry["size"], 1024)
+            self.assertIn("X", entry["keys"])
+            self.assertIn("Y", entry["keys"])
+        for entry in pods.catalog.search(keys=["Xtest", "Ytest"]):
+            self.assertIn("Xtest", entry["keys"])
+        self.assertEqual(
+            [entry["name"] for entry in pods.catalog.search(query="MARATHON")], ["olympic_marathon_men"]
+        )
+        self.assertRaises(ValueError, pods.catalog.search, task="clustering")
+
+    def test_index_rebuilt(self):
+        """catalog_tests: Test the shipped index is used, and built again into the data cache when its sources change."""
+        index = pods.catalog.build_index()
+        self.assertIn("olympic_marathon_men", index["entries"])
+
+        index["entries"] = {}
+        with open(self.path, "w") as f:
+            json.dump(index, f)
+        self.assertEqual(pods.catalog.entries(), {})
+
+        index["sources"]["datasets.py"] = "0" * 64
+        index["entries"] = {"olympic_marathon_men": {"keys": ["X", "Y", "covariates", "response"], "shapes": {"X": [27, 1]}}}
+        with open(self.path, "w") as f:
+            json.dump(index, f)
+        pods.catalog._index = None
+        entries = pods.catalog.entries()
+        self.assertEqual(entries["olympic_marathon_men"]["shapes"], {"X": [27, 1]})
+        self.assertTrue(os.path.exists(pods.catalog.cached_index_path()))
+        with open(self.path) as f:
+            self.assertEqual(json.load(f)["sources"]["datasets.py"], "0" * 64)
+
+    def test_shipped_index_current(self):
+        """catalog_tests: Test the index shipped with pods was built from the current sources."""
+        index = pods.catalog.read_index(os.path.join(os.path.dirname(pods.catalog.__file__), "catalog.json"))
+        self.assertIsNotNone(index)
+        self.assertEqual(index["sources"], pods.catalog.source_digests())
+
+    def test_shapes(self):
+        """catalog_tests: Test the shapes of what loaders return are recorded and kept."""
+        self.assertEqual(
+            pods.catalog.shapes({"X": np.zeros((3, 2)), "info": "text", "covariates": ["a", "b"]}),
+            {"X": [3, 2]},
+        )
+        with mock.patch.object(
+            pods.access, "data_available", side_effect=lambda name: name == "olympic_marathon_men"
+        ), mock.patch.object(pods.catalog, "run_loader", return_value={"X": [27, 1], "Y": [27, 1]}) as run:
+            index = pods.catalog.build_index(load=True)
+        run.assert_called_once_with("olympic_marathon_men")
+        self.assertEqual(index["entries"]["olympic_marathon_men"]["shapes"], {"X": [27, 1], "Y": [27, 1]})
+
+        index = pods.catalog.build_index(previous=index)
+        self.assertEqual(index["entries"]["olympic_marathon_men"]["shapes"], {"X": [27, 1], "Y": [27, 1]})
+        found = pods.catalog.search(where=lambda entry: entry["shapes"].get("X", [0])[0] == 27)
+        self.assertEqual([entry["name"] for entry in found], ["olympic_marathon_men"])
+
@@ -26,6 +26,7 @@ dataset_helpers = [
     "integer",
     "json_object",
     "list",
+    "load_async",
     "urlopen",
     "prompt_user",
     "cmu_mocap",
@@ -1,9 +1,44 @@
 import datetime
+import importlib
+import importlib.util
+import types
 import numpy as np
-import pandas as pd
 
 import json
 
+
+class LazyModule(types.ModuleType):
+    """A stand in for a module that imports it the first time one of its attributes is used.
+
+    :param name: the module to import, e.g. "scipy.io". The proxy stands for the top level package, so that scipy.io.loadmat works as usual."""
+    def __init__(self, name):
+        super(LazyModule, self).__init__(name.split(".")[0])
+        self._import_name = name
+
+    def __getattr__(self, attr):
+        if attr.startswith("__"):
+            raise AttributeError(attr)
+        importlib.import_module(self._import_name)
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+
+def lazy_import(name):
+    """Return a module that is only imported when it is first used."""
+    return LazyModule(name)
+
+
+def module_available(name):
+    """Check whether a module can be imported without importing it."""
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+pd = lazy_import("pandas")
+
 # Some general utilities.
 PERMUTE_DATA = True
 def permute(num):
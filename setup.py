@@ -9,6 +9,12 @@ def get_version_from_toml(file_path='pyproject.toml'):
     return data['tool']['poetry']['version']
 
 
+def build_indexes():
+    """Compile the data resources and build the catalog, with the shapes of the data sets cached here, so they are shipped."""
+    os.system("pods-compile-registry")
+    os.system("pods-build-catalog --shapes")
+
+
 if __name__ == "__main__":
     print("This project has transitioned to using Poetry for package management.")
     print("setup.py is now just a wrapper for backwards compatibility.")    
@@ -21,9 +27,11 @@ if __name__ == "__main__":
         os.system("poetry install")
     elif "build" in sys.argv:
         print("Emulating setup.py with poetry. Try running poetry build instead.")
+        build_indexes()
         os.system("poetry build")
     elif "upload" in sys.argv:
         print("Using twine to publish. Please consider switching to using poetry.")
+        build_indexes()
         os.system("poetry build")
         os.system("twine upload dist/*")
         print("Pushing git tags.")
@@ -74,11 +82,15 @@ EXTRAS = {
     "Olivetti Faces": ["netpbmfile"],
 }
 
-PACKAGE_DATA = {"pods": ["defaults.cfg", "data_resources.json", "football_teams.json"]}
+PACKAGE_DATA = {"pods": ["defaults.cfg", "data_resources.json", "data_resources.idx", "catalog.json", "football_teams.json"]}
 
 DEPENDENCY_LINKS = []
 
-CONSOLE_SCRIPTS = []
+CONSOLE_SCRIPTS = [
+    "pods-verify-cache=pods.access:verify_cache_main",
+    "pods-compile-registry=pods.access:compile_registry_main",
+    "pods-build-catalog=pods.catalog:build_index_main",
+]
 ENTRY_POINTS = {
     "console_scripts": CONSOLE_SCRIPTS,
 }